@@ -52,7 +52,7 @@ sql = checkAddr("Ouray")
 addrs = sql.getAddresses()
 for house in addrs:
     for road in sql.find_road(house):
-        name = road['road.name']
+        name = road['name']
         matched = False
         if name == house['addr:street'] or name == road['ref']:
             matched = True
@@ -56,6 +56,7 @@ class myconfig(object):
         self.options['logging'] = True
         self.options['dump'] = False
         self.options['verbose'] = False
+        self.options['namecache'] = False
         self.options['infile'] = os.path.dirname(argv[0])
         self.options['outfile'] = "./out.osm"
         self.options['convfile'] = os.path.dirname(argv[0]) + "/default.conv"
@@ -64,7 +65,7 @@ class myconfig(object):
 
         try:
             (opts, val) = getopt.getopt(argv[1:], "h,o:,i:,v,",
-                ["help", "outfile", "infile", "verbose"])
+                ["help", "outfile", "infile", "verbose", "name-cache="])
         except getopt.GetoptError as e:
             logging.error('%r' % e)
             self.usage(argv)
@@ -77,6 +78,8 @@ class myconfig(object):
                 self.options['outfile'] = val
             elif opt == "--infile" or opt == '-i':
                 self.options['infile'] = val
+            elif opt == "--name-cache":
+                self.options['namecache'] = val
             elif opt == "--verbose" or opt == '-v':
                 self.options['verbose'] = True
                 logging.basicConfig(filename='shp2map.log',level=logging.DEBUG)
@@ -126,6 +129,7 @@ class myconfig(object):
 \t--outfile(-o)   Output file name
 \t--infile(-i)    Input file name
 \t--verbose(-v)   Enable verbosity
+\t--name-cache    Keep corrected names in this file between runs
         """)
         quit()
 
@@ -176,7 +180,7 @@ tag = dict()
 doc = etree.parse(infile)
 members = list()
 modified = False
-fix = correct.correct()
+fix = correct.correct(dd.get('namecache'))
 
 for docit in doc.getiterator():
     #print("TAG: %r" % docit.tag)
@@ -191,10 +195,7 @@ for docit in doc.getiterator():
                     k = value
                 elif ref == 'v':
                     if k == 'addr:street' or k == 'addr:city' or k == 'addr:full':
-                        newvalue = fix.alphaNumeric(value)
-                        newvalue = fix.abbreviation(newvalue)
-                        if len(newvalue) > 0:
-                            newvalue = fix.compass(newvalue)
+                        newvalue = fix.normalize(value)
                         newvalue = string.capwords(newvalue)
                     else:
                         newvalue = value
@@ -229,9 +230,7 @@ for docit in doc.getiterator():
                     continue
                 elif ref == 'v':
                     if k == 'addr:street' or k == 'name' or k == 'alt_name'  or k == 'addr:city' or k == 'addr:full':
-                        newvalue = fix.alphaNumeric(value)
-                        newvalue = fix.abbreviation(newvalue)
-                        newvalue = fix.compass(newvalue)
+                        newvalue = fix.normalize(value)
                         newvalue = string.capwords(newvalue)
                     else:
                         newvalue = value
@@ -289,3 +288,4 @@ for docit in doc.getiterator():
         osmout.makeRelation(members, tags, attrs)
 
 osmout.footer()
+fix.close()
@@ -26,18 +26,24 @@ import logging
 import getopt
 import epdb
 import re
-from fastkml import kml, styles
 from osgeo import ogr
 #import shapely.wkt
 from shapely.geometry import Point, LineString, Polygon, MultiPoint, MultiPolygon, mapping
 import zipfile
+import tempfile
+import concurrent.futures
 import numpy as np
 
 from sys import argv
 sys.path.append(os.path.dirname(argv[0]) + '/osmpylib')
 from color import MapStyle
+from kmlwriter import kmlWriter
+from kmz import iconTable, packageAll, LEVEL
+import lod
 from poly import Poly
 from sql import Postgis
+from querycache import queryCache
+from querystats import queryStats
 from osm import OverpassXAPI, osmConvert
 
 
@@ -62,10 +68,19 @@ class myconfig(object):
         self.options['remote'] = None
         self.options['infile'] = None
         self.options['outfile'] = "./out.kml"
+        self.options['jobs'] = 1
+        self.options['cache'] = True
+        self.options['stats'] = False
+        self.options['statsjson'] = None
+        self.options['slow'] = None
+        self.options['html'] = False
+        self.options['compress'] = LEVEL
+        self.options['lod'] = False
+        self.options['precision'] = lod.PRECISION
 
         try:
-            (opts, val) = getopt.getopt(argv[1:], "h,o:,s:,p:,t:,v,d:,r:,x,i:",
-                ["help", "outfile", "subset", "poly", "title", "verbose", "database", "remote", "xapi", "infile"])
+            (opts, val) = getopt.getopt(argv[1:], "h,o:,s:,p:,t:,v,d:,r:,x,i:,j:",
+                ["help", "outfile", "subset", "poly", "title", "verbose", "database", "remote", "xapi", "infile", "jobs=", "no-cache", "stats", "stats-json=", "slow=", "html", "compress=", "lod", "precision="])
         except getopt.GetoptError as e:
             logging.error('%r' % e)
             self.usage(argv)
@@ -90,6 +105,26 @@ class myconfig(object):
                 self.options['database'] = val
             elif opt == "--remote" or opt == '-r':
                 self.options['remote'] = val
+            elif opt == "--jobs" or opt == '-j':
+                self.options['jobs'] = int(val)
+            elif opt == "--no-cache":
+                self.options['cache'] = False
+            elif opt == "--stats":
+                self.options['stats'] = True
+            elif opt == "--stats-json":
+                self.options['stats'] = True
+                self.options['statsjson'] = val
+            elif opt == "--slow":
+                self.options['stats'] = True
+                self.options['slow'] = float(val)
+            elif opt == "--compress":
+                self.options['compress'] = int(val)
+            elif opt == "--lod":
+                self.options['lod'] = True
+            elif opt == "--precision":
+                self.options['precision'] = int(val)
+            elif opt == "--html":
+                self.options['html'] = True
             elif opt == "--verbose" or opt == '-v':
                 self.options['verbose'] = True
                 logging.basicConfig(filename='osm2kml.log',level=logging.DEBUG)
@@ -162,6 +197,15 @@ class myconfig(object):
 \t--database(-d)  Database to Use
 \t--remote(-r)    Database Server to Use (default localhost)
 \t--xapi(-x)      Download OSM data only
+\t--jobs(-j)      Number of subsets to extract at once (default 1)
+\t--no-cache      Don't use the query results cached in ~/.cache/osmtools
+\t--stats         Print the time, rows, and bytes for each query
+\t--stats-json    Write the query statistics to this JSON file
+\t--slow          Explain the queries that take more than this many seconds
+\t--html          Put the tags in HTML descriptions instead of ExtendedData
+\t--compress      Compression level for the KMZ files, 0-9 (default 6)
+\t--lod           Simplify lines and polygons for each zoom level
+\t--precision     Decimal places for the coordinates with --lod (default 6)
 \t--verbose(-v)   Enable verbosity
 
 Either an input file in osm xml format or a database name. If both are supplied,
@@ -201,7 +245,14 @@ dbname = dd.get('database')
 
 kmz=outfile.replace(".kml", ".kmz")
 
-post = Postgis()
+# The results of each query are cached until the next import
+cache = None
+if dd.get('cache') is True:
+    cache = queryCache()
+stats = None
+if dd.get('stats') is True:
+    stats = queryStats(dd.get('slow'))
+post = Postgis(cache=cache, stats=stats)
 if dd.get('poly') is not None:
     polyfilter = Poly(poly)
     wkt = polyfilter.getWkt()
@@ -235,17 +286,27 @@ print("------------------------")
 #print(len(rr))
 
 
-# Create KML file
-kmlfile = kml.KML()
-ns = '{http://www.opengis.net/kml/2.2}'
-mapstyle = MapStyle("ns='{http://www.opengis.net/kml/2.2}'")
-mstyle = mapstyle.getStyles()
-kmldoc = kml.Document(ns, 'docid', title, 'doc description')
-# kmldoc = kml.Document(ns, 'docid', title, 'doc description', styles=mstyle)
-kmlfile.append(kmldoc)
+# Create KML file. The Document is written as soon as the subsets are
+# done, each subset is written to a temporary file first. Icons that
+# are copies of another are only used once.
+icons = iconTable()
+# The KML files to put in KMZ files when they're all written, as
+# (kmlfile, icons, level)
+packages = list()
+
+# With level of detail, the lines and polygons are simplified for each
+# zoom level, and viewers only draw the one that fits.
+detail = None
+if dd.get('lod') is True:
+    if lod.simplify is None:
+        logging.error("Level of detail needs shapely 2, so it won't be used")
+    else:
+        detail = lod.levelOfDetail(precision=dd.get('precision'))
 
-# Connect to database
-post.connect('localhost', dbname)
+# Connect to database. With more than one job, each subset is extracted
+# on a connection of it's own, so they all run at the same time.
+jobs = int(dd.get('jobs'))
+post.connect('localhost', dbname, jobs)
 
 # Get all of the cities and towns in the database. As some datasets
 # (like fire_hydrants) are large, and at some zoom levels obscure
@@ -256,174 +317,166 @@ counties = post.getPlaces(6)
 
 parks = post.getProtected()
 
+# Each subset is a function that gets the data using the session it's
+# given, and writes it's folders with the kmlWriter it's given, as the
+# features arrive. Roads and addresses are written to files of their
+# own. MapStyle keeps the last style it made, so each subset has it's
+# own.
+
+
+def placemark(out, subset, data, name, style, geom):
+    """Write a Placemark, with the tags in ExtendedData, or in the HTML
+    description MapStyle made"""
+    if dd.get('html') is True:
+        out.placemark(data['osm_id'], name, style[1], style[0], geom, subset)
+    else:
+        out.placemark(data['osm_id'], name, None, style[0], geom, subset, data)
+
 #
 # Hiking Trails
 #
-if dd.get('trails') is True:
+def trails(db, mapstyle, out):
     logging.info("Downloading trails for %s" % title)
-    trailfolder = kml.Folder(ns, 0, 'Hiking Trails')
-    # cache the trails we find in the area, so when we use
-    # the county polygon, we don't create a duplicate LineString.
-    cache = dict()
-    areas = list()
-    areas = parks
-    areas += counties
+    # All the trails come from one query, each in the first area
+    # it's in, so a trail in a park isn't also in the county.
+    areas = [place for place in parks + counties if place['name'] is not None]
     if len(areas) > 0:
-        kmldoc.append(trailfolder)
-        for place in areas:
-            if place['name'] is None:
-                continue
-            tmp = place['wkb_geometry'][0]
-            trails = post.getTrails(tmp)
-            logging.debug("FIXME trails: %d: %s" % (len(trails), place['name']))
-            if trails is None or len(trails) == 0:
-                continue
-            newfolder = kml.Folder(ns, 0, '%s Trails' % place['name'])
-            trailfolder.append(newfolder)
-            for trail in trails:
-                if trail['name'] is None:
-                    description = """OSM_ID: %s
-                    FIXME: this needs the real name!
-                    """ % trail['osm_id']
-                    trail['name'] = "Unknown: " + trail['osm_id']
-                else:
-                    description = trail['name']
-                    style = mapstyle.trails(trail)
-                    pm = kml.Placemark(ns, trail['osm_id'], trail['name'], style[1], styles=[style[0]])
-                    way = trail['wkb_geometry']
-                    pm.geometry =  LineString(way.geoms[0])
-                    newfolder.append(pm)
+        out.folder('Hiking Trails')
+        area = None
+        for trail in db.getGrouped('trails', [place['wkb_geometry'].geoms[0] for place in areas], stream=True):
+            # Only make a folder for the areas that have trails
+            if trail['area'] != area:
+                if area is not None:
+                    out.endFolder()
+                area = trail['area']
+                out.folder('%s Trails' % areas[area]['name'])
+            if trail['name'] is None:
+                description = """OSM_ID: %s
+                FIXME: this needs the real name!
+                """ % trail['osm_id']
+                trail['name'] = "Unknown: %s" % trail['osm_id']
+            else:
+                description = trail['name']
+                style = mapstyle.trails(trail)
+                way = trail['wkb_geometry']
+                placemark(out, 'trails', trail, trail['name'], style, LineString(way.geoms[0]))
+        if area is not None:
+            out.endFolder()
+        out.endFolder()
 
 #
 # Mile Markers
 #
-if dd.get('milestones') is True:
+def milestones(db, mapstyle, out):
     logging.info("Downloading mile stones for %s" % title)
-    stones = post.getMilestones()
+    stones = db.getMilestones()
     logging.debug("FIXME stones: %d" % (len(stones)))
     if stones is not None and len(stones) > 0:
-        milefolder = kml.Folder(ns, 0, 'Mile Markers', 'Mile markers in ' + title)
-        kmldoc.append(milefolder)
+        out.folder('Mile Markers', 'Mile markers in ' + title)
         for mark in stones:
             num = mark['name']
             street = "mark['alt_name']"
 
             style = mapstyle.milestones(mark)
-            pm = kml.Placemark(ns, mark['osm_id'], num, style[1], styles=[style[0]])
             way = mark['wkb_geometry']
-            pm.geometry =  Point(way.geoms[0])
-            milefolder.append(pm)
+            placemark(out, 'milestones', mark, num, style, Point(way.geoms[0]))
+        out.endFolder()
 
 #
 # Landing Site
 #
-if dd.get('landingsite') is True:
+def landingsite(db, mapstyle, out):
     logging.info("Downloading landing zones for %s" % title)
-    lzs = post.getLandingZones()
+    lzs = db.getLandingZones()
     if lzs is not None and len(lzs) > 0:
-        lzfolder = kml.Folder(ns, 0, 'Landing Sites', 'Landing Sites in ' + title)
-        kmldoc.append(lzfolder)
+        out.folder('Landing Sites', 'Landing Sites in ' + title)
         for lz in lzs:
             style = mapstyle.landingzones(lz)
-            pm = kml.Placemark(ns, lz['osm_id'], lz['name'], style[1], styles=[style[0]])
             way = lz['wkb_geometry']
-            pm.geometry =  Point(way.geoms[0])
-            lzfolder.append(pm)
+            placemark(out, 'landingsite', lz, lz['name'], style, Point(way.geoms[0]))
+        out.endFolder()
     else:
         logging.warning("No landing sites in this database")
 
 #
 # Hot Spring
 #
-if dd.get('hotsprings') is True:
+def hotsprings(db, mapstyle, out):
     logging.info("Downloading Hot Springs for %s" % title)
-    hsprings = post.getHotSprings()
+    hsprings = db.getHotSprings()
     if hsprings is not None and len(hsprings) > 0:
-        f = kml.Folder(ns, 0, 'Hot Springs')
-        kmldoc.append(f)
+        out.folder('Hot Springs')
         for hs in hsprings:
             style = mapstyle.hotsprings(hs)
-            p = kml.Placemark(ns, hs['osm_id'], hs['name'], style[1], styles=[style[0]])
             way = hs['wkb_geometry']
-            p.geometry = Point(way.geoms[0])
-            f.append(p)
+            placemark(out, 'hotsprings', hs, hs['name'], style, Point(way.geoms[0]))
+        out.endFolder()
 
 #
 # Water Sources
 #
-if dd.get('firewater') is True:
+def firewater(db, mapstyle, out):
     logging.info("Downloading Fire Water Sources for %s" % title)
-    f = kml.Folder(ns, 0, 'Fire Water Sources')
-    # cache the water sources we find in the place, so when we use
-    # the county polygon, we don't create a duplicate Placemark.
-    cache = dict()
+    # Only the cities, towns, and counties get a folder
     areas = list()
-    areas = places
-    areas += counties
-    if len(areas) > 0:
-        kmldoc.append(f)
-        for place in areas:
-            if 'osm_way_id' in place and place['osm_id'] is None:
-                place['osm_id'] = place['osm_way_id']
-            if place['place'] is None:
-                if int(place['admin_level']) != 6:
-                    logging.warning("%s is missing the place tag, so will be ignored" % place['name'])
-                    continue
-            elif place['place'] != 'city' and place['place'] != 'town' and place['name'] is not None:
-                continue
-            water = post.getFireWater(place['wkb_geometry'])
-            if water is None:
+    names = set()
+    for place in places + counties:
+        if 'osm_way_id' in place and place['osm_id'] is None:
+            place['osm_id'] = place['osm_way_id']
+        if place['place'] is None:
+            if int(place['admin_level']) != 6:
+                logging.warning("%s is missing the place tag, so will be ignored" % place['name'])
                 continue
-            if len(water) == 0:
-                continue
-            # gging.debug("FIXME: %d in %s" % (len(water), place['name']))
-            if place['name'] in cache:
-                continue
-            else:
-                cache[place['name']] = place
-            if len(water) > 0:
-                nf = kml.Folder(ns, 0, '%s Water Sources' % place['name'])
-                f.append(nf)
-                for source in water:
-                    if source['osm_id'] in cache:
-                        continue
-                    if 'name' not in source:
-                        if 'ref' in source:
-                            source['name'] = source['ref']
-                        else:
-                            source['name'] = "Unknown"
-                    way = source['wkb_geometry']
-                    cache[source['osm_id']] = source
-                    style = mapstyle.firewater(source)
-                    p = kml.Placemark(ns, source['osm_id'], source['name'], style[1], styles=[style[0]])
-                    p.geometry = Point(way.geoms[0])
-                    nf.append(p)
+        elif place['place'] != 'city' and place['place'] != 'town' and place['name'] is not None:
+            continue
+        if place['name'] in names:
+            continue
+        names.add(place['name'])
+        areas.append(place)
+    if len(areas) > 0:
+        out.folder('Fire Water Sources')
+        # All the water sources come from one query, each in the first
+        # place it's in, so a source in a town isn't also in the county.
+        area = None
+        for source in db.getGrouped('firewater', [place['wkb_geometry'].geoms[0] for place in areas], stream=True):
+            if source['area'] != area:
+                if area is not None:
+                    out.endFolder()
+                area = source['area']
+                out.folder('%s Water Sources' % areas[area]['name'])
+            if source['name'] is None:
+                if source['ref'] is not None:
+                    source['name'] = source['ref']
+                else:
+                    source['name'] = "Unknown"
+            way = source['wkb_geometry']
+            style = mapstyle.firewater(source)
+            placemark(out, 'firewater', source, source['name'], style, Point(way.geoms[0]))
+        if area is not None:
+            out.endFolder()
+        out.endFolder()
 
 #
 # Campgrounds and camp sites
 #
-if dd.get('camps') is True:
+def camps(db, mapstyle, out):
     logging.info("Downloading Camping for %s" % title)
-    camps = post.getCampGrounds()
+    camps = db.getCampGrounds()
     logging.debug("FIXME camps: %d" % len(camps))
     if camps is not None and len(camps) > 0:
-        f = kml.Folder(ns, 0, 'Campgrounds')
-        kmldoc.append(f)
+        out.folder('Campgrounds')
         for camp in camps:
             if 'name' not in camp:
                 if 'ref' in camp:
                     camp['name'] = camp['ref']
-            nf = kml.Folder(ns, 0, camp['name'])
-            f.append(nf)
+            out.folder(camp['name'])
             way = camp['wkb_geometry']
             for g in way.geoms:
                 # FIXME: do we care ?
                 if g.geom_type == 'Polygon':
                     style = mapstyle.campground(camp)
-                    p = kml.Placemark(ns, camp['osm_id'], camp['name'], style[1], styles=[style[0]])
-                    p.geometry = Polygon(g)
                     # continue
-                sites = post.getCampSites(way[0])
+                sites = db.getCampSites(way.geoms[0])
                 if sites is None:
                     continue
                 for site in sites:
@@ -431,37 +484,26 @@ if dd.get('camps') is True:
                         style = mapstyle.campsite(site, site['name'])
                     else:
                         style = mapstyle.campsite(camp, site['name'])
-                    p = kml.Placemark(ns, site['osm_id'], site['name'], style[1], styles=[style[0]])
-                    p.geometry = site['wkb_geometry'][0]
-                    nf.append(p)
-
-
-outkml = open(outfile, 'w')
-outkml.write(kmlfile.to_string(prettyprint=True))
-outkml.close()
-
-# Add icons to main KMZ file
-kmz = outfile.replace(".kml", ".kmz")
-zip = zipfile.ZipFile(kmz, mode="w")
-x = np.array(mapstyle.getIcons())
-for icon in np.unique(x):
-    zip.write(icon)
-zip.write(outfile)
-
-logging.info("Wrote %s" % outfile)
+                    placemark(out, 'campsites', site, site['name'], style, site['wkb_geometry'].geoms[0])
+            out.endFolder()
+        out.endFolder()
 
 #
 # Roads go in a separate file
 #
-if dd.get('roads') is True:
+def roads(db, mapstyle, out):
     logging.info("Downloading roads for %s" % title)
-    roads = post.getRoads()
+    # There can be hundreds of thousands of roads, so they're
+    # streamed from the database, and written as they arrive.
+    roads = db.getRoads(stream=True)
     if roads is not None:
-        logging.info("%d roads, putting in separate file %s" % (len(roads), os.path.basename(outfile)))
-        kmlfile = kml.KML()
-        roaddoc = kml.Document(ns, 'docid', title, 'doc description')
-        # roaddoc = kml.Document(ns, 'docid', title, 'doc description', styles=mstyle)
-        kmlfile.append(roaddoc)
+        kmlout = outfile
+        if outfile.find("Road") < 0 and outfile.find("Trail") < 0:
+            kmlout = outfile.replace(".kml", "-Roads.kml")
+        logging.info("Putting roads in separate file %s" % os.path.basename(kmlout))
+        count = 0
+        roaddoc = kmlWriter(kmlout, icons=icons, lod=detail)
+        roaddoc.header(title, 'doc description')
 
         for road in roads:
             if 'service' in road:
@@ -474,85 +516,102 @@ if dd.get('roads') is True:
                     description = """OSM_ID: %s
                     FIXME: this needs the real name!
                     """ % road['osm_id']
-                    road['name'] = "Unknown: " + road['osm_id']
+                    road['name'] = "Unknown: %s" % road['osm_id']
                 else:
                     description = road['name']
 
             style = mapstyle.roads(road)
-            pm = kml.Placemark(ns, road['osm_id'], road['name'], style[1], styles=[style[0]])
             way = road['wkb_geometry']
-            pm.geometry =  LineString(way.geoms[0])
-            roaddoc.append(pm)
-
-        if len(roads) > 0:
-            # Write the KML file
-            kmlout = outfile
-            if outfile.find("Road") < 0 and outfile.find("Trail") < 0:
-                kmlout = outfile.replace(".kml", "-Roads.kml")
-                roadout = open(kmlout, 'w+')
-            else:
-                roadout = open(outfile, 'w+')
-            roadout.write(kmlfile.to_string(prettyprint=True))
-            roadout.close()
-            # Write the KMZ file. Roads have no icons of course
-            kmz = kmlout.replace(".kml", ".kmz")
-            zip = zipfile.ZipFile(kmz, mode="w")
-            zip.write(kmlout)
-            logging.info("Wrote %s" % kmz)
+            placemark(roaddoc, 'roads', road, road['name'], style, LineString(way.geoms[0]))
+            count += 1
+
+        roaddoc.footer()
+        logging.info("%d roads" % count)
+        if count > 0:
+            # Roads have no icons of course
+            packages.append((kmlout, roaddoc.styles.iconFiles(), dd.get('compress')))
+        else:
+            os.remove(kmlout)
 
 #
 # House Addresses
 #
-if dd.get('addresses') is True:
+def addresses(db, mapstyle, out):
     logging.info("Downloading addresses for %s" % title)
-    # logging.info("%d address, putting in separate file %s-addresses.kml" % (len(addrs), dbname))
-    kmlfile = kml.KML()
-    # doc = kml.Document(ns, 'docid', title, 'doc description', styles=mstyle)
-    addrdoc = kml.Document(ns, 'docid', title + " Addresses", 'doc description')
-    kmlfile.append(addrdoc)
-    cache = dict()
-    areas = list()
-    areas = places
-    areas += counties
-    addrs = list()
-    if len(areas) > 0:
-        for place in areas:
-            if 'tourism' in place:
-                continue
-            addrs = post.getAddresses(place['wkb_geometry'][0])
-            if addrs is None or len(addrs) == 0:
-                logging.debug("%s has no addresses" % place['name'])
-                continue
-            af = kml.Folder(ns, 0, place['name'] + ' Addresses')
-            addrdoc.append(af)
-            for addr in addrs:
-                style = mapstyle.addresses(addr)
-                if  addr['addr_street'] is None:
-                     addr['addr_street'] = ""
-                pm = kml.Placemark(ns, addr['osm_id'], addr['addr_housenumber'] + " " + addr['addr_street'], style[1], styles=[style[0]])
-                way = addr['wkb_geometry']
-                pm.geometry =  Point(way.geoms[0])
-                af.append(pm)
-
-    if len(addrs) > 0:
-        # Write the KML file
-        addrkml = outfile
-        if outfile.find("Road") < 0 and outfile.find("Trail") < 0:
-            addrkml = outfile.replace(".kml", "-Addresses.kml")
-            addrout = open(addrkml, 'w')
-        else:
-            addrout = open(outfile, 'w')
-        addrout.write(kmlfile.to_string(prettyprint=True))
-        addrout.close()
-        # Write the KMZ file
-        kmz = addrkml.replace(".kml", ".kmz")
-        zip = zipfile.ZipFile(kmz, mode="w")
-        x = np.array(mapstyle.getIcons())
-        for icon in np.unique(x):
-            zip.write(icon)
-        zip.write(addrkml)
-
-        logging.info("Wrote %s" % kmz)
+    addrkml = outfile
+    if outfile.find("Road") < 0 and outfile.find("Trail") < 0:
+        addrkml = outfile.replace(".kml", "-Addresses.kml")
+    addrdoc = kmlWriter(addrkml, icons=icons, lod=detail)
+    addrdoc.header(title + " Addresses", 'doc description')
+    # All the addresses come from one query, each in the first place
+    # it's in, so an address in a town isn't also in the county.
+    areas = [place for place in places + counties if 'tourism' not in place]
+    count = 0
+    area = None
+    for addr in db.getGrouped('addresses', [place['wkb_geometry'].geoms[0] for place in areas], stream=True):
+        if addr['area'] != area:
+            if area is not None:
+                addrdoc.endFolder()
+            area = addr['area']
+            addrdoc.folder(areas[area]['name'] + ' Addresses')
+        count += 1
+        style = mapstyle.addresses(addr)
+        if  addr['addr_street'] is None:
+             addr['addr_street'] = ""
+        way = addr['wkb_geometry']
+        placemark(addrdoc, 'addresses', addr, addr['addr_housenumber'] + " " + addr['addr_street'], style, Point(way.geoms[0]))
+    addrdoc.footer()
+
+    if count > 0:
+        packages.append((addrkml, addrdoc.styles.iconFiles(), dd.get('compress')))
+    else:
+        os.remove(addrkml)
+
+
+def extract(subset, doc):
+    """Run a subset on a session of it's own, and return the KML it
+    wrote. The styles and schemas are shared with the Document it
+    goes in."""
+    db = post.session()
+    style = MapStyle("ns='{http://www.opengis.net/kml/2.2}'")
+    out = kmlWriter(tempfile.TemporaryFile(), depth=2, styles=doc.styles, schemas=doc.schemas, lod=doc.lod)
+    try:
+        subset(db, style, out)
+        return out
+    finally:
+        db.release()
+
+# The folders go in the KML file in this order, whichever subset
+# finishes first.
+subsets = [trails, milestones, landingsite, hotsprings, firewater, camps, roads, addresses]
+subsets = [subset for subset in subsets if dd.get(subset.__name__) is True]
+kmldoc = kmlWriter(outfile, icons=icons, lod=detail)
+kmldoc.header(title, 'doc description')
+with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    futures = [executor.submit(extract, subset, kmldoc) for subset in subsets]
+    for future in futures:
+        out = future.result()
+        kmldoc.include(out)
+        out.file.close()
+kmldoc.footer()
+logging.info("Wrote %s" % outfile)
+post.close()
+
+# The main KMZ file has the icons used by all the subsets. Each KMZ
+# file is compressed in a process of it's own.
+packages.insert(0, (outfile, kmldoc.styles.iconFiles(), dd.get('compress')))
+packageAll(packages)
+if icons.duplicates > 0:
+    logging.info("%d icons were copies of another" % icons.duplicates)
+if detail is not None:
+    detail.summary()
+
+if stats is not None:
+    if dd.get('statsjson') is not None:
+        stats.dump(dd.get('statsjson'))
+    else:
+        stats.summary()
+
 #    else:
 #        os.remove(top + dbname + '/' + dbname + "-Addresses.kmz")
 
@@ -43,6 +43,8 @@ class config(object):
         self.options['type'] = "line"
         self.options['dump'] = False
         self.options['verbose'] = False
+        self.options['jobs'] = 1
+        self.options['namecache'] = False
         self.options['infile'] = os.path.dirname(argv[0])
         self.options['outdir'] = "/tmp/"
         self.options['outfile'] = self.options['outdir'] + "tmp." + self.options.get('format')
@@ -52,8 +54,9 @@ class config(object):
             self.usage(argv)
 
         try:
-            (opts, val) = getopt.getopt(argv[1:], "h,o:,i:,f:,v,c:,d,e:,t:",
-                ["help", "format=", "outfile", "infile", "verbose", "convfile", "dump", "extra", "type"])
+            (opts, val) = getopt.getopt(argv[1:], "h,o:,i:,f:,v,c:,d,e:,t:,j:",
+                ["help", "format=", "outfile", "infile", "verbose", "convfile", "dump", "extra", "type", "jobs=",
+                 "name-cache="])
         except getopt.GetoptError as e:
             logging.error('%r' % e)
             self.usage(argv)
@@ -66,6 +69,11 @@ class config(object):
                 self.options['filter'] = val
             elif opt == "--outfile" or opt == '-o':
                 self.options['outfile'] = val
+            elif opt == "--format":
+                if val == "osm" or val == "pbf" or val == "csv":
+                    self.options['format'] = val
+                else:
+                    self.usage(argv)
             elif opt == "--infile" or opt == '-i':
                 self.options['infile'] = val
             elif opt == "--extra" or opt == '-e':
@@ -80,6 +88,10 @@ class config(object):
                 logging.basicConfig(filename='shp2map.log',level=logging.DEBUG)
             elif opt == "--dump" or opt == '-d':
                 self.options['dump'] = True
+            elif opt == "--jobs" or opt == '-j':
+                self.options['jobs'] = int(val)
+            elif opt == "--name-cache":
+                self.options['namecache'] = val
             elif opt == "convfile" or opt == '-c':
                 self.options['convfile'] = val
 
@@ -130,11 +142,14 @@ class config(object):
 \t--uid           OSM User ID (optional)
 \t--dump{-d)      Dump the Shape fields
 \t--outfile(-o)   Output file name
+\t--format        Output format, (osm,pbf,csv)
 \t--infile(-i)    Input file name
 \t--convfile(-c)  Conversion data file name
 \t--limit(-l)     Limit the output records
 \t--verbose(-v)   Enable verbosity
 \t--type(-t)      Type of data, (way,line)
+\t--jobs(-j)      Number of processes to use
+\t--name-cache    Keep corrected names in this file between runs
         """)
         quit()
 
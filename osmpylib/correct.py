@@ -20,107 +20,117 @@
 # but does the trick for me. It's still hard to filter out all bad data,
 # but this gets close.
 import logging
-import string
-import epdb
+import hashlib
 import re
+from namecache import nameCache
+
+# Road types, and a few other words, that get expanded. These match
+# in any case, but only as a whole token between spaces, so "Dr."
+# is left alone, and not in a name that's only one token.
+ABBREVIATIONS = {"hwy": "Highway", "rd": "Road", "ln": "Lane", "dr": "Drive",
+                 "cir": "Circle", "ave": "Avenue", "pl": "Place",
+                 "trl": "Trail", "ct": "Court", "cr": "CR", "fr": "FS",
+                 "crk": "Creek", "mtn": "Mountain", "spur": "Spur"}
+# At the start of a name, these mean something else
+PREFIXES = {"cr": "County Road"}
+# A compass direction is only expanded at the start of a name
+DIRECTIONS = {"N": "North", "S": "South", "E": "East", "W": "West"}
+
+# All the rules as one pattern, so a name is only scanned once. Which
+# rule matched is the name of the group.
+_rules = re.compile(r"^(?P<compass>[NSEW])(?= )"
+                    r"|(?<=[0-9])(?P<suffix>[abnesw]+)$"
+                    r"|(?<!\S)(?P<abbreviation>(?i:%s))(?=\s|$)"
+                    % '|'.join(sorted(ABBREVIATIONS, key=len, reverse=True)))
+
+# A cache of corrected names is only good for this version of the rules
+with open(__file__, 'rb') as source:
+    VERSION = hashlib.sha1(source.read()).hexdigest()
 
 
 class correct(object):
-    def __init__(self):
+    def __init__(self, cache=None):
         self.orig = ""
         self.value = ""
         self.modified = False
-        self.dirshort = ("S", "E", "N", "W")
-        self.dirlong = ("South", "East", "North", "West")
-        self.abbrevs = ("Hwy", "Rd", "Ln", "Dr", "Cir", "Ave", "Pl", "Trl", "Ct", "Cr", "FR", 'Crk')
-        self.fullname = ("Highway", "Road", "Lane", "Drive", "Circle", "Avenue", "Place", "Trail", "Court", "CR", "FS", 'Creek')
+        # Optionally keep the corrected names between runs, cache is
+        # the database file
+        self.cache = None
+        if cache:
+            self.cache = nameCache(cache, VERSION)
+        self.dirshort = tuple(DIRECTIONS.keys())
+        self.dirlong = tuple(DIRECTIONS.values())
+        # Each of the old entry points only applies some of the rules
+        self.everything = self.replacer('everything', ('compass', 'suffix', 'abbreviation'))
+        self.suffixes = self.replacer('suffix', ('suffix', ))
+        self.roadtypes = self.replacer('abbreviation', ('abbreviation', ))
+        self.directions = self.replacer('compass', ('compass', ))
 
-    def alphaNumeric(self, value=""):
+    def replacer(self, name, rules):
+        """Make the function re.sub() calls for a set of rules"""
+        def replace(match):
+            rule = match.lastgroup
+            word = match.group(rule)
+            if rule not in rules:
+                return word
+            if rule == 'compass':
+                return DIRECTIONS[word]
+            if rule == 'suffix':
+                return word.upper()
+            # A name that's only the abbreviation isn't expanded
+            if match.start() == 0 and match.string[match.end():].strip() == '':
+                return word
+            word = word.lower()
+            if match.start() == 0 and word in PREFIXES:
+                return PREFIXES[word]
+            return ABBREVIATIONS[word]
+        replace.rules = name
+        return replace
+
+    def apply(self, value, replace):
         self.orig = value
-        self.value = value
-        m = re.search("[0-9]+[abnesw]+$", value)
-        if m is not None:
-            number = value[0:len(value)-1]
-            suffix = string.capwords(value[len(value)-1])
-            self.value = str(number) + suffix
-            if self.value != value:
-                # print("MODIFIED%r to %r" % (value, self.value))
-                self.modified = True
+        if self.cache is None:
+            self.value = _rules.sub(replace, value)
         else:
-            # print("NO CHANGE, %r" % self.value)
-            self.value = value
+            self.value = self.cache.get(replace.rules, value)
+            if self.value is None:
+                self.value = _rules.sub(replace, value)
+                self.cache.add(replace.rules, value, self.value)
+        if self.value != value:
+            self.modified = True
         return self.value
 
-    def abbreviation(self, value=""):
-        self.orig = value
-        self.value = value
-        # Fix abbreviations for road type
-        i = 0
-        while i < len(self.abbrevs):
-            pattern = " " + self.abbrevs[i] + "$"
-            m = re.search(pattern, value, re.IGNORECASE)
-            pattern = "^" + self.abbrevs[i] + " "
-            n = re.search(pattern, value, re.IGNORECASE)
-            if n is not None:
-                m = n
-            if m is not None:
-                pattern = " " + self.abbrevs[i] + " "
-                newvalue = value[0:m.start()]
-                rest = ' ' + value[m.start() + len(self.abbrevs[i])+1:len(value)]
-                self.value = newvalue + ' ' + self.fullname[i] + rest.rstrip(' ')
-                self.modified = True
-                break
+    def normalize(self, value=""):
+        """Fix the abbreviations, compass direction, and any suffix on
+        a number in a name, all in one pass"""
+        return self.apply(value, self.everything)
 
-            pattern = " " + self.abbrevs[i] + " "
-            m = re.search(pattern, value, re.IGNORECASE)
-            if m is not None:
-                newvalue = value[0:m.start()]
-                rest = ' ' + value[m.start() + len(self.abbrevs[i])+1:len(value)]
-                self.value = newvalue + ' ' + self.fullname[i] + rest
-                self.modified = True
+    def normalize_many(self, values):
+        """Normalize each name in an iterable"""
+        if self.cache is not None:
+            for value in values:
+                yield self.apply(value, self.everything)
+            return
+        sub = _rules.sub
+        replace = self.everything
+        for value in values:
+            yield sub(replace, value)
 
-            # These seem to be special cases
-            pattern = " spur"
-            m = re.search(pattern, value)
-            if m is not None:
-                self.value = string.capwords(self.value)
-                self.modified = True
-
-            pattern = " Mtn "
-            m = re.search(pattern, value)
-            if m is not None:
-                self.value = self.value.replace(pattern, " Mountain ")
-                self.modified = True
+    def alphaNumeric(self, value=""):
+        """Capitalize the letters after a number, like 126n"""
+        return self.apply(value, self.suffixes)
 
-            # Look for a few weird Rd patterns
-            pattern = " Rd[\) ]+"
-            m = re.search(pattern, value, re.IGNORECASE)
-            if m is not None:
-                self.value = self.value.replace(" Rd", " Road")
-                self.modified = True
-                break
-            i = i +1
+    def abbreviation(self, value=""):
+        """Expand abbreviations for the road type"""
+        return self.apply(value, self.roadtypes)
 
-        return self.value.lstrip()
-    
     def compass(self, value=""):
-        self.orig = value
-        i = 0
-        # Fix compass direction names
-        if len(value) == 0:
-            epdb.st()
-        if value[0] == 'S' or value[0] == 'E' or value[0] == 'N' or value[0] == 'W':
-            while i < len(self.dirshort):
-                pattern = "^" + self.dirshort[i] + ' '
-                m = re.search(pattern, value, re.IGNORECASE)
-                if m is not None:
-                    newvalue = self.dirlong[i] + ' '
-                    newvalue += value[2:]
-                    self.value = newvalue
-                i = i +1
-
-        return self.value
+        """Expand a compass direction at the start of a name"""
+        return self.apply(value, self.directions)
 
     def ismodified(self):
         return self.modified
 
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
@@ -15,16 +15,23 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 # 
 
+import os
+import pickle
+import hashlib
 import logging
 # import epdb
 # import re
 
+# Where the compiled conversion files are kept
+CACHEDIR = os.path.join(os.path.expanduser('~'), '.cache', 'osmtools')
+
 
 class convfile(object):
     """Data file for the conversion"""
     def __init__(self, file=""):
         self.table = dict()
         self.attrtable = dict()
+        self.compiled = dict()
         if file != '':
             self.file = self.open(file)
         self.filespec = file
@@ -37,7 +44,47 @@ class convfile(object):
             logging.info("Opened %r" % file)
         except Exception as inst:
             logging.error("Couldn't open %r: %r" % (file), inst)
-        self.read()
+        # The cached copy is named by a hash of the contents, so any
+        # edit to the conversion file is a different cache file.
+        digest = hashlib.sha1(self.file.read().encode('utf-8')).hexdigest()
+        self.file.seek(0)
+        cache = os.path.join(CACHEDIR, "%s-%s.pickle" % (os.path.basename(file), digest))
+        if self.load(cache) is False:
+            self.read()
+            self.compile()
+            self.save(cache)
+
+    def load(self, cache):
+        """Load a compiled conversion table"""
+        try:
+            with open(cache, 'rb') as data:
+                self.table, self.attrtable, self.compiled = pickle.load(data)
+        except Exception as inst:
+            return False
+        logging.debug("Loaded compiled conversion table %r" % cache)
+        return True
+
+    def save(self, cache):
+        """Save the compiled conversion table"""
+        try:
+            os.makedirs(CACHEDIR, exist_ok=True)
+            with open(cache + ".tmp", 'wb') as data:
+                pickle.dump((self.table, self.attrtable, self.compiled), data)
+            os.replace(cache + ".tmp", cache)
+        except Exception as inst:
+            logging.warning("Couldn't save %r: %r" % (cache, inst))
+
+    def compile(self):
+        """Make one table that goes from the field name to the OSM tag
+        and the values to translate for it, so translate() only needs
+        one lookup."""
+        self.compiled = dict()
+        # Tags that aren't in the conversion file map directly to
+        # themselves, but can still have attributes
+        for name, values in self.attrtable.items():
+            self.compiled[name] = (name, values)
+        for name, tag in self.table.items():
+            self.compiled[name] = (tag, self.attrtable.get(tag, dict()))
 
     def read(self):
         if self.file is False:
@@ -100,6 +147,15 @@ class convfile(object):
             # logging.debug("No VAL for: %r" % name)
             return attr
 
+    def translate(self, field, value):
+        """Get the OSM tag and value for a field and it's value"""
+        try:
+            tag, values = self.compiled[field]
+        except KeyError:
+            return field, value
+        # Drop any embedded commas
+        return tag, values.get(value.replace(", ", " "), value)
+
     def match(self, instr):
         # logging.debug("datafile:match(%r) %r" % (name, instr))
         try:
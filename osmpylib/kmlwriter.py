@@ -0,0 +1,405 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# fastkml builds the whole document in memory before it can be written,
+# so a county of roads is held as rows, as a tree of objects, and then
+# as a string. This writes the same KML as each Placemark arrives, in
+# the same layout fastkml uses when pretty printing, so memory use
+# doesn't depend on how many features there are. A subset can also be
+# written to a temporary file, and included in the document later.
+#
+# MapStyle makes a Style for every feature, but there are only a few
+# different ones, so each is written once in the Document, and the
+# Placemarks refer to it with a styleUrl.
+#
+# The tags of a feature can go in ExtendedData instead of an HTML
+# description. Each subset has a Schema, declared once in the Document,
+# and each Placemark only has the fields that aren't empty.
+#
+# For level of detail, the Placemarks are kept until there's a batch of
+# them, so they can all be simplified at once, and each one is written
+# with a Region for each tier.
+
+import re
+import shutil
+import logging
+import tempfile
+import threading
+
+# Flush the buffer to disk once it holds this many characters
+BUFSIZE = 1024 * 1024
+
+NAMESPACE = "http://www.opengis.net/kml/2.2"
+
+# Columns that are already in the Placemark, or aren't tags
+COLUMNS = set(['osm_id', 'name', 'area', 'wkb_geometry', 'wkb', 'cp'])
+
+# Characters that can't appear as is in XML text
+_escapes = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'})
+_special = re.compile('[&<>"]')
+
+
+def escape(value):
+    """Escape a value so it can be used in XML text or an attribute"""
+    value = str(value)
+    if _special.search(value) is None:
+        return value
+    return value.translate(_escapes)
+
+
+def coordinates(coords, digits=None):
+    if digits is None:
+        return ' '.join(['%r,%r' % (coord[0], coord[1]) for coord in coords])
+    # Rounding drops the noise left when the coordinates were quantized
+    return ' '.join(['%r,%r' % (round(coord[0], digits), round(coord[1], digits)) for coord in coords])
+
+
+def geometry(geom, indent, digits=None):
+    """The KML for a shapely geometry, digits is the precision for
+    the coordinates"""
+    type = geom.geom_type
+    inner = indent + '  '
+    if type == 'Point' or type == 'LineString' or type == 'LinearRing':
+        return '%s<%s>\n%s<coordinates>%s</coordinates>\n%s</%s>\n' \
+            % (indent, type, inner, coordinates(geom.coords, digits), indent, type)
+    elif type == 'Polygon':
+        text = '%s<Polygon>\n%s<outerBoundaryIs>\n%s%s</outerBoundaryIs>\n' \
+            % (indent, inner, geometry(geom.exterior, inner + '  ', digits), inner)
+        for ring in geom.interiors:
+            text += '%s<innerBoundaryIs>\n%s%s</innerBoundaryIs>\n' \
+                % (inner, geometry(ring, inner + '  ', digits), inner)
+        return text + indent + '</Polygon>\n'
+    # The Multi* types and GeometryCollection
+    return '%s<MultiGeometry>\n%s%s</MultiGeometry>\n' \
+        % (indent, ''.join([geometry(part, inner, digits) for part in geom.geoms]), indent)
+
+
+def substyles(style):
+    # Older versions of fastkml have styles() as a generator
+    substyles = style.styles
+    if callable(substyles):
+        substyles = substyles()
+    return substyles
+
+
+def style(style, indent, id=None, href=None):
+    """The KML for a fastkml Style, as made by MapStyle. href can
+    change the path to an icon."""
+    inner = indent + '  '
+    if id is None:
+        text = indent + '<Style>\n'
+    else:
+        text = '%s<Style id="%s">\n' % (indent, id)
+    for substyle in substyles(style):
+        name = type(substyle).__name__
+        text += '%s<%s>\n' % (inner, name)
+        if getattr(substyle, 'color', None) is not None:
+            text += '%s  <color>%s</color>\n' % (inner, substyle.color)
+        if getattr(substyle, 'width', None) is not None:
+            text += '%s  <width>%r</width>\n' % (inner, float(substyle.width))
+        icon = getattr(substyle, 'icon_href', None)
+        if icon is not None:
+            if href is not None:
+                icon = href(icon)
+            text += '%s  <Icon>\n%s    <href>%s</href>\n%s  </Icon>\n' \
+                % (inner, inner, escape(icon), inner)
+        text += '%s</%s>\n' % (inner, name)
+    return text + indent + '</Style>\n'
+
+
+class styleTable(object):
+    """The different styles used in a Document"""
+    def __init__(self, icons=None):
+        # Finds the icons that are the same as another
+        self.icons = icons
+        self.ids = dict()
+        self.styles = list()
+        # The subsets share the table of the Document they go in
+        self.lock = threading.Lock()
+        # Statistics for the run
+        self.inline = 0
+        self.references = 0
+
+    def key(self, mapstyle):
+        """Styles with the same color, width, and icon are the same"""
+        return tuple([(type(substyle).__name__, getattr(substyle, 'color', None),
+                       getattr(substyle, 'width', None), self.href(getattr(substyle, 'icon_href', None)))
+                      for substyle in substyles(mapstyle)])
+
+    def href(self, icon):
+        if icon is None or self.icons is None:
+            return icon
+        return self.icons.href(icon)
+
+    def styleUrl(self, mapstyle, indent):
+        """The styleUrl element for a Style, adding it if it's new"""
+        key = self.key(mapstyle)
+        with self.lock:
+            try:
+                id, size, lines = self.ids[key]
+            except KeyError:
+                id = "style%d" % len(self.styles)
+                text = style(mapstyle, '', id, self.href)
+                size = len(text) - len(' id="%s"' % id)
+                lines = text.count('\n')
+                self.ids[key] = (id, size, lines)
+                self.styles.append((id, mapstyle))
+            text = '%s<styleUrl>#%s</styleUrl>\n' % (indent, id)
+            # What writing the Style here would have cost
+            self.inline += size + lines * len(indent)
+            self.references += len(text)
+        return text
+
+    def size(self):
+        return len(self.styles)
+
+    def iconFiles(self):
+        """The icons used by the styles"""
+        return set([part[3] for key in self.ids for part in key if part[3] is not None])
+
+    def kml(self, indent):
+        """The shared Style elements, for the top of the Document"""
+        return ''.join([style(mapstyle, indent, id, self.href) for id, mapstyle in self.styles])
+
+    def saved(self, indent='    '):
+        """How many bytes sharing the styles saved"""
+        return self.inline - self.references - len(self.kml(indent))
+
+
+def region(box, minimum, maximum, indent):
+    """The KML for a Region, box is (north, south, east, west)"""
+    inner = indent + '  '
+    return '%s<Region>\n%s<LatLonAltBox>\n%s  <north>%r</north>\n%s  <south>%r</south>\n' \
+        '%s  <east>%r</east>\n%s  <west>%r</west>\n%s</LatLonAltBox>\n' \
+        '%s<Lod>\n%s  <minLodPixels>%d</minLodPixels>\n%s  <maxLodPixels>%d</maxLodPixels>\n%s</Lod>\n%s</Region>\n' \
+        % (indent, inner, inner, float(box[0]), inner, float(box[1]), inner, float(box[2]), inner, float(box[3]),
+           inner, inner, inner, minimum, inner, maximum, inner, indent)
+
+
+class schemaTable(object):
+    """The fields in the data of each subset, which become a Schema"""
+    def __init__(self):
+        # The fields are added as they're found, in the order they're found
+        self.schemas = dict()
+        # The subsets share the table of the Document they go in
+        self.lock = threading.Lock()
+
+    def fields(self, schema, data):
+        """The fields of a feature that aren't empty, adding any new ones
+        to the Schema"""
+        fields = [(key, value) for key, value in data.items()
+                  if key not in COLUMNS and value is not None and value != ''
+                  and getattr(value, 'geom_type', None) is None]
+        with self.lock:
+            known = self.schemas.setdefault(schema, dict())
+            for key, value in fields:
+                if key not in known:
+                    known[key] = True
+        return fields
+
+    def size(self):
+        return len(self.schemas)
+
+    def kml(self, indent):
+        """The Schema elements, for the top of the Document"""
+        text = ''
+        for schema, fields in self.schemas.items():
+            text += '%s<Schema name="%s" id="%s">\n' % (indent, escape(schema), escape(schema))
+            for field in fields:
+                text += '%s  <SimpleField type="string" name="%s"/>\n' % (indent, escape(field))
+            text += indent + '</Schema>\n'
+        return text
+
+
+class kmlWriter(object):
+    """Buffered writer for KML files"""
+    def __init__(self, file, bufsize=BUFSIZE, depth=1, styles=None, schemas=None, icons=None, lod=None):
+        # This can be a filespec, or an open binary file, like a
+        # temporary file for a subset.
+        if isinstance(file, str):
+            self.filespec = file
+            self.file = open(file, 'wb')
+            self.owner = True
+        else:
+            self.filespec = getattr(file, 'name', None)
+            self.file = file
+            self.owner = False
+        self.bufsize = bufsize
+        self.buffer = list()
+        self.buffered = 0
+        # How deep in the tree the next element is, a subset
+        # starts inside the Document.
+        self.depth = depth
+        self.folders = list()
+        # A subset uses the styles of the Document it goes in
+        if styles is None:
+            styles = styleTable(icons)
+        self.styles = styles
+        if schemas is None:
+            schemas = schemaTable()
+        self.schemas = schemas
+        # The levelOfDetail, if the lines and polygons are simplified
+        self.lod = lod
+        self.digits = None
+        if lod is not None:
+            self.digits = lod.precision
+        self.pending = list()
+        self.head = None
+        # Statistics for the run
+        self.placemarks = 0
+
+    def indent(self):
+        return '  ' * self.depth
+
+    def write(self, text):
+        """Add raw text to the output buffer"""
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.file.write(''.join(self.buffer).encode('utf-8'))
+            self.buffer.clear()
+            self.buffered = 0
+
+    def header(self, name, description=None):
+        """Start the KML file, with a Document"""
+        self.depth = 1
+        text = '<kml xmlns="%s">\n  <Document id="docid">\n    <name>%s</name>\n' % (NAMESPACE, escape(name))
+        if description is not None:
+            text += '    <description>%s</description>\n' % escape(description)
+        # The Document starts with the shared styles and the schemas,
+        # and they aren't all known until the end, so the rest goes to
+        # a temporary file until then.
+        self.head = text
+        self.output = self.file
+        self.file = tempfile.TemporaryFile()
+        self.depth = 2
+
+    def footer(self):
+        """End the Document, and close the file"""
+        self.flushPlacemarks()
+        while len(self.folders) > 0:
+            self.endFolder()
+        self.write('  </Document>\n</kml>\n')
+        self.flush()
+        if self.head is not None:
+            body = self.file
+            self.file = self.output
+            self.file.write((self.head + self.styles.kml('    ') + self.schemas.kml('    ')).encode('utf-8'))
+            body.seek(0)
+            shutil.copyfileobj(body, self.file)
+            body.close()
+            self.head = None
+        self.close()
+
+    def close(self):
+        self.flush()
+        if self.owner and not self.file.closed:
+            self.file.close()
+            logging.info("Wrote %d placemarks to %s" % (self.placemarks, self.filespec))
+            logging.info("%d shared styles in %s, saved %d bytes"
+                         % (self.styles.size(), self.filespec, self.styles.saved()))
+
+    def folder(self, name, description=None):
+        """Start a Folder, which lasts until endFolder()"""
+        self.flushPlacemarks()
+        indent = self.indent()
+        text = '%s<Folder>\n%s  <name>%s</name>\n' % (indent, indent, escape(name))
+        if description is not None:
+            text += '%s  <description>%s</description>\n' % (indent, escape(description))
+        self.write(text)
+        self.folders.append(name)
+        self.depth += 1
+
+    def endFolder(self):
+        self.flushPlacemarks()
+        self.folders.pop()
+        self.depth -= 1
+        self.write(self.indent() + '</Folder>\n')
+
+    def placemark(self, osmid, name, description, mapstyle, geom, schema=None, data=None):
+        """Write a Placemark, mapstyle is the Style from MapStyle. If
+        there's a schema, the tags in data go in ExtendedData."""
+        self.placemarks += 1
+        if self.lod is not None:
+            self.pending.append((osmid, name, description, mapstyle, geom, schema, data))
+            if len(self.pending) >= self.lod.batch:
+                self.flushPlacemarks()
+            return
+        self.write(self.placemarkText(osmid, name, description, mapstyle, geom, schema, data))
+
+    def flushPlacemarks(self):
+        """Simplify the Placemarks waiting for it, and write them with
+        a Region for each tier"""
+        if len(self.pending) == 0:
+            return
+        pending = self.pending
+        self.pending = list()
+        tiers = self.lod.simplify([placemark[4] for placemark in pending],
+                                  [placemark[5] for placemark in pending])
+        indent = self.indent() + '  '
+        for placemark, versions in zip(pending, tiers):
+            osmid, name, description, mapstyle, geom, schema, data = placemark
+            for tier, (geom, box, minimum, maximum) in enumerate(versions):
+                text = None
+                if box is not None:
+                    text = region(box, minimum, maximum, indent)
+                # The IDs have to be different
+                if tier > 0:
+                    osmid = "%s-%d" % (placemark[0], tier)
+                self.write(self.placemarkText(osmid, name, description, mapstyle, geom, schema, data, text))
+
+    def placemarkText(self, osmid, name, description, mapstyle, geom, schema, data, lod=None):
+        indent = self.indent()
+        inner = indent + '  '
+        text = '%s<Placemark id="%s">\n' % (indent, escape(osmid))
+        if name is not None:
+            text += '%s<name>%s</name>\n' % (inner, escape(name))
+        if description:
+            text += '%s<description>%s</description>\n' % (inner, escape(description))
+        if mapstyle is not None:
+            text += self.styles.styleUrl(mapstyle, inner)
+        if lod is not None:
+            text += lod
+        if schema is not None and data is not None:
+            text += self.extendedData(schema, data, inner)
+        if geom is not None:
+            text += geometry(geom, inner, self.digits)
+        return text + indent + '</Placemark>\n'
+
+    def include(self, subset):
+        """Copy in a subset written by another kmlWriter"""
+        subset.flushPlacemarks()
+        subset.flush()
+        self.flushPlacemarks()
+        self.flush()
+        subset.file.seek(0)
+        shutil.copyfileobj(subset.file, self.file)
+        self.placemarks += subset.placemarks
+
+    def extendedData(self, schema, data, indent):
+        """The ExtendedData for the fields of a feature"""
+        fields = self.schemas.fields(schema, data)
+        if len(fields) == 0:
+            return ''
+        text = '%s<ExtendedData>\n%s  <SchemaData schemaUrl="#%s">\n' % (indent, indent, escape(schema))
+        for key, value in fields:
+            text += '%s    <SimpleData name="%s">%s</SimpleData>\n' % (indent, escape(key), escape(value))
+        return text + '%s  </SchemaData>\n%s</ExtendedData>\n' % (indent, indent)
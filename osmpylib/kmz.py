@@ -0,0 +1,108 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# A KMZ file is a zip file with the KML file first, and the icons it
+# uses. KML is very repetitive, so it's compressed with deflate, which
+# makes it several times smaller, but the icons are PNG files that are
+# already compressed, so they're stored as is. Some of the icons are
+# copies of others, so they're found by their contents, and only one
+# of them is used. Compressing is slow for big files, so the separate
+# KMZ files are made at the same time, each in it's own process.
+
+import os
+import shutil
+import hashlib
+import logging
+import zipfile
+import threading
+import multiprocessing
+
+# The deflate compression level, from 0 (fastest) to 9 (smallest)
+LEVEL = 6
+# Copy the KML file into the KMZ file in chunks of this many bytes
+CHUNKSIZE = 1024 * 1024
+
+
+class iconTable(object):
+    """Icons with the same contents are the same icon"""
+    def __init__(self):
+        # The first icon with each hash
+        self.hashes = dict()
+        self.hrefs = dict()
+        # The styles of the subsets are made in different threads
+        self.lock = threading.Lock()
+        # Statistics for the run
+        self.duplicates = 0
+
+    def href(self, href):
+        """The icon to use instead of this one, which might be the same"""
+        with self.lock:
+            try:
+                return self.hrefs[href]
+            except KeyError:
+                pass
+            try:
+                with open(href, 'rb') as file:
+                    digest = hashlib.sha1(file.read()).hexdigest()
+            except OSError as inst:
+                logging.warning("Couldn't read icon %s: %r" % (href, inst))
+                self.hrefs[href] = href
+                return href
+            found = self.hashes.setdefault(digest, href)
+            if found != href:
+                logging.debug("%s is the same as %s" % (href, found))
+                self.duplicates += 1
+            self.hrefs[href] = found
+            return found
+
+
+def package(job):
+    """Write the KMZ file for a KML file and it's icons, this runs in
+    a process of it's own"""
+    kmlfile, icons, level = job
+    kmz = kmlfile.replace(".kml", ".kmz")
+    size = os.path.getsize(kmlfile)
+    with zipfile.ZipFile(kmz, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=level) as zip:
+        # The KML file has to be first, and the icons are relative to it
+        with open(kmlfile, 'rb') as file, \
+             zip.open(os.path.basename(kmlfile), mode="w", force_zip64=size > zipfile.ZIP64_LIMIT) as entry:
+            shutil.copyfileobj(file, entry, CHUNKSIZE)
+        for icon in sorted(icons):
+            if not os.path.exists(icon):
+                logging.warning("%s is missing from %s" % (icon, kmz))
+                continue
+            zip.write(icon, compress_type=zipfile.ZIP_STORED)
+    return kmz, size, os.path.getsize(kmz)
+
+
+def packageAll(jobs, processes=None):
+    """Write the KMZ files for a list of (kmlfile, icons, level), each
+    in a process of it's own, up to one for each CPU"""
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.map(package, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = [package(job) for job in jobs]
+    for kmz, before, after in results:
+        logging.info("Wrote %s, %d bytes of KML in %d bytes, %.1f times smaller"
+                     % (kmz, before, after, before / max(after, 1)))
+    return results
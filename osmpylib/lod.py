@@ -0,0 +1,125 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# A county of roads has millions of vertices, and a viewer draws all of
+# them at every zoom level. For level of detail, each line or polygon
+# is simplified for each tier, and written once for each tier that's
+# different, with a KML Region so the viewer only draws the one that
+# fits the zoom level. The coordinates are also rounded to a fixed
+# precision, which drops the vertices that end up in the same place.
+# Shapely 2 simplifies a whole array of geometries at once, so the
+# Placemarks are simplified in batches.
+
+import logging
+import threading
+import numpy as np
+try:
+    # Shapely 2 works on arrays of geometries
+    from shapely import simplify, set_precision, get_num_coordinates, get_type_id, is_empty, bounds
+except ImportError:
+    simplify = None
+
+# The tiers, most detailed first, as the tolerance in degrees for
+# simplifying, and the size in pixels a feature has to be on the
+# screen for the tier to be drawn. Smaller than the last tier, it's
+# not drawn at all.
+TIERS = ((0.0, 256), (0.0001, 64), (0.001, 8))
+# Round the coordinates to this many decimal places, about 10cm
+PRECISION = 6
+# How many Placemarks to simplify at once
+BATCH = 1000
+
+# The shapely type ids of lines and polygons, the points are written
+# as they are
+SIMPLIFY = (1, 2, 3, 5, 6)
+# The smallest Region, in degrees, so a feature with no width or
+# height still has a size on the screen
+MINIMUM = 0.00001
+
+
+class levelOfDetail(object):
+    """Simplify geometries for each tier of detail"""
+    def __init__(self, tiers=TIERS, precision=PRECISION):
+        self.tiers = tiers
+        self.precision = precision
+        self.batch = BATCH
+        # The subsets are written in different threads
+        self.lock = threading.Lock()
+        # Statistics for the run, the vertices for each subset before,
+        # and in each tier
+        self.vertices = dict()
+
+    def simplify(self, geoms, subsets):
+        """Returns a list for each geometry, of (geometry, box,
+        minLodPixels, maxLodPixels) for each tier that's different,
+        most detailed first. Points have a box of None."""
+        geoms = np.array(geoms, dtype=object)
+        quantized = set_precision(geoms, 10.0 ** -self.precision)
+        # Something smaller than the precision is kept as it was
+        quantized = np.where(is_empty(quantized) & ~is_empty(geoms), geoms, quantized)
+        versions = list()
+        for tolerance, pixels in self.tiers:
+            if tolerance > 0:
+                versions.append(simplify(quantized, tolerance, preserve_topology=True))
+            else:
+                versions.append(quantized)
+        counts = np.array([get_num_coordinates(version) for version in versions])
+        lines = np.isin(get_type_id(geoms), SIMPLIFY)
+        self.count(subsets, get_num_coordinates(geoms), counts, lines)
+        boxes = self.boxes(bounds(quantized))
+
+        result = list()
+        for index in range(0, len(geoms)):
+            if not lines[index]:
+                result.append([(quantized[index], None, None, None)])
+                continue
+            tiers = list()
+            maximum = -1
+            for tier in range(0, len(self.tiers)):
+                # The next tier is the same, so this one covers it too
+                if tier + 1 < len(self.tiers) and counts[tier + 1][index] == counts[tier][index]:
+                    continue
+                tiers.append((versions[tier][index], boxes[index], self.tiers[tier][1], maximum))
+                maximum = self.tiers[tier][1]
+            result.append(tiers)
+        return result
+
+    def boxes(self, bounds):
+        """The Regions as (north, south, east, west), square so lines
+        that go one way have a size on the screen"""
+        half = np.maximum(np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1]), MINIMUM) / 2
+        x = (bounds[:, 0] + bounds[:, 2]) / 2
+        y = (bounds[:, 1] + bounds[:, 3]) / 2
+        return np.round(np.stack((y + half, y - half, x + half, x - half), axis=1), self.precision)
+
+    def count(self, subsets, before, counts, lines):
+        with self.lock:
+            for index in np.nonzero(lines)[0]:
+                try:
+                    entry = self.vertices[subsets[index]]
+                except KeyError:
+                    entry = self.vertices[subsets[index]] = [0] * (len(self.tiers) + 1)
+                entry[0] += int(before[index])
+                for tier in range(0, len(self.tiers)):
+                    entry[tier + 1] += int(counts[tier][index])
+
+    def summary(self):
+        """Log how many vertices were left in each tier"""
+        for subset, entry in sorted(self.vertices.items(), key=lambda item: str(item[0])):
+            tiers = ["%d (%.1f%%) at %g" % (vertices, vertices * 100.0 / max(entry[0], 1), tier[0])
+                     for vertices, tier in zip(entry[1:], self.tiers)]
+            logging.info("%s: %d vertices, %s" % (subset, entry[0], ', '.join(tiers)))
@@ -0,0 +1,102 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Most runs of editosm, parcels, plotcalls, or shp2map see the same
+# county road and address names as the last run, so this keeps the
+# corrected names in an SQLite database that all of them can share.
+# The database is stamped with a hash of the rules in correct.py, and
+# is emptied when they change, so a stale name is never returned.
+# WAL mode lets the shp2map worker processes read while one writes.
+
+import sqlite3
+import logging
+
+# Write the new names to the database after this many
+COMMITSIZE = 1000
+
+
+class nameCache(object):
+    """Cache of corrected names, stored on disk"""
+    def __init__(self, filespec, version):
+        self.filespec = filespec
+        self.version = version
+        # Names looked up or added this run
+        self.names = dict()
+        self.pending = list()
+        # Statistics for the run
+        self.lookups = 0
+        self.hits = 0
+        self.db = sqlite3.connect(filespec, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS version (hash TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS names (rules TEXT, raw TEXT, name TEXT,"
+                        " PRIMARY KEY (rules, raw)) WITHOUT ROWID")
+        row = self.db.execute("SELECT hash FROM version").fetchone()
+        if row is None or row[0] != version:
+            logging.info("The name rules have changed, emptying %s" % filespec)
+            self.db.execute("DELETE FROM names")
+            self.db.execute("DELETE FROM version")
+            self.db.execute("INSERT INTO version VALUES (?)", (version, ))
+        self.db.commit()
+
+    def get(self, rules, raw):
+        """Get the corrected name, or None"""
+        self.lookups += 1
+        key = (rules, raw)
+        try:
+            name = self.names[key]
+        except KeyError:
+            row = self.db.execute("SELECT name FROM names WHERE rules=? AND raw=?", key).fetchone()
+            if row is None:
+                return None
+            name = self.names[key] = row[0]
+        self.hits += 1
+        return name
+
+    def add(self, rules, raw, name):
+        """Add a corrected name"""
+        self.names[(rules, raw)] = name
+        self.pending.append((rules, raw, name))
+        if len(self.pending) >= COMMITSIZE:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        try:
+            self.db.executemany("INSERT OR REPLACE INTO names VALUES (?, ?, ?)", self.pending)
+            self.db.commit()
+        except sqlite3.Error as inst:
+            logging.warning("Couldn't update %s: %r" % (self.filespec, inst))
+            self.db.rollback()
+        self.pending.clear()
+
+    def close(self):
+        if self.db is None:
+            return
+        self.flush()
+        self.db.close()
+        self.db = None
+        logging.info("Name cache: %d hits of %d lookups (%.1f%%) in %s"
+                     % (self.hits, self.lookups, self.ratio() * 100, self.filespec))
+
+    def ratio(self):
+        """The fraction of lookups that found a name"""
+        if self.lookups == 0:
+            return 0.0
+        return self.hits / self.lookups
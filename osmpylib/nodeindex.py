@@ -0,0 +1,104 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Adjacent road segments and parcels share vertices, and if each one
+# gets it's own node the ways aren't connected, which breaks routing.
+# This index maps a location to the ID of the node already written
+# there. A dict would need over 100 bytes an entry, which is too much
+# for a statewide file with tens of millions of vertices, so this is
+# an open addressing hash table stored in two arrays of 64 bit
+# integers, 16 bytes a slot.
+
+from array import array
+
+# Coordinates are rounded to this many units per degree before being
+# compared, which is the same resolution as the PBF format.
+PRECISION = 10000000
+# No key can have this value, so it marks an empty slot
+EMPTY = -(1 << 63)
+
+
+class nodeIndex(object):
+    """Index of node IDs by location"""
+    def __init__(self, size=1 << 20, precision=PRECISION):
+        self.precision = precision
+        self.allocate(size)
+        self.used = 0
+        # Statistics for the run
+        self.lookups = 0
+        self.hits = 0
+
+    def allocate(self, size):
+        self.size = size
+        self.mask = size - 1
+        self.keys = array('q', [EMPTY]) * size
+        self.ids = array('q', bytes(8 * size))
+
+    def key(self, lat, lon):
+        """Pack the rounded location into a single integer"""
+        lat = int(round(float(lat) * self.precision))
+        lon = int(round(float(lon) * self.precision))
+        return (lat << 32) | (lon & 0xffffffff)
+
+    def slot(self, key):
+        """Find the slot for a key, or the empty one where it goes"""
+        # Mix the bits, as nearby locations only differ in a few of them
+        index = ((key * 0x9e3779b97f4a7c15) >> 24) & self.mask
+        keys = self.keys
+        while keys[index] != key and keys[index] != EMPTY:
+            index = (index + 1) & self.mask
+        return index
+
+    def get(self, lat, lon):
+        """Get the ID of the node at this location, or None"""
+        self.lookups += 1
+        index = self.slot(self.key(lat, lon))
+        if self.keys[index] == EMPTY:
+            return None
+        self.hits += 1
+        return self.ids[index]
+
+    def add(self, lat, lon, osmid):
+        """Add the ID of a node at this location"""
+        key = self.key(lat, lon)
+        index = self.slot(key)
+        if self.keys[index] == EMPTY:
+            self.used += 1
+        self.keys[index] = key
+        self.ids[index] = int(osmid)
+        # Keep the table under 70% full so the probes stay short
+        if self.used * 10 > self.size * 7:
+            self.grow()
+
+    def grow(self):
+        keys = self.keys
+        ids = self.ids
+        self.allocate(self.size * 2)
+        for i in range(0, len(keys)):
+            if keys[i] != EMPTY:
+                index = self.slot(keys[i])
+                self.keys[index] = keys[i]
+                self.ids[index] = ids[i]
+
+    def __len__(self):
+        return self.used
+
+    def ratio(self):
+        """The fraction of lookups that found an existing node"""
+        if self.lookups == 0:
+            return 0.0
+        return self.hits / self.lookups
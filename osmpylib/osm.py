@@ -20,8 +20,12 @@ import os.path
 import time
 import logging
 from datafile import convfile
+from osmwriter import xmlWriter
+from pbf import pbfWriter
+from nodeindex import nodeIndex
 import config
 import html
+import xml.etree.ElementTree as ET
 import string
 import re
 import epdb
@@ -29,54 +33,82 @@ from subprocess import PIPE, Popen, STDOUT
 import subprocess
 ON_POSIX = 'posix' in sys.builtin_module_names
 from datetime import datetime
+from collections import OrderedDict
 import correct
 import overpass
 from poly import Poly
 
+# The default number of translated tags to cache
+TAGCACHE = 65536
+
 
 class osmfile(object):
     """OSM File output"""
-    def __init__(self, options, filespec=None):
+    def __init__(self, options, filespec=None, format=None):
         self.options = options
         # Read the config file to get our OSM credentials, if we have any
         # self.config = config.config(self.options)
         self.version = 3
         self.visible = 'true'
         self.osmid = -30470
+        # The timestamp only changes once a second, so cache it
+        self.now = 0
+        self.timestamp = None
         # Open the OSM output file
         if filespec is None:
-            self.file = self.options.get('outdir') + "foobar.osm"
+            filespec = self.options.get('outdir') + "foobar.osm"
+        if format is None:
+            format = self.options.get('format')
+        if format == 'pbf' or (format != 'osm' and filespec.endswith('.pbf')):
+            self.file = pbfWriter(filespec)
         else:
-            self.file = open(filespec, 'w')
-            # self.file = open(filespec + ".osm", 'w')
+            self.file = xmlWriter(filespec)
         logging.info("Opened output file: " + filespec )
-        #logging.error("Couldn't open %s for writing!" % filespec)
 
         # This is the file that contains all the filtering data
         self.ctable = convfile(options.get('convfile'))
         # These are for importing the CO addresses
         self.full = None
         self.addr = None
+        self.fix = correct.correct(options.get('namecache'))
+        # Cache of translated tags, and how well it's working
+        self.tagcache = OrderedDict()
+        self.tagcachesize = options.get('tagcache')
+        if not self.tagcachesize:
+            self.tagcachesize = TAGCACHE
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Nodes already written, so shared vertices can be reused
+        self.nodeindex = nodeIndex()
 
     def isclosed(self):
         return self.file.closed
 
     def header(self):
-        if self.file is not False:
-            self.file.write('<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n')
-            #self.file.write('<osm version="0.6" generator="gosm 0.1" timestamp="2017-03-13T21:43:02Z">\n')
-            self.file.write('<osm version="0.6" generator="gosm 0.1">\n')
+        self.file.header()
 
     def footer(self):
-        #logging.debug("FIXME: %r" % self.file)
-        self.file.write("</osm>\n")
-        if self.file != False:
-            self.file.close()
+        self.file.footer()
+        self.fix.close()
+        logging.info("Tag cache: %d hits, %d misses, %d evictions"
+                     % (self.hits, self.misses, self.evictions))
+        if self.nodeindex.lookups > 0:
+            logging.info("Reused %d of %d vertices (%.1f%%)"
+                         % (self.nodeindex.hits, self.nodeindex.lookups,
+                            self.nodeindex.ratio() * 100))
 
     def writeWay(self, way=list()):
         for line in way:
             self.file.write("%s\n" % line)
 
+    def getTimestamp(self):
+        now = int(time.time())
+        if now != self.now:
+            self.now = now
+            self.timestamp = datetime.fromtimestamp(now).strftime("%Y-%m-%dT%TZ")
+        return self.timestamp
+
     def mergeTags(self, tags1, tags2):
         """Merge two sets of tags together. This would be easy if all the
         values matched exactly, but often imported datra sucks... so
@@ -101,9 +133,6 @@ class osmfile(object):
         return newtags
 
     def writeNode(self, tags=list(), attrs=dict(), modified=False):
-        #        timestamp = ""  # LastUpdate
-        timestamp = datetime.now().strftime("%Y-%m-%dT%TZ")
-        # self.file.write("       <node id='" + str(self.osmid) + "\' visible='true'")
         try:
             x = attrs['osmid']
         except:
@@ -124,15 +153,7 @@ class osmfile(object):
             except:
                 attrs['uid'] = str(self.options.get('uid'))
 
-        if len(attrs) > 0:
-            self.file.write("    <node")
-            for ref,value in attrs.items():
-                self.file.write(" " + ref + "=\"" + value + "\"")
-            if len(tags) > 0:
-                self.file.write(">\n")
-            else:
-                self.file.write("/>\n")
-
+        newtags = list()
         for i in tags:
             for name, value in i.items():
                 if name == "Ignore" or value == None:
@@ -140,52 +161,46 @@ class osmfile(object):
                 if str(value)[0] != 'b':
                     if value != 'None' or value != 'Ignore':
                         tag = self.makeTag(name, value)
-                        for newname, newvalue in tag.items():
-                            # if newname == 'addr:street' or newname == 'addr:full' or newname == 'name' or newname == 'alt_name':
-                            #     newvalue = string.capwords(newvalue)
-                            self.file.write("    <tag k=\"" + newname + "\" v=\"" + str(newvalue) + "\"/>\n")
+                        newtags.extend(tag.items())
 
-        if len(tags) > 0:
-            self.file.write("    </node>\n")
+        self.file.node(attrs, newtags)
 
         return self.osmid
 
+    # Most of the scripts use the shorter name
+    node = writeNode
+
+    def vertex(self, lat, lon):
+        """Write an untagged node for a vertex of a way, unless there is
+        already one at the same location, and return it's ID"""
+        osmid = self.nodeindex.get(lat, lon)
+        if osmid is None:
+            osmid = self.osmid
+            self.nodeindex.add(lat, lon, osmid)
+            self.writeNode(list(), {'lat': str(lat), 'lon': str(lon)})
+        return osmid
+
     # Here's where the fun starts. Read a field header from a file,
     # which of course are all different. Make an attempt to match these
     # random field names to standard OSM tag names. Same for the values,
     # which for OSM often have defined ranges.
     def makeTag(self, field, value):
-        fix = correct.correct()
-        newval = str(value)
-        #newval = html.unescape(newval)
-        newval = newval.replace('&', 'and')
-        newval = newval.replace('"', '')
-        #newval = newval.replace('><', '')
         tag = dict()
-        # logging.debug("OSM:makeTag(field=%r, value=%r)" % (field, newval))
-
+        # Most columns only have a few hundred different values, so
+        # the translation is cached, and only the address handling
+        # below has to be done for every record.
+        key = (field, str(value))
         try:
-            newtag = self.ctable.match(field)
-        except Exception as inst:
-            logging.warning("MISSING Field: %r, %r" % (field, newval))
-            # If it's not in the conversion file, assume it maps directly
-            # to an official OSM tag.
-            newtag = field
-
-
-        newval = self.ctable.attribute(newtag, newval)
-        #logging.debug("ATTRS1: %r %r" % (newtag, newval))
-        change = newval.split('=')
-        if len(change) > 1:
-            newtag = change[0]
-            newval = change[1]
-
-        # name tags, usually roads or addresses, often have to be tweaked
-        # for OSM standards
-        if (newtag == "name") or (newtag == "alt_name"):
-            newval = string.capwords(fix.alphaNumeric(newval))
-            newval = fix.abbreviation(newval)
-            newval = fix.compass(newval)
+            newtag, newval = self.tagcache[key]
+            self.tagcache.move_to_end(key)
+            self.hits += 1
+        except KeyError:
+            newtag, newval = self.translateTag(field, key[1])
+            self.misses += 1
+            self.tagcache[key] = (newtag, newval)
+            if len(self.tagcache) > self.tagcachesize:
+                self.tagcache.popitem(last=False)
+                self.evictions += 1
 
         # This is a hack because the CO address data truncates the street,
         # and we need the whole thing so routing will work to an address.
@@ -210,84 +225,122 @@ class osmfile(object):
         #print("ATTRS2: %r %r" % (newtag, newval))
         return tag
 
+    def translateTag(self, field, value):
+        """Translate a field and value using the conversion file"""
+        newval = value
+        #newval = html.unescape(newval)
+        newval = newval.replace('&', 'and')
+        newval = newval.replace('"', '')
+        #newval = newval.replace('><', '')
+        # logging.debug("OSM:translateTag(field=%r, value=%r)" % (field, newval))
+
+        # If it's not in the conversion file, assume it maps directly
+        # to an official OSM tag.
+        newtag, newval = self.ctable.translate(field, newval)
+        #logging.debug("ATTRS1: %r %r" % (newtag, newval))
+        change = newval.split('=')
+        if len(change) > 1:
+            newtag = change[0]
+            newval = change[1]
+
+        # name tags, usually roads or addresses, often have to be tweaked
+        # for OSM standards
+        if (newtag == "name") or (newtag == "alt_name"):
+            newval = self.fix.normalize(string.capwords(newval))
+
+        return newtag, newval
+
     def makeWay(self, refs, tags=list(), attrs=dict(), modified=True):
         if len(refs) is 0:
             logging.error("No refs! %r" % tags)
             return
 
-        if len(attrs) > 0:
-            self.file.write("  <way")
-            for ref,value in attrs.items():
-                self.file.write("    " + ref + "=\"" + value + "\"")
-            self.file.write(">\n")
-        else:
-            #try:
-            #    x = attrs['osmid']
-            #except:
-            #    attrs['id'] = str(self.osmid)
-
-            #logging.debug("osmfile::way(refs=%r, tags=%r)" % (refs, tags))
-            #logging.debug("osmfile::way(tags=%r)" % (tags))
-            self.file.write("    <way")
-            timestamp = datetime.now().strftime("%Y-%m-%dT%TZ")
-
+        if len(attrs) == 0:
+            attrs = dict()
             if modified:
-                self.file.write(" action='modified'")
-            self.file.write(" version='1'")
-            self.file.write(" id=\'" + str(self.osmid) + "\'")
-            self.file.write(" timestamp='" + timestamp + "\'>\n")
-#            self.file.write(" user='" + self.options.get('user') + "' uid='" +
-#                            str(self.options.get('uid')) + "'>'\n")
+                attrs['action'] = 'modified'
+            attrs['version'] = '1'
+            attrs['id'] = str(self.osmid)
+            attrs['timestamp'] = self.getTimestamp()
 
         # Each ref ID points to a node id. The coordinates is im the node.
+        nds = list()
         for ref in refs:
             # FIXME: Ignore any refs that point to ourself. There shouldn't be
             # any, so this is likely a bug elsewhere when parsing the geom.
-            # logging.debug("osmfile::way(ref=%r, osmid=%r)" % (ref, self.osmid))
             if ref == self.osmid:
                 break
-            self.file.write("    <nd ref=\"" + str(ref) + "\"/>\n")
-
-        value = ""
+            nds.append(ref)
 
-        for i in tags:
-            for name, value in i.items():
-                if name == "Ignore" or value == '':
-                    continue
-                if str(value)[0] != 'b':
-                    self.file.write("    <tag k=\"" + name + "\" v=\"" +
-                                    str(value) + "\"/>\n")
-
-        self.file.write("  </way>\n")
+        self.file.way(attrs, nds, self.filterTags(tags))
         self.osmid = int(self.osmid) - 1
 
     def makeRelation(self, members, tags=list(), attrs=dict()):
-        if len(attrs) > 0:
-            self.file.write("  <relation")
-            for ref,value in attrs.items():
-                self.file.write(" " + ref + "=\"" + value + "\"")
-            self.file.write(">\n")
-
-        # Each ref ID points to a node id. The coordinates is im the node.
+        # Each member is spread across several dictionaries, type, ref,
+        # and finally role, which ends the member.
+        mems = list()
+        member = dict()
         for mattr in members:
             for ref, value in mattr.items():
-                #print("FIXME: %r %r" % (ref, value))
-                if ref == 'type':
-                    self.file.write("    <member")
-                self.file.write(" " + ref + "=\"" + value + "\"")
+                member[ref] = value
                 if ref == 'role':
-                    self.file.write("/>\n")
+                    mems.append((member.get('type'), member.get('ref'), value))
+                    member = dict()
 
-        value = ""
+        self.file.relation(attrs, mems, self.filterTags(tags))
 
+    def filterTags(self, tags):
+        """Flatten a list of tag dictionaries into (key, value) pairs"""
+        newtags = list()
         for i in tags:
             for name, value in i.items():
                 if name == "Ignore" or value == '':
                     continue
                 if str(value)[0] != 'b':
-                    self.file.write("    <tag k=\"" + name + "\" v=\"" + str(value) + "\"/>\n")
-            
-        self.file.write("  </relation>\n")
+                    newtags.append((name, value))
+        return newtags
+
+    def merge(self, fragments):
+        """Copy several OSM files into this one, all the nodes first,
+        then the ways and relations. Untagged nodes at the same location
+        in different files become one, and the number of these is
+        returned."""
+        remap = dict()
+        for element in ('node', 'way', 'relation'):
+            for fragment in fragments:
+                context = ET.iterparse(fragment, events=('start', 'end'))
+                event, root = next(context)
+                for event, elem in context:
+                    if event != 'end' or elem.tag not in ('node', 'way', 'relation'):
+                        continue
+                    if elem.tag == element:
+                        self.mergeElement(elem, remap)
+                    # Drop everything parsed so far
+                    root.clear()
+        return len(remap)
+
+    def mergeElement(self, elem, remap):
+        attrs = dict(elem.attrib)
+        tags = [(tag.get('k'), tag.get('v')) for tag in elem.iter('tag')]
+        if elem.tag == 'node':
+            if len(tags) == 0:
+                osmid = self.nodeindex.get(attrs['lat'], attrs['lon'])
+                if osmid is not None:
+                    remap[attrs['id']] = str(osmid)
+                    return
+                self.nodeindex.add(attrs['lat'], attrs['lon'], attrs['id'])
+            self.file.node(attrs, tags)
+        elif elem.tag == 'way':
+            refs = [remap.get(nd.get('ref'), nd.get('ref')) for nd in elem.iter('nd')]
+            self.file.way(attrs, refs, tags)
+        else:
+            members = list()
+            for member in elem.iter('member'):
+                ref = member.get('ref')
+                if member.get('type') == 'node':
+                    ref = remap.get(ref, ref)
+                members.append((member.get('type'), ref, member.get('role')))
+            self.file.relation(attrs, members, tags)
 
     def cleanup(self, tags):
         cache = dict()
@@ -0,0 +1,272 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# This loads an OSM file into the same tables ogr2ogr makes with the
+# osmconf.ini in this directory, but without running ogr2ogr. The file
+# is read once with pyosmium, and each table is loaded with a binary
+# COPY on a connection of it's own, in another thread, so the database
+# can be writing all three tables while the file is still being read.
+
+import time
+import queue
+import struct
+import logging
+import threading
+import psycopg2
+import osmium
+
+# Send the rows to the database in chunks of about this many bytes
+CHUNKSIZE = 1024 * 1024
+# How many chunks can be waiting for each table
+QUEUESIZE = 16
+
+# Closed ways with any of these tags are areas, not lines
+POLYGONS = set(['aeroway', 'amenity', 'boundary', 'building', 'craft', 'geological',
+                'historic', 'landuse', 'leisure', 'military', 'natural', 'office',
+                'place', 'shop', 'sport', 'tourism'])
+
+# The tags that get a column of their own in each table, the others
+# go in other_tags. These match osmconf.ini.patch.
+TABLES = {
+    'points': ('name', 'barrier', 'highway', 'ref', 'address', 'is_in', 'place', 'man_made',
+               'emergency', 'landing_site', 'disused', 'note', 'water_tank', 'aeroway',
+               'description', 'tourism', 'addr:housenumber', 'addr:street', 'smoothness',
+               'surface', 'sac_scale', 'piste', 'historic', 'amenity', 'natural', 'boundary'),
+    'lines': ('name', 'highway', 'waterway', 'aerialway', 'barrier', 'man_made'),
+    'multipolygons': ('name', 'type', 'aeroway', 'amenity', 'admin_level', 'barrier', 'boundary',
+                      'building', 'craft', 'geological', 'historic', 'land_area', 'landuse',
+                      'leisure', 'man_made', 'military', 'natural', 'office', 'place', 'shop',
+                      'sport', 'tourism', 'addr:housenumber', 'addr:street', 'smoothness',
+                      'surface', 'sac_scale', 'piste'),
+}
+
+# Tags that aren't kept at all
+IGNORE = set(['created_by', 'converted_by', 'source', 'time', 'ele', 'attribution',
+              'openGeoDB:', 'fixme', 'FIXME'])
+# A node with only these tags isn't a point
+UNSIGNIFICANT = set(['created_by', 'converted_by', 'source', 'time', 'ele', 'attribution'])
+
+# The header of the binary COPY format, with no flags or extensions
+HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+TRAILER = struct.pack('!h', -1)
+NULL = struct.pack('!i', -1)
+# ogr2ogr makes every geometry a GeometryCollection, so the WKB for
+# each one is wrapped in a collection of one, with the SRID.
+COLLECTION = struct.pack('<BIII', 1, 7 | 0x20000000, 4326, 1)
+
+
+def quote(value):
+    """Quote a key or value for other_tags"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def field(value):
+    """Encode a text field for COPY"""
+    if value is None:
+        return NULL
+    data = value.encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+
+class copyTable(object):
+    """Load the rows of a table with COPY, in a thread of it's own"""
+    def __init__(self, dbname, table, extra=()):
+        self.table = table
+        self.tags = TABLES[table]
+        self.columns = ('osm_id', ) + tuple(extra) + tuple([tag.replace(':', '_') for tag in self.tags]) \
+            + ('other_tags', 'wkb_geometry')
+        self.fields = len(self.columns)
+        self.queue = queue.Queue(QUEUESIZE)
+        self.buffer = [HEADER]
+        self.buffered = len(HEADER)
+        self.done = False
+        self.failed = False
+        # Statistics for the run
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        self.db = psycopg2.connect("dbname='%s'" % dbname)
+        self.thread = threading.Thread(target=self.copy, name="copy %s" % table)
+        self.thread.start()
+
+    def copy(self):
+        # Some tags, like natural, are reserved words in SQL
+        sql = "COPY %s (%s) FROM STDIN WITH (FORMAT binary)" \
+            % (self.table, ','.join(['"%s"' % column for column in self.columns]))
+        try:
+            with self.db.cursor() as cursor:
+                cursor.copy_expert(sql, self, CHUNKSIZE)
+            self.db.commit()
+        except psycopg2.Error as e:
+            logging.error("Couldn't load %s! %r" % (self.table, e.pgerror))
+            self.db.rollback()
+            self.failed = True
+        finally:
+            # Keep reading, so the reader of the file doesn't wait
+            # forever for room in the queue.
+            while not self.done:
+                self.read()
+            self.db.close()
+            self.elapsed = time.perf_counter() - self.start
+
+    def read(self, size=-1):
+        """This is the file COPY reads from, it gets whole chunks
+        regardless of the size"""
+        if self.done:
+            return b''
+        chunk = self.queue.get()
+        if chunk is None:
+            self.done = True
+            return b''
+        return chunk
+
+    def add(self, osmid, extra, tags, wkb):
+        """Add a row, the geometry is WKB without an SRID"""
+        values = dict()
+        other = list()
+        for tag in tags:
+            if tag.k in IGNORE:
+                continue
+            if tag.k in self.tags:
+                values[tag.k] = tag.v
+            else:
+                other.append(quote(tag.k) + '=>' + quote(tag.v))
+        row = [struct.pack('!h', self.fields), field(osmid)]
+        row += [field(value) for value in extra]
+        row += [field(values.get(tag)) for tag in self.tags]
+        row.append(field(','.join(other) if len(other) > 0 else None))
+        row.append(struct.pack('!i', len(COLLECTION) + len(wkb)) + COLLECTION + wkb)
+        row = b''.join(row)
+        self.buffer.append(row)
+        self.buffered += len(row)
+        self.rows += 1
+        if self.buffered >= CHUNKSIZE:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0 and not self.done:
+            self.queue.put(b''.join(self.buffer))
+        self.buffer = list()
+        self.buffered = 0
+
+    def close(self):
+        """Wait for all the rows to be loaded"""
+        self.buffer.append(TRAILER)
+        self.flush()
+        if not self.done:
+            self.queue.put(None)
+        self.thread.join()
+        rate = 0
+        if self.elapsed > 0:
+            rate = self.rows / self.elapsed
+        logging.info("Loaded %d rows into %s in %.1f seconds, %d rows/second"
+                     % (self.rows, self.table, self.elapsed, rate))
+        return not self.failed
+
+
+class osmLoader(osmium.SimpleHandler):
+    """Load an OSM file into the points, lines, and multipolygons tables"""
+    def __init__(self, dbname):
+        super(osmLoader, self).__init__()
+        self.dbname = dbname
+        self.factory = osmium.geom.WKBFactory()
+        self.tables = dict()
+
+    def create(self):
+        """Replace the tables with empty ones"""
+        db = psycopg2.connect("dbname='%s'" % self.dbname)
+        db.autocommit = True
+        cursor = db.cursor()
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+        for table, tags in TABLES.items():
+            columns = ["osm_id character varying"]
+            if table == 'multipolygons':
+                columns.append("osm_way_id character varying")
+            columns += ['"%s" character varying' % tag.replace(':', '_') for tag in tags]
+            columns.append("other_tags character varying")
+            # The views of the subsets depend on the old tables
+            cursor.execute("DROP TABLE IF EXISTS %s CASCADE" % table)
+            cursor.execute("CREATE TABLE %s (ogc_fid serial PRIMARY KEY, %s, wkb_geometry geometry(GeometryCollection, 4326))"
+                           % (table, ', '.join(columns)))
+        db.close()
+
+    def index(self):
+        """Add the indexes ogr2ogr makes"""
+        db = psycopg2.connect("dbname='%s'" % self.dbname)
+        db.autocommit = True
+        cursor = db.cursor()
+        for table in TABLES.keys():
+            cursor.execute("CREATE INDEX %s_wkb_geometry_geom_idx ON %s USING GIST (wkb_geometry)" % (table, table))
+        db.close()
+
+    def load(self, filespec):
+        """Load an OSM file, returns True if all the tables loaded"""
+        start = time.perf_counter()
+        self.create()
+        # Every table has it's own connection, so they're all loaded at
+        # the same time.
+        self.tables['points'] = copyTable(self.dbname, 'points')
+        self.tables['lines'] = copyTable(self.dbname, 'lines')
+        self.tables['multipolygons'] = copyTable(self.dbname, 'multipolygons', ('osm_way_id', ))
+        try:
+            self.apply_file(filespec, locations=True)
+        finally:
+            loaded = [table.close() for table in self.tables.values()]
+        rows = sum([table.rows for table in self.tables.values()])
+        elapsed = time.perf_counter() - start
+        logging.info("Loaded %d rows from %s in %.1f seconds, %d rows/second"
+                     % (rows, filespec, elapsed, rows / max(elapsed, 0.001)))
+        if False in loaded:
+            return False
+        self.index()
+        return True
+
+    def node(self, n):
+        significant = [tag.k for tag in n.tags if tag.k not in UNSIGNIFICANT]
+        if len(significant) == 0:
+            return
+        wkb = bytes.fromhex(self.factory.create_point(n))
+        self.tables['points'].add(str(n.id), (), n.tags, wkb)
+
+    def way(self, w):
+        # Closed ways that are areas go in multipolygons instead
+        if w.is_closed() and len([tag for tag in w.tags if tag.k in POLYGONS]) > 0:
+            return
+        if len(w.tags) == 0:
+            return
+        try:
+            wkb = bytes.fromhex(self.factory.create_linestring(w))
+        except (osmium.InvalidLocationError, RuntimeError) as inst:
+            logging.warning("Couldn't make a line for way %d" % w.id)
+            return
+        self.tables['lines'].add(str(w.id), (), w.tags, wkb)
+
+    def area(self, a):
+        if a.from_way():
+            if len([tag for tag in a.tags if tag.k in POLYGONS]) == 0:
+                return
+            osmid = None
+            extra = (str(a.orig_id()), )
+        else:
+            osmid = str(a.orig_id())
+            extra = (None, )
+        try:
+            wkb = bytes.fromhex(self.factory.create_multipolygon(a))
+        except (osmium.InvalidLocationError, RuntimeError) as inst:
+            logging.warning("Couldn't make a polygon for %d" % a.orig_id())
+            return
+        self.tables['multipolygons'].add(osmid, extra, a.tags, wkb)
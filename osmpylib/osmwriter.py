@@ -0,0 +1,138 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# This is the output side of osmfile. Rather than calling write() for
+# every attribute and tag, each element is built as a single string and
+# appended to a buffer, which only gets written to disk once it's large.
+# On a statewide shapefile this is the difference between millions of
+# tiny writes and a few hundred big ones.
+
+import gzip
+import bz2
+import re
+import logging
+
+# Flush the buffer to disk once it holds this many characters
+BUFSIZE = 1024 * 1024
+
+# Characters that can't appear as is in an XML attribute value
+_escapes = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;',
+                          '"': '&quot;', '\n': '&#10;', '\r': '&#13;',
+                          '\t': '&#9;'})
+_special = re.compile('[&<>"\n\r\t]')
+
+
+def escape(value):
+    """Escape a value so it can be used in an XML attribute"""
+    value = str(value)
+    # Almost nothing needs escaping, and searching is much cheaper
+    # than translating.
+    if _special.search(value) is None:
+        return value
+    return value.translate(_escapes)
+
+
+def openfile(filespec, mode='wb'):
+    """Open a file, compressing it if the suffix is .gz or .bz2"""
+    if filespec.endswith('.gz'):
+        return gzip.open(filespec, mode)
+    elif filespec.endswith('.bz2'):
+        return bz2.open(filespec, mode)
+    return open(filespec, mode)
+
+
+class xmlWriter(object):
+    """Buffered writer for OSM XML files"""
+    def __init__(self, filespec, bufsize=BUFSIZE):
+        self.filespec = filespec
+        self.file = openfile(filespec)
+        self.bufsize = bufsize
+        self.buffer = list()
+        self.buffered = 0
+        # Statistics for the run
+        self.nodes = 0
+        self.ways = 0
+        self.relations = 0
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def write(self, text):
+        """Add raw text to the output buffer"""
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.file.write(''.join(self.buffer).encode('utf-8'))
+            self.buffer.clear()
+            self.buffered = 0
+
+    def header(self):
+        self.write('<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n'
+                   '<osm version="0.6" generator="gosm 0.1">\n')
+
+    def footer(self):
+        self.write("</osm>\n")
+        self.close()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+        logging.info("Wrote %d nodes, %d ways, %d relations to %s"
+                     % (self.nodes, self.ways, self.relations, self.filespec))
+
+    def attributes(self, attrs):
+        return ''.join([' %s="%s"' % (ref, escape(value))
+                        for ref, value in attrs.items()])
+
+    def tags(self, tags):
+        return ''.join(['    <tag k="%s" v="%s"/>\n' % (escape(name), escape(value))
+                        for name, value in tags])
+
+    def node(self, attrs, tags=list()):
+        """Write a node, tags is a list of (key, value) pairs"""
+        self.nodes += 1
+        if len(tags) == 0:
+            text = "  <node%s/>\n" % self.attributes(attrs)
+        else:
+            text = "  <node%s>\n%s  </node>\n" % (self.attributes(attrs), self.tags(tags))
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.bufsize:
+            self.flush()
+
+    def way(self, attrs, refs, tags=list()):
+        """Write a way, refs is the list of node IDs"""
+        self.ways += 1
+        nds = ''.join(['    <nd ref="%s"/>\n' % ref for ref in refs])
+        self.write("  <way%s>\n%s%s  </way>\n"
+                   % (self.attributes(attrs), nds, self.tags(tags)))
+
+    def relation(self, attrs, members, tags=list()):
+        """Write a relation, members is a list of (type, ref, role)"""
+        self.relations += 1
+        mems = ''.join(['    <member type="%s" ref="%s" role="%s"/>\n'
+                        % (type, ref, escape(role))
+                        for type, ref, role in members])
+        self.write("  <relation%s>\n%s%s  </relation>\n"
+                   % (self.attributes(attrs), mems, self.tags(tags)))
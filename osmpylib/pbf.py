@@ -0,0 +1,215 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# This writes the OSM PBF format, which is much smaller than the XML
+# format, and faster to load into JOSM, osmium, or ogr2ogr. The format
+# is documented at https://wiki.openstreetmap.org/wiki/PBF_Format.
+# Rather than add a dependency on the protobuf module for four message
+# types, the encoding is done here. Elements are collected into blocks
+# of 8000, and each block is compressed and written as soon as it's
+# full, so memory use doesn't depend on the size of the output file.
+
+import struct
+import zlib
+import logging
+
+# The most entities the spec recommends for a single block
+BLOCKSIZE = 8000
+# Coordinates are stored as integers in units of 100 nanodegrees
+GRANULARITY = 100
+
+# Protobuf wire types
+VARINT = 0
+LENGTH = 2
+
+# Relation member types
+memtypes = {'node': 0, 'way': 1, 'relation': 2}
+
+
+def varint(value):
+    """Encode an unsigned integer as a protobuf varint"""
+    # Negative int64 values are sent as their 64 bit two's complement
+    value &= 0xffffffffffffffff
+    data = bytearray()
+    while value > 0x7f:
+        data.append((value & 0x7f) | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def zigzag(value):
+    """Map a signed integer to an unsigned one for sint64 fields"""
+    return (value << 1) ^ (value >> 63)
+
+
+def field(number, value):
+    """Encode an integer field"""
+    return varint(number << 3 | VARINT) + varint(value)
+
+
+def message(number, data):
+    """Encode a string, bytes, or embedded message field"""
+    return varint(number << 3 | LENGTH) + varint(len(data)) + data
+
+
+def packed(number, values):
+    """Encode a packed repeated integer field"""
+    return message(number, b''.join([varint(value) for value in values]))
+
+
+def delta(values):
+    """Delta code a list of signed integers"""
+    previous = 0
+    deltas = list()
+    for value in values:
+        deltas.append(zigzag(value - previous))
+        previous = value
+    return deltas
+
+
+class pbfWriter(object):
+    """Writer for OSM PBF files"""
+    def __init__(self, filespec, blocksize=BLOCKSIZE):
+        self.filespec = filespec
+        self.file = open(filespec, 'wb')
+        self.blocksize = blocksize
+        self.reset()
+        # Statistics for the run
+        self.nodes = 0
+        self.ways = 0
+        self.relations = 0
+        self.blocks = 0
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def reset(self):
+        """Start a new block"""
+        # The first entry in the string table is always empty
+        self.strings = {'': 0}
+        self.stringtable = [b'']
+        self.nodeids = list()
+        self.lats = list()
+        self.lons = list()
+        self.keysvals = list()
+        self.waybuf = list()
+        self.relbuf = list()
+        self.entities = 0
+
+    def string(self, value):
+        """Get the string table index of a value"""
+        value = str(value)
+        try:
+            return self.strings[value]
+        except KeyError:
+            index = len(self.stringtable)
+            self.strings[value] = index
+            self.stringtable.append(value.encode('utf-8'))
+            return index
+
+    def blob(self, type, data):
+        """Compress and write a blob, with it's header"""
+        blob = field(2, len(data)) + message(3, zlib.compress(data))
+        header = message(1, type.encode('utf-8')) + field(3, len(blob))
+        self.file.write(struct.pack('!L', len(header)) + header + blob)
+
+    def write(self, text):
+        logging.error("Can't write raw XML to a PBF file!")
+
+    def header(self):
+        block = message(4, b'OsmSchema-V0.6')
+        block += message(4, b'DenseNodes')
+        block += message(16, b'gosm 0.1')
+        self.blob('OSMHeader', block)
+
+    def footer(self):
+        self.close()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+        logging.info("Wrote %d nodes, %d ways, %d relations in %d blocks to %s"
+                     % (self.nodes, self.ways, self.relations, self.blocks, self.filespec))
+
+    def flush(self):
+        """Write the current block"""
+        if self.entities == 0:
+            return
+        groups = b''
+        if len(self.nodeids) > 0:
+            dense = packed(1, delta(self.nodeids))
+            dense += packed(8, delta(self.lats))
+            dense += packed(9, delta(self.lons))
+            dense += packed(10, self.keysvals)
+            groups += message(2, message(2, dense))
+        if len(self.waybuf) > 0:
+            groups += message(2, b''.join([message(3, way) for way in self.waybuf]))
+        if len(self.relbuf) > 0:
+            groups += message(2, b''.join([message(4, rel) for rel in self.relbuf]))
+        strings = message(1, b''.join([message(1, s) for s in self.stringtable]))
+        self.blob('OSMData', strings + groups + field(17, GRANULARITY))
+        self.blocks += 1
+        self.reset()
+
+    def added(self):
+        self.entities += 1
+        if self.entities >= self.blocksize:
+            self.flush()
+
+    def tags(self, tags):
+        keys = list()
+        vals = list()
+        for name, value in tags:
+            keys.append(self.string(name))
+            vals.append(self.string(value))
+        return packed(2, keys) + packed(3, vals)
+
+    # PBF has no place for the JOSM action attribute, and new data has
+    # no history, so only the ID and location are kept from attrs.
+    def node(self, attrs, tags=list()):
+        """Write a node, tags is a list of (key, value) pairs"""
+        self.nodes += 1
+        self.nodeids.append(int(attrs['id']))
+        self.lats.append(int(round(float(attrs['lat']) * 1e9 / GRANULARITY)))
+        self.lons.append(int(round(float(attrs['lon']) * 1e9 / GRANULARITY)))
+        for name, value in tags:
+            self.keysvals.append(self.string(name))
+            self.keysvals.append(self.string(value))
+        self.keysvals.append(0)
+        self.added()
+
+    def way(self, attrs, refs, tags=list()):
+        """Write a way, refs is the list of node IDs"""
+        self.ways += 1
+        way = field(1, int(attrs['id'])) + self.tags(tags)
+        way += packed(8, delta([int(ref) for ref in refs]))
+        self.waybuf.append(way)
+        self.added()
+
+    def relation(self, attrs, members, tags=list()):
+        """Write a relation, members is a list of (type, ref, role)"""
+        self.relations += 1
+        rel = field(1, int(attrs['id'])) + self.tags(tags)
+        rel += packed(8, [self.string(role) for type, ref, role in members])
+        rel += packed(9, delta([int(ref) for type, ref, role in members]))
+        rel += packed(10, [memtypes[type] for type, ref, role in members])
+        self.relbuf.append(rel)
+        self.added()
@@ -18,9 +18,10 @@
 # 
 
 import pdb
+import os
 import glob
+import hashlib
 import psycopg2
-import subprocess
 import config
 import logging
 from shapely.geometry import MultiPolygon
@@ -32,9 +33,9 @@ class pgdb(object):
         self.config = config
         self.dbname = ""
         self.result = ""
+        self.dbshell = None
+        self.dbcursor = None
         # self.config.dump()
-# Load the SQL functions from osmsqllib
-        self.load_functions()
         self.geometry = None
         #self.geometry =  MultiPolygon()
 
@@ -58,44 +59,73 @@ class pgdb(object):
 
         except Exception as e:
             print("Couldn't connect to database: %r" % e)
-        
+            return
+
+        self.dbname = dbname
+        # Load the SQL functions from osmsqllib
+        self.load_functions()
+
     # List the SQL functions in a database
     # func = optional function name to limit the results
     def list_functions(self, func=''):
-        cmdline = list()
-        cmdline.append("psql")
-        cmdline.append("--dbname=" + self.dbname)
-        cmdline.append("--command=\df " + func)
         try:
-            subprocess.call(cmdline, stdout=subprocess.DEVNULL)
-        except:
-            self.verbose.warning("Couldn't list function: %r" % func)
-            out = False
-            
-        return True
+            self.dbcursor.execute("SELECT p.proname, pg_get_function_arguments(p.oid) FROM pg_proc p"
+                                  " JOIN pg_namespace n ON n.oid=p.pronamespace"
+                                  " WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')"
+                                  " AND p.proname LIKE %s ORDER BY p.proname", (func + '%', ))
+            functions = self.dbcursor.fetchall()
+        except (psycopg2.Error, AttributeError) as e:
+            logging.warning("Couldn't list function: %r" % func)
+            return list()
+
+        return functions
 
-    # Load all the SQL files that define our functions
+    # Load all the SQL files that define our functions. This is done in
+    # a single transaction over the open connection, and each file's
+    # checksum is kept in the database, so only the files that have
+    # changed since the last time are loaded.
     def load_functions(self):
         top = self.config.get('toplevel')
+        if not top:
+            logging.debug("No directory of SQL functions to load")
+            return True
         files = list()
         try:
-            files = glob.glob(top + "/*.sql")
+            files = sorted(glob.glob(top + "/*.sql"))
         except Exception as inst:
             logging.error(inst)
             return
-            
+
+        found = list()
         for file in files:
-            cmdline = list()
-            cmdline.append("psql")
-            cmdline.append("--dbname=" + self.dbname)
-            cmdline.append("--file=" + file)
-            self.verbose.log("Loading SQL functions from file: %r" % file)
-            try:
-                subprocess.call(cmdline, stdout=subprocess.DEVNULL)
-            except:
-                logging.warning("Couldn't load: %r" + file)
-                return False
+            with open(file, 'r') as sql:
+                text = sql.read()
+            found.append((os.path.basename(file), hashlib.sha1(text.encode('utf-8')).hexdigest(), text))
 
+        self.dbshell.autocommit = False
+        try:
+            self.dbcursor.execute("CREATE TABLE IF NOT EXISTS sql_functions (file text PRIMARY KEY, checksum text)")
+            self.dbcursor.execute("SELECT file, checksum FROM sql_functions")
+            loaded = dict(self.dbcursor.fetchall())
+            count = 0
+            for file, checksum, text in found:
+                if loaded.get(file) == checksum:
+                    continue
+                logging.info("Loading SQL functions from file: %r" % file)
+                self.dbcursor.execute(text)
+                self.dbcursor.execute("INSERT INTO sql_functions VALUES (%s, %s)"
+                                      " ON CONFLICT (file) DO UPDATE SET checksum=EXCLUDED.checksum",
+                                      (file, checksum))
+                count += 1
+            self.dbshell.commit()
+        except psycopg2.Error as e:
+            logging.warning("Couldn't load the SQL functions: %r" % e.pgerror)
+            self.dbshell.rollback()
+            return False
+        finally:
+            self.dbshell.autocommit = True
+
+        logging.debug("Loaded %d of %d SQL function files" % (count, len(files)))
         return True
 
     # Get a list of all the SQL functions in a sub directory. This assumes
@@ -126,17 +156,16 @@ class pgdb(object):
         return self.result
 
     def shell(self, cmd):
-        cmdline = list()
-        cmdline.append("psql")
-        if len(self.config.get('dbname')) > 0:
-            cmdline.append("--dbname=" + str(self.config.get('dbname')))
-        cmdline.append("--command=" + cmd)
-        self.verbose.log(cmdline)
+        """Run a command that doesn't return anything"""
+        logging.debug("pgdb.shell(%r)" % cmd)
+        if self.dbcursor is None:
+            logging.error("Not connected to a database!")
+            return False
         try:
-            subprocess.call(cmdline, stdout=subprocess.DEVNULL)
+            self.dbcursor.execute(cmd)
             out = True
-        except:
-            self.verbose.warning("Couldn't list function: %r" % func)
+        except psycopg2.Error as e:
+            logging.warning("Couldn't run %r: %r" % (cmd, e.pgerror))
             out = False
             
         return out
@@ -146,7 +175,8 @@ class pgdb(object):
         #print("\tDBname: " + self.config.get('dbname'))
         #print("\tDBuser: " + self.config.get('dbuser'))
         #print("\tDBpass: " + self.config.get('dbpass'))
-        self.list_functions()
+        for name, args in self.list_functions():
+            print("Function: %s(%s)" % (name, args))
         if self.dbshell.closed == 0:
             status = "Open"
         else:
@@ -0,0 +1,189 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# A database only changes when data is imported into it, but osm2kml
+# runs the same queries against it every time it makes a map. This
+# keeps the results on disk, one file for each query, as the column
+# names followed by the rows in batches, so a streamed query can be
+# replayed without reading it all into memory. The key includes the
+# generation stamp importOSM() writes, so an import makes the old
+# results unreachable, and they age out when the cache gets too big.
+
+import os
+import pickle
+import hashlib
+import logging
+import threading
+
+CACHEDIR = os.path.join(os.path.expanduser("~"), ".cache", "osmtools", "queries")
+# The most disk space the cache can use before the least recently
+# used results are removed
+CACHESIZE = 1024 * 1024 * 1024
+
+
+class cacheWriter(object):
+    """Write the results of one query to the cache"""
+    def __init__(self, cache, key, names):
+        self.cache = cache
+        self.filespec = cache.filespec(key)
+        # Other threads or processes can be writing the same query
+        self.tmpfile = "%s.%d.%d.tmp" % (self.filespec, os.getpid(), threading.get_ident())
+        self.file = open(self.tmpfile, 'wb')
+        pickle.dump(names, self.file, pickle.HIGHEST_PROTOCOL)
+
+    def add(self, lines):
+        """Add a batch of rows"""
+        # A bytea column is returned as a memoryview, which can't be
+        # pickled.
+        lines = [tuple([bytes(value) if isinstance(value, memoryview) else value for value in line])
+                 for line in lines]
+        pickle.dump(lines, self.file, pickle.HIGHEST_PROTOCOL)
+
+    def commit(self):
+        """All the rows have been added"""
+        self.file.close()
+        size = os.path.getsize(self.tmpfile)
+        # This can replace the same query written by another thread
+        try:
+            size -= os.path.getsize(self.filespec)
+        except OSError as inst:
+            pass
+        os.replace(self.tmpfile, self.filespec)
+        self.cache.added(size)
+
+    def abort(self):
+        """The query failed or wasn't finished, so forget it"""
+        if self.file.closed:
+            return
+        self.file.close()
+        os.remove(self.tmpfile)
+
+
+class queryCache(object):
+    """Cache of query results, stored on disk"""
+    def __init__(self, cachedir=CACHEDIR, limit=CACHESIZE):
+        self.cachedir = cachedir
+        self.limit = limit
+        os.makedirs(cachedir, exist_ok=True)
+        # The writers and lookups run in the worker threads
+        self.lock = threading.Lock()
+        # The directory is only scanned again when this goes over the
+        # limit
+        self.size = sum([entry[1] for entry in self.scan()])
+        # Statistics for the run
+        self.lookups = 0
+        self.hits = 0
+
+    def key(self, *args):
+        """Make a key from anything with a repr()"""
+        return hashlib.sha1(repr(args).encode('utf-8')).hexdigest()
+
+    def filespec(self, key):
+        return os.path.join(self.cachedir, key + ".pickle")
+
+    def get(self, key):
+        """Get the column names and a generator of the batches of rows
+        for a key, or None"""
+        with self.lock:
+            self.lookups += 1
+        filespec = self.filespec(key)
+        try:
+            file = open(filespec, 'rb')
+            names = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError) as inst:
+            return None
+        with self.lock:
+            self.hits += 1
+        # The modification time is when it was last used
+        try:
+            os.utime(filespec)
+        except OSError as inst:
+            pass
+        return names, self.batches(file)
+
+    def batches(self, file):
+        with file:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    return
+
+    def writer(self, key, names):
+        """Start adding the results of a query"""
+        try:
+            return cacheWriter(self, key, names)
+        except OSError as inst:
+            logging.warning("Couldn't write to %s: %r" % (self.cachedir, inst))
+            return None
+
+    def scan(self):
+        """Get the modification time, size, and path of each result"""
+        entries = list()
+        for entry in os.scandir(self.cachedir):
+            if not entry.name.endswith(".pickle"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError as inst:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def added(self, size):
+        """A result changed the size of the cache by size bytes"""
+        with self.lock:
+            self.size += size
+            if self.size > self.limit:
+                self.evict()
+
+    def evict(self):
+        """Remove the least recently used results, until the cache is
+        under the size limit. The lock has to be held."""
+        # Another process may have changed the cache, so this is the
+        # real size
+        entries = self.scan()
+        total = sum([entry[1] for entry in entries])
+        self.size = total
+        if total <= self.limit:
+            return
+        entries.sort()
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except OSError as inst:
+                continue
+            total -= size
+            removed += 1
+        self.size = total
+        logging.debug("Removed %d old query results from %s" % (removed, self.cachedir))
+
+    def close(self):
+        with self.lock:
+            hits, lookups = self.hits, self.lookups
+        logging.info("Query cache: %d hits of %d lookups (%.1f%%) in %s"
+                     % (hits, lookups, self.ratio() * 100, self.cachedir))
+
+    def ratio(self):
+        """The fraction of lookups that found a result"""
+        with self.lock:
+            if self.lookups == 0:
+                return 0.0
+            return self.hits / self.lookups
@@ -0,0 +1,104 @@
+#
+# Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# When making a map is slow, this shows which queries are to blame.
+# Postgis records the time, rows, and bytes of every query here, and
+# the first time a query takes longer than the threshold, the plan
+# from EXPLAIN (ANALYZE, BUFFERS) is kept too. Postgis only calls this
+# if it has one, so it costs nothing when it's not used.
+
+import json
+import logging
+import threading
+
+
+class queryStats(object):
+    """Statistics for the queries in a run"""
+    def __init__(self, threshold=None):
+        # Explain the queries that take longer than this many seconds
+        self.threshold = threshold
+        self.queries = dict()
+        # Sessions in other threads share this
+        self.lock = threading.Lock()
+
+    def size(self, lines):
+        """Approximate bytes in a batch of rows, the text and binary
+        values are most of it"""
+        total = 0
+        for line in lines:
+            for value in line:
+                if isinstance(value, (str, bytes, memoryview)):
+                    total += len(value)
+                elif value is not None:
+                    total += 8
+        return total
+
+    def add(self, name, query, elapsed, rows=0, size=0, error=None):
+        """Add a query, returns True if it should be explained"""
+        with self.lock:
+            try:
+                entry = self.queries[name]
+            except KeyError:
+                entry = self.queries[name] = {'name': name, 'query': query, 'calls': 0,
+                                              'time': 0.0, 'max': 0.0, 'rows': 0,
+                                              'bytes': 0, 'errors': 0, 'plan': None}
+            entry['calls'] += 1
+            entry['time'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            entry['rows'] += rows
+            entry['bytes'] += size
+            if error is not None:
+                entry['errors'] += 1
+                entry['error'] = error
+                return False
+            if self.threshold is None or elapsed < self.threshold or entry['plan'] is not None:
+                return False
+            # Only the first slow call is explained
+            entry['plan'] = ""
+            return True
+
+    def explained(self, name, plan):
+        with self.lock:
+            self.queries[name]['plan'] = plan
+
+    def entries(self):
+        """The queries, slowest total time first"""
+        return sorted(self.queries.values(), key=lambda entry: entry['time'], reverse=True)
+
+    def summary(self):
+        """Print a table of the queries"""
+        print("%-28s %6s %9s %9s %9s %9s %11s %6s" % ("Query", "Calls", "Total(s)", "Mean(ms)",
+                                                       "Max(ms)", "Rows", "Bytes", "Errors"))
+        for entry in self.entries():
+            print("%-28s %6d %9.3f %9.1f %9.1f %9d %11d %6d"
+                  % (entry['name'][:28], entry['calls'], entry['time'],
+                     entry['time'] * 1000 / entry['calls'], entry['max'] * 1000,
+                     entry['rows'], entry['bytes'], entry['errors']))
+        for entry in self.entries():
+            if entry['plan']:
+                print("\nSlow query %s: %s\n%s" % (entry['name'], entry['query'], entry['plan']))
+
+    def dump(self, filespec):
+        """Write the statistics as JSON"""
+        try:
+            with open(filespec, 'w') as file:
+                json.dump(self.entries(), file, indent=2)
+        except OSError as inst:
+            logging.error("Couldn't write %s: %r" % (filespec, inst))
+            return False
+        logging.info("Wrote query statistics to %s" % filespec)
+        return True
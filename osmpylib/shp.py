@@ -19,10 +19,18 @@
 import logging
 import shapefile
 import sys
+import os
 import re
 import epdb
 import time
+import tempfile
+import shutil
+import multiprocessing
 import correct
+import osm
+
+# Each process gets a range of this many negative IDs to use
+IDRANGE = 100000000
 
 # This class holds a field from the Shapefile. It has 4 fields.
 # Name - name of the field
@@ -77,6 +85,7 @@ class shpfile(object):
         
     def open(self, file):
         logging.info("Opened shp input files: %s" % file)
+        self.filespec = file
         self.sf = shapefile.Reader(file)
         shpfile = file + ".shp"
         self.shp = open(shpfile, "rb")
@@ -84,7 +93,6 @@ class shpfile(object):
         # self.dbf = open(dbffile, "rb")
         # self.sf = shapefile.Reader(shp=shpfile, dbf=dbffile)
         self.fields = self.sf.fields
-        self.shapeRecs = self.sf.shapeRecords()
 
     # Dump the contents of the Shapefile.
     def dump(self):
@@ -136,10 +144,15 @@ class shpfile(object):
             silly.write("\n")
         return
 
-    def makeOSM(self, osm):
+    def makeOSM(self, osm, start=0, stop=None):
         silly = sys.stdout
         osm.header()
-        shapeRecs = self.sf.iterShapeRecords()
+        if stop is None:
+            shapeRecs = self.sf.iterShapeRecords()
+        else:
+            # Only read this slice of the records, which uses the
+            # offsets in the .shx file
+            shapeRecs = (self.sf.shapeRecord(i) for i in range(start, stop))
         silly.write("   Processing OSM file: \r")
         for entry in shapeRecs:
             #print("FIXME TYPE: %r" % (entry.shape.shapeType))
@@ -300,7 +313,9 @@ class shpfile(object):
                 lat = point[1]
                 attrs['lat'] = str(lat)
                 if self.options.get('type') == "line":
-                    node = osm.node(list(), attrs)
+                    # Shared vertices use the same node, so the ways
+                    # are connected
+                    node = osm.vertex(lat, lon)
                 else:
                     node = osm.node(alltags, attrs)
                 refs.append(node)
@@ -320,6 +335,51 @@ class shpfile(object):
                 osm.makeWay(refs, alltags)
 
         osm.footer()
+        if stop is None:
+            self.reused(osm.nodeindex.hits, osm.nodeindex.lookups)
+
+    def makeOSMJobs(self, osm, jobs):
+        """Split the records between several processes, and then merge
+        the files they write"""
+        records = len(self.sf)
+        step = -(-records // jobs)
+        tmpdir = tempfile.mkdtemp(prefix="shp2map")
+        slices = list()
+        for start in range(0, records, step):
+            fragment = os.path.join(tmpdir, "%d.osm" % len(slices))
+            osmid = osm.osmid - len(slices) * IDRANGE
+            slices.append((self.options, self.filespec, fragment, start,
+                           min(start + step, records), osmid))
+        logging.info("Converting %d records with %d processes" % (records, len(slices)))
+
+        pool = multiprocessing.Pool(jobs)
+        results = pool.map(convertSlice, slices)
+        pool.close()
+        pool.join()
+
+        hits = 0
+        lookups = 0
+        for args, result in zip(slices, results):
+            if result[0] <= args[5] - IDRANGE:
+                logging.error("%s used more than %d IDs!" % (args[2], IDRANGE))
+                shutil.rmtree(tmpdir)
+                return False
+            hits += result[1]
+            lookups += result[2]
+
+        osm.header()
+        # Vertices shared by records in different slices are only
+        # found when merging
+        hits += osm.merge([args[2] for args in slices])
+        osm.footer()
+        shutil.rmtree(tmpdir)
+        self.reused(hits, lookups)
+        return True
+
+    def reused(self, hits, lookups):
+        if lookups > 0:
+            print("Reused %d of %d vertices, %.1f%% deduplicated"
+                  % (hits, lookups, hits * 100.0 / lookups))
 
     def makeKML(self, kml):
         kml.header('TODO')
@@ -360,3 +420,16 @@ class shpfile(object):
             i = i + 1
 
         return columns
+
+
+def convertSlice(args):
+    """Convert a slice of the records to an OSM file, this is run by
+    each process started by shpfile.makeOSMJobs()"""
+    options, infile, fragment, start, stop, osmid = args
+    shp = shpfile(options)
+    shp.open(infile)
+    # The fragments are always XML, as they get parsed again to merge them
+    out = osm.osmfile(options, fragment, 'osm')
+    out.osmid = osmid
+    shp.makeOSM(out, start, stop)
+    return out.osmid, out.nodeindex.hits, out.nodeindex.lookups
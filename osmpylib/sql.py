@@ -22,23 +22,155 @@
 
 import epdb
 import psycopg2
+import psycopg2.extras
+from psycopg2.pool import ThreadedConnectionPool
 import sqlparse
 import logging
+import re
 from shapely.geometry import GeometryCollection, Point, LineString, Polygon
 from shapely import wkt, wkb
+import numpy as np
+try:
+    # Shapely 2 can decode a whole array of geometries at once
+    from shapely import from_wkb
+except ImportError:
+    from_wkb = None
 from subprocess import PIPE, Popen, STDOUT
 import os
 import sys
+import time
+import uuid
 ON_POSIX = 'posix' in sys.builtin_module_names
 from sys import argv
 sys.path.append(os.path.dirname(argv[0]) + '/osmpylib')
 from poly import Poly
+from querycache import queryCache
+try:
+    # Loading the file in python needs pyosmium, otherwise use ogr2ogr
+    from osmload import osmLoader
+except ImportError:
+    osmLoader = None
+
+# How many rows to get from the server at a time when streaming
+ITERSIZE = 2000
+
+# The layers of features that are in an area, as the table, the
+# columns, and which features to select.
+LAYERS = {
+    'trails': ("lines", "osm_id,name,highway,other_tags", "highway='path'"),
+    'addresses': ("points", "osm_id,name,addr_housenumber,addr_street",
+                  "addr_housenumber is not NULL"),
+    'campsites': ("points", "osm_id,ref,name,other_tags",
+                  "(tourism='camp_pitch' OR tourism='camp_site')"),
+    'firewater': ("points", "osm_id,ref,name,emergency",
+                  "(emergency='fire_hydrant' OR emergency='water_tank' OR emergency='fire_water_pond')"),
+}
+
+# One materialized view for each subset osm2kml makes, as the table,
+# the tags it needs, and which features to select. Each tag becomes an
+# indexed column of the view, taken out of other_tags if ogr2ogr didn't
+# already make a column for it. In the filter, %(tag)s is the tag.
+SUBSETS = {
+    'trails': ("lines", ("highway", ), "%(highway)s='path'"),
+    'piste': ("lines", ("piste:type", "piste:difficulty"), "%(piste:type)s IS NOT NULL"),
+    'firewater': ("points", ("emergency", "ref"),
+                  "%(emergency)s IN ('fire_hydrant', 'water_tank', 'fire_water_pond')"),
+    'hotsprings': ("points", ("natural", "amenity", "bath:type", "description"),
+                   "%(natural)s='hot_spring' OR %(amenity)s='hot_spring' OR %(bath:type)s='hot_spring'"
+                   " OR name LIKE '%%Hot Spring%%'"),
+    'landingzones': ("points", ("emergency", "aeroway"),
+                     "%(aeroway)s IN ('helipad', 'heliport') OR %(emergency)s='landing_site'"),
+    'campgrounds': ("multipolygons", ("tourism", "boundary"),
+                    "%(tourism)s='camp_site' AND %(boundary)s IS NOT NULL"),
+    'campsites': ("points", ("tourism", "ref"), "%(tourism)s IN ('camp_pitch', 'camp_site')"),
+    'milestones': ("points", ("highway", ), "%(highway)s='milestone'"),
+    'addresses': ("points", ("addr:housenumber", "addr:street"), "%(addr:housenumber)s IS NOT NULL"),
+}
+
+# The typed geometry column added to each table after an import, and
+# the geometry type ST_CollectionExtract() gets from the collection.
+GEOMETRIES = {
+    'points': ("MultiPoint", 1),
+    'lines': ("MultiLineString", 2),
+    'multipolygons': ("MultiPolygon", 3),
+}
+
+# A key and value in other_tags, when it's text instead of an hstore
+_hstore = re.compile(r'"((?:[^"\\]|\\.)*)"\s*=>\s*(?:"((?:[^"\\]|\\.)*)"|NULL)')
+_unescape = re.compile(r'\\(.)')
+
+
+def hstore(text):
+    """Parse the text form of an hstore into a dict"""
+    tags = dict()
+    for match in _hstore.finditer(text):
+        key, value = match.groups()
+        if value is not None:
+            value = _unescape.sub(r'\1', value)
+        tags[_unescape.sub(r'\1', key)] = value
+    return tags
+
+
+class Row(object):
+    """A row returned by a query, which works like a dict. The column
+    names are shared by all the rows from the same query, and the
+    tags from other_tags are only kept if there are any."""
+    __slots__ = ('layout', 'values', 'tags')
+
+    def __init__(self, layout, values, tags=None):
+        self.layout = layout
+        self.values = values
+        self.tags = tags
+
+    def __getitem__(self, key):
+        index = self.layout.get(key)
+        if index is not None:
+            return self.values[index]
+        if self.tags is not None:
+            return self.tags[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        index = self.layout.get(key)
+        if index is not None:
+            self.values[index] = value
+        else:
+            if self.tags is None:
+                self.tags = dict()
+            self.tags[key] = value
+
+    def __contains__(self, key):
+        return key in self.layout or (self.tags is not None and key in self.tags)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = list(self.layout.keys())
+        if self.tags is not None:
+            keys += [key for key in self.tags if key not in self.layout]
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
 
 
 class Postgis(object):
     """A class to work with a postgresql/postgis database"""
 
-    def __init__(self, dbname=None, dbhost=None):
+    def __init__(self, dbname=None, dbhost=None, binary=True, cache=None, stats=None):
         #if dbname is not None or dbhost is not None:
         #    self.connect(dbhost, dbname)
         self.database = dbname
@@ -48,6 +180,28 @@ class Postgis(object):
         self.dbshell = None
         self.dbcursor = None
         self.fields = list()
+        # Each streaming query needs it's own server side cursor
+        self.cursors = 0
+        # The column layout for each set of columns a query returns
+        self.layouts = dict()
+        # Get the geometries as binary WKB instead of hex
+        self.binary = binary
+        # The areas in the temporary table, by their WKB
+        self.areas = dict()
+        # The prepared statements in this session
+        self.prepared = set()
+        # The tables with a typed geometry column
+        self.typed = set()
+        # The subsets that have a materialized view
+        self.views = set()
+        # The connections for other threads, if there is more than one
+        self.pool = None
+        # The cache of query results, if there is one
+        self.cache = cache
+        # The stamp importOSM() wrote, None if there isn't one
+        self.generation = None
+        # The statistics for each query, if they are wanted
+        self.stats = stats
 
     def parse(self, sql):
         self.fields = list()
@@ -59,8 +213,10 @@ class Postgis(object):
                     # logging.info("TOKEN: %r %s" % (token, type(token)))
         return self.fields
 
-    def connect(self, dbserver='localhost', database='postgres'):
-        """Connect to a local or remote postgresql server"""
+    def connect(self, dbserver='localhost', database='postgres', jobs=1):
+        """Connect to a local or remote postgresql server. If jobs is
+        more than one, the connections come from a pool, so each thread
+        can get a session() of it's own."""
 
         self.database = database
         self.dbserver = dbserver
@@ -77,7 +233,12 @@ class Postgis(object):
 
         logging.debug("postgresql.connect(%r)" % connect)
         try:
-            self.dbshell = psycopg2.connect(connect)
+            if jobs > 1:
+                # One for this session, and one for each thread
+                self.pool = ThreadedConnectionPool(1, jobs + 1, connect)
+                self.dbshell = self.pool.getconn()
+            else:
+                self.dbshell = psycopg2.connect(connect)
         except psycopg2.OperationalError as e:
             logging.debug("%s doesn't exist! %r" % (database, e.diag.message_primary))
 
@@ -86,23 +247,70 @@ class Postgis(object):
             quit()
 
         if self.dbshell.closed == 0:
-            self.dbshell.autocommit = True
-            logging.info("Opened connection to %r %r" % (database, self.dbshell))
-
-            self.dbcursor = self.dbshell.cursor()
-            if self.dbcursor.closed == 0:
-                logging.info("Opened cursor in %r %r" % (database, self.dbcursor))
-            self.dbcursor = self.dbshell.cursor()
+            self.setup()
         else:
             logging.warning("DB Shell already open")
         # self.addExtensions()
 
+    def setup(self):
+        """Start a new session on an open connection"""
+        self.dbshell.autocommit = True
+        logging.info("Opened connection to %r %r" % (self.database, self.dbshell))
+
+        self.dbcursor = self.dbshell.cursor()
+        if self.dbcursor.closed == 0:
+            logging.info("Opened cursor in %r %r" % (self.database, self.dbcursor))
+        # Temporary tables and prepared statements go away with
+        # the old session
+        self.areas = dict()
+        self.prepared = set()
+        self.findTyped()
+        self.findViews()
+        self.findGeneration()
+        # Decode hstore columns to a dict, if the database has them
+        try:
+            psycopg2.extras.register_hstore(self.dbshell)
+        except psycopg2.ProgrammingError as e:
+            logging.debug("No hstore in %s, other_tags is text" % self.database)
+
+    def session(self):
+        """Get a Postgis with a connection of it's own from the pool,
+        to use in another thread. Without a pool, this is the only
+        session there is."""
+        if self.pool is None:
+            return self
+        pg = Postgis(self.database, self.dbserver, self.binary, self.cache, self.stats)
+        pg.pool = self.pool
+        pg.dbshell = self.pool.getconn()
+        pg.setup()
+        return pg
+
+    def release(self):
+        """Give the connection of a session() back to the pool"""
+        if self.pool is None or self.dbshell is None:
+            return
+        # The next session on this connection starts out clean, without
+        # our temporary tables, cursors, or prepared statements.
+        try:
+            self.dbcursor.execute("DISCARD ALL")
+        except psycopg2.Error as e:
+            logging.warning("Couldn't reset the session! %r" % e.pgerror)
+        self.pool.putconn(self.dbshell)
+        self.dbshell = None
+        self.dbcursor = None
+
     def addPolygon(self, poly):
         wkt = poly.getGeometry().getWkt()
         self.boundpoints = "AND ST_Contains(ST_GeomFromText(%s, 4326), ST_CollectionExtract(wkb_geometry, 1))" % wkt
         self.boundlines = "AND ST_Contains(ST_GeomFromText(%s, 4326), ST_CollectionExtract(wkb_geometry, 2))" % wkt
 
     def close(self):
+        if self.cache is not None:
+            self.cache.close()
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+            return
         self.dbshell.close()
 
     def initDB(self, dbname):
@@ -115,84 +323,354 @@ class Postgis(object):
         pg.query("CREATE DATABASE %s" % dbname)
         pg.close()
 
-    def query(self, query=""):
-        """Query a local or remote postgresql database"""
+    def query(self, query="", params=None, key=None, name=None):
+        """Query a local or remote postgresql database. If there is a
+        key, the results are added to the cache."""
         logging.debug("postgresql.query(" + query + ")")
         if self.dbshell.closed != 0:
-            logging.error("Database %r is not connected!" % self.options.get('database'))
+            logging.error("Database %r is not connected!" % self.database)
             return self.result
 
         self.result = list()
+        start = time.perf_counter()
         try:
-            self.dbcursor.execute(query)
+            self.dbcursor.execute(query, params)
             # logging.info("Got %r records from query." % self.dbcursor.rowcount)
-        except Exception as e:
-            if e.pgcode != None:
-                logging.error("Query failed to fetch! %r" % e.pgerror)
-                logging.error("Query failed: %r" % query)
-
-        fields = self.parse(query)
-        # logging.debug("FIXME fields(%d): %r" % (self.dbcursor.rowcount, fields))
-        
+        except psycopg2.Error as e:
+            logging.error("Query failed to fetch! %r" % e.pgerror)
+            logging.error("Query failed: %r" % query)
+            if self.stats is not None:
+                self.record(name, query, params, time.perf_counter() - start, error=str(e))
+            return None
+
         try:
-            line = self.dbcursor.fetchone()
-        except:
+            lines = self.dbcursor.fetchall()
+        except psycopg2.ProgrammingError:
+            # Nothing was returned
             return None
-        while line is not None:
-            i = 0
-            data = dict()
+        # Get the columns before anything else uses the cursor
+        names = tuple([column.name for column in self.dbcursor.description])
+        layout = self.getLayout(names)
+        if self.stats is not None:
+            self.record(name, query, params, time.perf_counter() - start, lines)
+        writer = self.cacheWriter(key, names)
+        if writer is not None:
+            writer.add(lines)
+            writer.commit()
+        self.result = self.makeRows(layout, lines)
+
+        return self.result
+
+    def iterquery(self, query="", itersize=ITERSIZE, params=None, key=None, name=None, withhold=False):
+        """Query a local or remote postgresql database, and return each
+        row as it arrives instead of all of them at the end. If there
+        is a key, the results are added to the cache. withhold is only
+        needed if the caller commits while iterating."""
+        logging.debug("postgresql.iterquery(" + query + ")")
+        start = time.perf_counter()
+        count = 0
+        if self.dbshell.closed != 0:
+            logging.error("Database %r is not connected!" % self.database)
+            return
+
+        # A named cursor is kept on the server, so only itersize rows
+        # are ever in memory. A cursor WITH HOLD outlives its
+        # transaction, but the server runs the whole query and keeps
+        # the results before the first row is returned. So instead the
+        # cursor is used in a transaction, which lasts until the last
+        # row. This has to be the connection of this session, as the
+        # queries use its temporary tables and prepared statements.
+        transaction = False
+        if not withhold and self.dbshell.autocommit:
+            self.dbshell.autocommit = False
+            transaction = True
+        self.cursors += 1
+        cursor = self.dbshell.cursor(name="iterquery%d" % self.cursors, withhold=withhold)
+        cursor.itersize = itersize
+        try:
+            cursor.execute(query, params)
+        except psycopg2.Error as e:
+            logging.error("Query failed to fetch! %r" % e.pgerror)
+            logging.error("Query failed: %r" % query)
+            cursor.close()
+            if transaction:
+                self.dbshell.rollback()
+                self.dbshell.autocommit = True
+            if self.stats is not None:
+                self.record(name, query, params, time.perf_counter() - start, error=str(e))
+            return
+
+        writer = None
+        # The time waiting for the database, not the caller
+        elapsed = 0.0
+        size = 0
+        finished = False
+        try:
+            lines = cursor.fetchmany(itersize)
+            # A named cursor only has a description after the first fetch
+            names = tuple([column.name for column in cursor.description])
+            layout = self.getLayout(names)
+            writer = self.cacheWriter(key, names)
+            while len(lines) > 0:
+                if self.stats is not None:
+                    elapsed += time.perf_counter() - start
+                    size += self.stats.size(lines)
+                if writer is not None:
+                    writer.add(lines)
+                for row in self.makeRows(layout, lines):
+                    yield row
+                count += len(lines)
+                start = time.perf_counter()
+                lines = cursor.fetchmany(itersize)
+            if writer is not None:
+                writer.commit()
+            if self.stats is not None:
+                elapsed += time.perf_counter() - start
+                self.record(name, query, params, elapsed, count=count, size=size)
+            finished = True
+        finally:
+            # Only a complete result goes in the cache
+            if writer is not None:
+                writer.abort()
+            try:
+                cursor.close()
+            except psycopg2.Error:
+                pass
+            # The transaction only read, but if the rows weren't all
+            # used, or something failed, it's rolled back
+            if transaction:
+                try:
+                    if finished:
+                        self.dbshell.commit()
+                    else:
+                        self.dbshell.rollback()
+                except psycopg2.Error as e:
+                    logging.warning("Couldn't end the transaction! %r" % e.pgerror)
+                self.dbshell.autocommit = True
+            logging.debug("postgresql.iterquery() returned %d rows" % count)
+
+    def record(self, name, query, params, elapsed, lines=None, count=0, size=0, error=None):
+        """Add a query to the statistics, and explain it if it's slow"""
+        if name is None:
+            name = ' '.join(query.split())[:40]
+        if lines is not None:
+            count = len(lines)
+            size = self.stats.size(lines)
+        if self.stats.add(name, query, elapsed, count, size, error) is not True:
+            return
+        # A prepared statement is explained with it's arguments. This
+        # uses a cursor of it's own, so the results of the query are
+        # left alone.
+        try:
+            with self.dbshell.cursor() as cursor:
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+                plan = '\n'.join([row[0] for row in cursor.fetchall()])
+        except psycopg2.Error as e:
+            plan = "Couldn't explain the query! %r" % e.pgerror
+        self.stats.explained(name, plan)
+
+    def addArea(self, geom):
+        """Put an area in a temporary table, so queries can refer to it
+        by it's id instead of including the whole polygon"""
+        data = geom.wkb
+        try:
+            return self.areas[data]
+        except KeyError:
+            pass
+        if len(self.areas) == 0:
+            self.dbcursor.execute("CREATE TEMP TABLE IF NOT EXISTS areas (id serial PRIMARY KEY, geom geometry)")
+            self.dbcursor.execute("CREATE INDEX IF NOT EXISTS areas_geom ON areas USING GIST (geom)")
+        self.dbcursor.execute("INSERT INTO areas (geom) VALUES (ST_GeomFromWKB(%s, 4326)) RETURNING id",
+                              (psycopg2.Binary(data), ))
+        areaid = self.areas[data] = self.dbcursor.fetchone()[0]
+        return areaid
+
+    def prepare(self, name, query, types="integer"):
+        """Prepare a statement, once per session"""
+        if name in self.prepared:
+            return
+        self.dbcursor.execute("PREPARE %s (%s) AS %s" % (name, types, query))
+        self.prepared.add(name)
+
+    def areaQuery(self, name, query, geom, stream=False):
+        """Run a query for the features in an area, where $1 in the query
+        is the id of the area. The query is prepared the first time it's
+        used, so it's only planned once for all the areas."""
+        # The id of an area depends on the session, so the area itself
+        # is the key.
+        key = (query, geom.wkb)
+        result = self.cached(key, stream)
+        if result is not None:
+            return result
+        areaid = self.addArea(geom)
+        # A cursor can't be declared for EXECUTE, so when streaming the
+        # query is sent each time, but it's short without the polygon.
+        if stream is True:
+            return self.iterquery(query.replace("$1", "%s"), params=(areaid, ), key=key, name=name)
+        start = time.perf_counter()
+        self.prepare(name, query)
+        result = self.query("EXECUTE %s (%d)" % (name, areaid), key=key, name=name)
+        logging.debug("%s(%d) returned %d rows in %.3f seconds"
+                      % (name, areaid, len(result or list()), time.perf_counter() - start))
+        return result
+
+    def layerQuery(self, layer):
+        """The query for the features of a layer in the area with the
+        id $1"""
+        table, columns, where = self.layer(layer)
+        return "SELECT %s,%s FROM %s, areas WHERE areas.id=$1 AND ST_Contains(areas.geom, %s) AND %s" \
+            % (columns, self.geometry(), table, self.extract(table), where)
+
+    def getGrouped(self, layer, areas, stream=False):
+        """Get the features of a layer in any of the areas with a single
+        query. Each feature has an 'area' column, which is the index of
+        the first area it's in, and they are sorted by it. A feature is
+        only returned once, even if it's in more than one area."""
+        if len(areas) == 0:
+            return list()
+        table, columns, where = self.layer(layer)
+        query = "SELECT * FROM (SELECT DISTINCT ON (osm_id) array_position(%%s, areas.id) - 1 AS area, %s,%s" \
+            " FROM %s, areas WHERE areas.id = ANY(%%s) AND ST_Intersects(areas.geom, %s) AND %s" \
+            " ORDER BY osm_id, area) AS grouped ORDER BY area" % (columns, self.geometry(), table, self.extract(table), where)
+        key = (query, [geom.wkb for geom in areas])
+        result = self.cached(key, stream)
+        if result is not None:
+            return result
+        ids = [self.addArea(geom) for geom in areas]
+        if stream is True:
+            return self.iterquery(query, params=(ids, ids), key=key, name="grouped " + layer)
+        start = time.perf_counter()
+        result = self.query(query, (ids, ids), key, "grouped " + layer)
+        logging.debug("Grouped %s in %d areas returned %d rows in %.3f seconds"
+                      % (layer, len(ids), len(result or list()), time.perf_counter() - start))
+        return result
+
+    def select(self, query, stream=False):
+        """Get all the results of a query, or a generator of them"""
+        key = (query, None)
+        result = self.cached(key, stream)
+        if result is not None:
+            return result
+        # The statistics are by the get*() method that called this
+        name = None
+        if self.stats is not None:
+            name = sys._getframe(1).f_code.co_name
+        if stream is True:
+            return self.iterquery(query, key=key, name=name)
+        return self.query(query, key=key, name=name)
+
+    def findGeneration(self):
+        """Get the stamp importOSM() wrote, which changes with each import"""
+        self.generation = None
+        try:
+            self.dbcursor.execute("SELECT stamp FROM generation")
+            row = self.dbcursor.fetchone()
+            if row is not None:
+                self.generation = row[0]
+        except psycopg2.Error as e:
+            logging.debug("%s has no generation, so queries aren't cached" % self.database)
+        return self.generation
+
+    def cacheKey(self, key):
+        """The cache key for a query and it's parameters"""
+        query, params = key
+        # Formatting doesn't change the results
+        query = ' '.join(query.split()).rstrip(';')
+        return self.cache.key(self.dbserver, self.database, self.generation, query, params)
+
+    def cached(self, key, stream=False):
+        """Get the results of a query from the cache, or None"""
+        if self.cache is None or self.generation is None:
+            return None
+        found = self.cache.get(self.cacheKey(key))
+        if found is None:
+            return None
+        names, batches = found
+        layout = self.getLayout(names)
+        if stream is True:
+            return (row for lines in batches for row in self.makeRows(layout, lines))
+        result = list()
+        for lines in batches:
+            result += self.makeRows(layout, lines)
+        return result
+
+    def cacheWriter(self, key, names):
+        """Start adding the results of a query to the cache, or None"""
+        if key is None or self.cache is None or self.generation is None:
+            return None
+        return self.cache.writer(self.cacheKey(key), names)
+
+    def getLayout(self, names):
+        """Get the layout of the columns returned by a query"""
+        try:
+            return self.layouts[names]
+        except KeyError:
+            pass
+        columns = dict()
+        tags = None
+        geoms = list()
+        for index, name in enumerate(names):
             # While it's possible to edit the osmconf.ini file for GDAL
             # and have everything you want appear as a field, I prefer
             # tp not have to edit a root protected config file, so
             # parse each entry out of other_tags, which accomplishes
             # the same thing.
-            for item in line:
-                # logging.debug("FIXME item: %r, %r" % (fields[i], item))
-                if fields[i] == "other_tags":
-                    if item is not None:
-                        tags = item.split(',')
-                        for value in tags:
-                            # print(value)
-                            tmp = value.split('=>')
-                            # print(len(tmp))
-                            if len(tmp) == 2:
-                                # logging.debug("TMP: %r" % tmp)
-                                data[tmp[0].replace('"', '').lstrip()] = tmp[1].replace('"', '')
-                elif fields[i] == "wkb":
-                    try:
-                        # FIXME: is this generating hex errors!
-                        data['wkb'] = wkb.loads(item,hex=True)
-                    except:
-                        if 'name' in data:
-                            logging.warning("Couldn't parse wkb %r" % data['name'])
-                        if 'osm_way_id' in data:
-                            logging.warning("Couldn't parse wkb %r" % data['osm_way_id'])
-                        if 'osm_id' in data:
-                            logging.warning("Couldn't parse wkb %r" % data['osm_id'])
-                        i += 1
-                        continue
-                elif fields[i] == "cp":
-                    try:
-                        # FIXME: is this generating hex errors!
-                        data['cp'] = wkb.loads(item,hex=True)
-                    except:
-                        if 'name' in data:
-                            logging.warning("Couldn't parse cp %r" % data['name'])
-                        if 'osm_way_id' in data:
-                            logging.warning("Couldn't parse cp %r" % data['osm_way_id'])
-                        if 'osm_id' in data:
-                            logging.warning("Couldn't parse cp %r" % data['osm_id'])
-                        i += 1
-                        continue
-                    #data['wkb'] = wkb.loads(item.tobytes())
-                else:
-                    data[fields[i]] = str(item).lstrip()
-                    # logging.debug("FIXME data: %r" % (data))
-                i += 1
-            self.result.append(data)
-            line = self.dbcursor.fetchone()
-
-        return self.result
+            if name == "other_tags":
+                tags = index
+                continue
+            if name == "wkb" or name == "cp" or name == "wkb_geometry":
+                geoms.append(index)
+            columns[name] = index
+        layout = self.layouts[names] = (columns, tags, geoms)
+        return layout
+
+    def geometry(self, column="wkb_geometry"):
+        """The SQL to select a geometry column"""
+        if self.binary is True:
+            return "ST_AsBinary(%s) AS %s" % (column, column)
+        return column
+
+    def makeRows(self, layout, lines):
+        """Convert rows from the database to a list of Rows"""
+        columns, index, geoms = layout
+        rows = list()
+        for line in lines:
+            values = list(line)
+            tags = None
+            if index is not None:
+                tags = values[index]
+                if isinstance(tags, str):
+                    tags = hstore(tags)
+            rows.append(Row(columns, values, tags))
+        for index in geoms:
+            self.decode(rows, index)
+        return rows
+
+    def decode(self, rows, index):
+        """Decode a geometry column for a batch of rows"""
+        # Not everything called cp is a geometry
+        found = [row for row in rows if isinstance(row.values[index], (str, bytes, memoryview))]
+        if len(found) == 0:
+            return
+        # A bytea column comes back as a memoryview
+        data = [row.values[index] for row in found]
+        if not isinstance(data[0], str):
+            data = [bytes(value) for value in data]
+        if from_wkb is not None:
+            geoms = from_wkb(np.array(data, dtype=object), on_invalid='ignore')
+        else:
+            geoms = list()
+            for value in data:
+                try:
+                    geoms.append(wkb.loads(value, hex=isinstance(value, str)))
+                except Exception as inst:
+                    geoms.append(None)
+        for row, geom in zip(found, geoms):
+            row.values[index] = geom
+            if geom is None:
+                for key in ('name', 'osm_way_id', 'osm_id'):
+                    if key in row:
+                        logging.warning("Couldn't parse geometry %r" % row[key])
 
     # Edit /usr/share/gdal/osmconf.ini and add boundary as a polygon
     def getBoundaries(self, poly, result=list()):
@@ -207,9 +685,123 @@ class Postgis(object):
         result = self.query("create extension hstore")
         result = self.query("create extension postgis")
 
+    def findTyped(self):
+        """Find which tables have had the typed geometry column added"""
+        try:
+            self.dbcursor.execute("SELECT f_table_name FROM geometry_columns WHERE f_geometry_column='geom' AND f_table_name IN %s",
+                                  (tuple(GEOMETRIES.keys()), ))
+            self.typed = set([row[0] for row in self.dbcursor.fetchall()])
+        except psycopg2.Error as e:
+            # Not a postgis database
+            self.typed = set()
+        return self.typed
+
+    def extract(self, table):
+        """The SQL for the geometry of a table, to use in a WHERE clause"""
+        # The areas table also has a geom column
+        if table in self.typed or table.startswith("subset_"):
+            return "%s.geom" % table
+        return "ST_CollectionExtract(%s.wkb_geometry, %d)" % (table, GEOMETRIES[table][1])
+
+    def optimize(self):
+        """ogr2ogr imports everything as a GeometryCollection, which
+        has to be taken apart in every query, so no index can be used.
+        This adds a column with the geometry as the real type, indexes
+        it, and sorts the table by it so nearby features are together
+        on disk."""
+        for table, (type, index) in GEOMETRIES.items():
+            start = time.perf_counter()
+            try:
+                self.dbcursor.execute("ALTER TABLE %s ADD COLUMN IF NOT EXISTS geom geometry(%s, 4326)" % (table, type))
+                self.dbcursor.execute("UPDATE %s SET geom=ST_Multi(ST_CollectionExtract(wkb_geometry, %d))" % (table, index))
+                self.dbcursor.execute("CREATE INDEX IF NOT EXISTS %s_geom ON %s USING GIST (geom)" % (table, table))
+                self.dbcursor.execute("CLUSTER %s USING %s_geom" % (table, table))
+                self.dbcursor.execute("ANALYZE %s" % table)
+            except psycopg2.Error as e:
+                logging.error("Couldn't optimize %s! %r" % (table, e.pgerror))
+                continue
+            logging.info("Optimized %s in %.1f seconds" % (table, time.perf_counter() - start))
+        # The prepared statements use the old columns
+        self.dbcursor.execute("DEALLOCATE ALL")
+        self.prepared = set()
+        self.findTyped()
+
+    def findViews(self):
+        """Find which subsets have a materialized view"""
+        try:
+            self.dbcursor.execute("SELECT matviewname FROM pg_matviews WHERE matviewname LIKE 'subset\\_%%'")
+            self.views = set([row[0][7:] for row in self.dbcursor.fetchall()])
+        except psycopg2.Error as e:
+            self.views = set()
+        return self.views
+
+    def viewColumns(self, subset):
+        """The columns of the view for a subset"""
+        table, tags, where = SUBSETS[subset]
+        # Some tags, like natural, are reserved words in SQL
+        return "osm_id,name,other_tags," + ','.join(['"%s"' % tag.replace(':', '_') for tag in tags])
+
+    def updateViews(self):
+        """Create the view for each subset, or refresh it if it's there.
+        This has to be done after every import or update."""
+        self.findViews()
+        try:
+            self.dbcursor.execute("CREATE EXTENSION IF NOT EXISTS hstore")
+        except psycopg2.Error as e:
+            logging.error("Couldn't add hstore! %r" % e.pgerror)
+            return
+        columns = dict()
+        for subset, (table, tags, where) in SUBSETS.items():
+            view = "subset_" + subset
+            start = time.perf_counter()
+            try:
+                if subset in self.views:
+                    self.dbcursor.execute("REFRESH MATERIALIZED VIEW %s" % view)
+                    logging.info("Refreshed %s in %.1f seconds" % (view, time.perf_counter() - start))
+                    continue
+                if table not in columns:
+                    self.dbcursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name=%s", (table, ))
+                    columns[table] = set([row[0] for row in self.dbcursor.fetchall()])
+                values = dict()
+                for tag in tags:
+                    # Some tags, like natural, are reserved words in SQL
+                    if tag.replace(':', '_') in columns[table]:
+                        values[tag] = '"%s"' % tag.replace(':', '_')
+                    else:
+                        values[tag] = "(other_tags::hstore->'%s')" % tag
+                select = ['%s AS "%s"' % (values[tag], tag.replace(':', '_')) for tag in tags]
+                self.dbcursor.execute("CREATE MATERIALIZED VIEW %s AS SELECT osm_id,name,other_tags,%s,wkb_geometry,"
+                                      "ST_Multi(ST_CollectionExtract(wkb_geometry, %d)) AS geom FROM %s WHERE %s"
+                                      % (view, ','.join(select), GEOMETRIES[table][1], table, where % values))
+                self.dbcursor.execute("CREATE INDEX %s_geom ON %s USING GIST (geom)" % (view, view))
+                for tag in tags:
+                    column = tag.replace(':', '_')
+                    self.dbcursor.execute('CREATE INDEX %s_%s ON %s ("%s")' % (view, column, view, column))
+                self.dbcursor.execute("ANALYZE %s" % view)
+            except psycopg2.Error as e:
+                logging.error("Couldn't make %s! %r" % (view, e.pgerror))
+                continue
+            logging.info("Created %s in %.1f seconds" % (view, time.perf_counter() - start))
+        # The prepared statements use the old tables
+        self.dbcursor.execute("DEALLOCATE ALL")
+        self.prepared = set()
+        self.findViews()
+
+    def subsetQuery(self, subset, query):
+        """Use the view for a subset if there is one, otherwise the query"""
+        if subset not in self.views:
+            return query
+        return "SELECT %s,%s FROM subset_%s" % (self.viewColumns(subset), self.geometry(), subset)
+
+    def layer(self, layer):
+        """The table, columns, and filter for the features of a layer"""
+        if layer in self.views:
+            return "subset_" + layer, self.viewColumns(layer), "TRUE"
+        return LAYERS[layer]
+
     def importOSM(self, filespec="out.osm", dbname=None):
-        # FIXME: there has got to be a somple way of doing this purely
-        # in python using ogr, and not using a subprocess.
+        """Import an OSM file into a database, using pyosmium if it's
+        installed, and ogr2ogr if it isn't"""
          # ogr2ogr -overwrite -f  "PostgreSQL" PG:"dbname=${dbname}" -nlt GEOMETRYCOLLECTION ${infile}
         if dbname is None:
             dbname = os.path.basename(filespec).replace('.osm', '')
@@ -217,87 +809,100 @@ class Postgis(object):
 
         # self.initDB(dbname)
 
-        cmd = [ 'ogr2ogr', '-overwrite', '-f', "PostgreSQL", "PG:dbname=" + dbname, "-nlt", "GEOMETRYCOLLECTION", filespec]
-        ppp = Popen(cmd, stdout=PIPE, bufsize=0, close_fds=ON_POSIX)
-        ppp.wait()
+        if osmLoader is not None:
+            if osmLoader(dbname).load(filespec) is not True:
+                logging.error("Couldn't import %s into %s!" % (filespec, dbname))
+                return
+        else:
+            cmd = [ 'ogr2ogr', '-overwrite', '-f', "PostgreSQL", "PG:dbname=" + dbname, "-nlt", "GEOMETRYCOLLECTION", filespec]
+            ppp = Popen(cmd, stdout=PIPE, bufsize=0, close_fds=ON_POSIX)
+            ppp.wait()
 
         logging.info("Created database %s with data from %s" % (dbname, filespec))
 
-    def getRoads(self, result=list()):
-        result = self.query("SELECT osm_id,name,other_tags,highway,wkb_geometry FROM lines WHERE highway is not NULL AND (highway!='path' AND highway!='footway' AND highway!='milestone' AND highway!='cycleway' AND highway!='bridleway');")
+        self.connect('localhost', dbname)
+        self.optimize()
+        self.updateViews()
+        # Anything cached from before this import is out of date
+        self.generation = uuid.uuid4().hex
+        self.dbcursor.execute("CREATE TABLE IF NOT EXISTS generation (stamp text)")
+        self.dbcursor.execute("DELETE FROM generation")
+        self.dbcursor.execute("INSERT INTO generation VALUES (%s)", (self.generation, ))
+
+    def getRoads(self, result=list(), stream=False):
+        result = self.select("SELECT osm_id,name,other_tags,highway," + self.geometry() + " FROM lines WHERE highway is not NULL AND (highway!='path' AND highway!='footway' AND highway!='milestone' AND highway!='cycleway' AND highway!='bridleway');", stream)
         return result
 
-    def getAddresses(self, geom, result=list()):
+    def getAddresses(self, geom, result=list(), stream=False):
         """Get all the addresses in a defined area"""
-        result = self.query("SELECT osm_id,name,addr_housenumber,addr_street,wkb_geometry FROM points WHERE ST_Contains(ST_GeomFromText('%s', 4326), ST_CollectionExtract(wkb_geometry, 1)) AND addr_housenumber is not NULL;" % geom.wkt)
+        result = self.areaQuery("addresses", self.layerQuery("addresses"), geom, stream)
         return result
 
-    def getWay(self, geom, result=dict()):
+    def getWay(self, geom, result=dict(), stream=False):
         """Get the data for a fire water source using the GPS location in the relation"""
-        result = self.query("SELECT osm_id,emergency,landing_site,name,ref,other_tags FROM points WHERE ST_Equals(ST_CollectionExtract(wkb_geometry, 1), ST_GeomFromText('%s', 4326))" % geom.wkt)
+        result = self.select("SELECT osm_id,emergency,landing_site,name,ref,other_tags FROM points WHERE ST_Equals(" + self.extract('points') + ", ST_GeomFromText('%s', 4326))" % geom.wkt, stream)
         return result
  
-    def getCampGrounds(self, result=list(), campground=None):
+    def getCampGrounds(self, result=list(), campground=None, stream=False):
         """Get all the camping areas in the database, which is used to organize them
         the camp sites into each campground"""
         #result = self.query("SELECT osm_id,name,other_tags,wkb_geometry FROM other_relations WHERE other_tags LIKE '%camp_site%' AND (name LIKE '%Campground%' OR name LIKE '%Camping Area%' );")
-        result =  self.query("SELECT osm_id,name,other_tags,wkb_geometry FROM multipolygons WHERE tourism='camp_site' AND boundary is not NULL;")
+        result =  self.select(self.subsetQuery('campgrounds', "SELECT osm_id,name,other_tags," + self.geometry() + " FROM multipolygons WHERE tourism='camp_site' AND boundary is not NULL;"), stream)
         return result
 
-    def getCampSites(self, geom, result=list()):
+    def getCampSites(self, geom, result=list(), stream=False):
         """Get all the camp sites in a camping area"""
-        result = self.query("SELECT osm_id,ref,name,other_tags,wkb_geometry FROM points WHERE ST_Contains(ST_GeomFromText('%s', 4326), ST_CollectionExtract(wkb_geometry, 1)) AND (tourism='camp_pitch' OR tourism='camp_site');" % geom.wkt)
+        result = self.areaQuery("campsites", self.layerQuery("campsites"), geom, stream)
         return result
 
-    def getPlaces(self, level, result=list()):
+    def getPlaces(self, level, result=list(), stream=False):
         """Get all the cities and town in the database, which is used to organize
         various data into smaller, more navigatable subsets."""
-        result =  self.query("SELECT osm_id,osm_way_id,name,admin_level,place,wkb_geometry FROM multipolygons WHERE boundary is not NULL AND admin_level='%d' AND name is not NULL;" % level)
+        result =  self.select("SELECT osm_id,osm_way_id,name,admin_level,place," + self.geometry() + " FROM multipolygons WHERE boundary is not NULL AND admin_level='%d' AND name is not NULL;" % level, stream)
         return result
 
-    def getProtected(self, result=list()):
+    def getProtected(self, result=list(), stream=False):
         """Get all the wilderness areas and park in database, which is used to organize
         various data into smaller, more navigatable subsets."""
-        result =  self.query("SELECT osm_id,osm_way_id,name,admin_level,place,wkb_geometry FROM multipolygons WHERE boundary='protected_area' OR boundary='national_park' AND name is not NULL;")
+        result =  self.select("SELECT osm_id,osm_way_id,name,admin_level,place," + self.geometry() + " FROM multipolygons WHERE boundary='protected_area' OR boundary='national_park' AND name is not NULL;", stream)
         return result
 
-    def getTrails(self, geom, result=list()):
+    def getTrails(self, geom, result=list(), stream=False):
         """Get all the Trails in a defined area"""
-        result = self.query("SELECT osm_id,name,highway,other_tags,wkb_geometry FROM lines WHERE ST_Contains(ST_GeomFromText('%s', 4326), ST_CollectionExtract(wkb_geometry, 2)) AND highway='path';" % geom.wkt)
+        result = self.areaQuery("trails", self.layerQuery("trails"), geom, stream)
         return result
 
-    def getFireWater(self, geom, result=list()):
+    def getFireWater(self, geom, result=list(), stream=False):
         """Get all the fire hydrants, cisterns, or open water sources in a polygon."""
-        query = "SELECT osm_id,ref,name,emergency,wkb_geometry FROM points WHERE ST_Contains(ST_GeomFromText('%s', 4326), ST_CollectionExtract(wkb_geometry, 1)) AND (emergency='fire_hydrant' OR emergency='water_tank' OR emergency='fire_water_pond');" % geom[0].wkt
-        result = self.query(query)
+        result = self.areaQuery("firewater", self.layerQuery("firewater"), geom[0], stream)
         return result
 
-    def getPiste(self, result=list()):
-        result = self.query("SELECT osm_id,name,other_tags,wkb_geometry FROM lines WHERE other_tags LIKE '%piste%';")
+    def getPiste(self, result=list(), stream=False):
+        result = self.select(self.subsetQuery('piste', "SELECT osm_id,name,other_tags," + self.geometry() + " FROM lines WHERE other_tags LIKE '%piste%';"), stream)
         return result
     
-    def getHistoric(self, result=list()):
-        result = self.query("SELECT osm_id,name,other_tags,historic,wkb_geometry FROM points WHERE historic is not NULL;")
+    def getHistoric(self, result=list(), stream=False):
+        result = self.select("SELECT osm_id,name,other_tags,historic," + self.geometry() + " FROM points WHERE historic is not NULL;", stream)
         return result
 
-    def getMilestones(self, result=list()):
-        result = self.query("SELECT osm_id,name,other_tags,wkb_geometry FROM points WHERE highway='milestone';")
+    def getMilestones(self, result=list(), stream=False):
+        result = self.select(self.subsetQuery('milestones', "SELECT osm_id,name,other_tags," + self.geometry() + " FROM points WHERE highway='milestone';"), stream)
         return result
 
     def getTrailhead(self, result=list()):
         result = self.query("")
         return result
 
-    def getHotSprings(self, result=list()):
-        result = self.query("SELECT osm_id,name,description,other_tags FROM points WHERE natural='hot_spring' OR amenity='hot_spring' OR 'bath:type'='hot_spring' OR name LIKE '%Hot Spring%';")
+    def getHotSprings(self, result=list(), stream=False):
+        result = self.select(self.subsetQuery('hotsprings', "SELECT osm_id,name,description,other_tags," + self.geometry() + " FROM points WHERE \"natural\"='hot_spring' OR amenity='hot_spring' OR other_tags LIKE '%\"bath:type\"=>\"hot_spring\"%' OR name LIKE '%Hot Spring%';"), stream)
         return result
 
-    def getLandingZones(self, result=list()):
-        result = self.query("SELECT osm_id,name,emergency,aeroway,wkb_geometry FROM points WHERE aeroway='helipad' OR aeroway='heliport' OR emergency='landing_site';")
+    def getLandingZones(self, result=list(), stream=False):
+        result = self.select(self.subsetQuery('landingzones', "SELECT osm_id,name,emergency,aeroway," + self.geometry() + " FROM points WHERE aeroway='helipad' OR aeroway='heliport' OR emergency='landing_site';"), stream)
         return result
 
-    def getPlace(self, result=list()):
-        result = self.query("osm_id,name,place,wkb_geometry FROM points WHERE place='hamlet' OR place='village' OR place='town' OR place='isolated_dwelling' OR place='locality';")
+    def getPlace(self, result=list(), stream=False):
+        result = self.select("osm_id,name,place," + self.geometry() + " FROM points WHERE place='hamlet' OR place='village' OR place='town' OR place='isolated_dwelling' OR place='locality';", stream)
         return result
 
     def getWaterfalls(self, result=list()):
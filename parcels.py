@@ -58,12 +58,13 @@ class myconfig(object):
         self.options['logging'] = True
         self.options['dump'] = False
         self.options['verbose'] = False
+        self.options['namecache'] = False
         self.options['infile'] = os.path.dirname(argv[0])
         self.options['outfile'] = "./out"
 
         try:
             (opts, val) = getopt.getopt(argv[1:], "h,o:,i:,v,",
-                ["help", "outfile", "infile", "verbose"])
+                ["help", "outfile", "infile", "verbose", "name-cache="])
         except getopt.GetoptError as e:
             logging.error('%r' % e)
             self.usage(argv)
@@ -76,6 +77,8 @@ class myconfig(object):
                 self.options['outfile'] = val
             elif opt == "--infiles" or opt == '-i':
                 self.options['infiles'] = val
+            elif opt == "--name-cache":
+                self.options['namecache'] = val
             elif opt == "--verbose" or opt == '-v':
                 self.options['verbose'] = True
                 logging.basicConfig(filename='parcels.log',level=logging.DEBUG)
@@ -99,6 +102,7 @@ class myconfig(object):
 \t--outfile(-o)   Output file name
 \t--infile(-i)    Input file names
 \t--verbose(-v)   Enable verbosity
+\t--name-cache    Keep corrected names in this file between runs
         """)
         quit()
 
@@ -144,7 +148,7 @@ if suffix != "csv":
     logging.error("Not an CSV file!")
     quit()
 
-fix = correct.correct()
+fix = correct.correct(dd.get('namecache'))
     
 tag = dict()
 members = list()
@@ -261,3 +265,4 @@ for docit in doc.getiterator():
         osmout.node(tags, attrs)
         #osmout.makeNode(refs, tags, attrs)
 osmout.footer()
+fix.close()
@@ -37,6 +37,7 @@ class config(object):
         self.options['logging'] = True
         self.options['operation'] = "split"
         self.options['verbose'] = False
+        self.options['namecache'] = False
         self.options['root'] = os.path.dirname(argv[0])
         self.options['infiles'] = os.path.dirname(argv[0])
         self.options['outdir'] = "/tmp/"
@@ -48,7 +49,7 @@ class config(object):
 
         try:
             (opts, val) = getopt.getopt(argv[1:], "h,o:,i:,v,e:,d:,t:",
-                ["help", "outfile", "infiles", "verbose", "directory", "title"])
+                ["help", "outfile", "infiles", "verbose", "directory", "title", "name-cache="])
         except getopt.GetoptError as e:
             logging.error('%r' % e)
             self.usage(argv)
@@ -65,6 +66,8 @@ class config(object):
                 self.options['outdir'] = val
             elif opt == "--title" or opt == '-t':
                 self.options['title'] = val
+            elif opt == "--name-cache":
+                self.options['namecache'] = val
             elif opt == "--verbose" or opt == '-v':
                 self.options['verbose'] = True
                 with open('plotcalls.log', 'w'):
@@ -93,6 +96,7 @@ class config(object):
 \t--infile(-i)   Input file name(s)
 \t--verbose(-v)   Enable verbosity
 \t--title(-t)     Set output file title
+\t--name-cache    Keep corrected names in this file between runs
         """)
         quit()
 
@@ -138,7 +142,7 @@ kml.header("TLFPD Calls")
 
 calldata = open(dd.get('infile'), 'r')    
 lines = calldata.readlines()
-fix = correct.correct()
+fix = correct.correct(dd.get('namecache'))
 for line in lines:
     if line[1] == '#':
         continue
@@ -147,9 +151,7 @@ for line in lines:
     street = line[index + 2:]
     street = street.replace("\n", '')
     street = street.strip()
-    street = fix.alphaNumeric(street)
-    street = fix.abbreviation(street)
-    street = fix.compass(street)
+    street = fix.normalize(street)
     
 
     query = "SELECT ST_AsKML(way) from planet_osm_point"
@@ -166,3 +168,4 @@ for line in lines:
         logging.warning("%r %r Not found!" % (number, street))
 
 kml.footer()
+fix.close()
@@ -75,11 +75,14 @@ if dd.get('dump') is True:
 #     shp.makeKML(osm)
 
 # Write OSM file
-elif dd.get('format') == "osm":
+elif dd.get('format') == "osm" or dd.get('format') == "pbf":
     outdir = dd.get('outdir')
     osmfile = dd.get('outfile')
     osm = osm.osmfile(dd, osmfile)
-    shp.makeOSM(osm)
+    if dd.get('jobs') > 1:
+        shp.makeOSMJobs(osm, dd.get('jobs'))
+    else:
+        shp.makeOSM(osm)
     print("Output file: %r" % osmfile)
 
 # Write CSV file
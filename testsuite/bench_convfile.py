@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Compare looking up a field and value with match() and attribute(),
+# which is what osmfile used to do, against the single translate()
+# lookup. Every field and value in the conversion file is looked up,
+# plus some that aren't there. This also times loading the conversion
+# file when it has to be parsed, and when the compiled copy is used.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+import datafile
+
+loops = 200
+if len(argv) > 1:
+    loops = int(argv[1])
+
+top = os.path.join(os.path.dirname(argv[0]), '..')
+datafile.CACHEDIR = tempfile.mkdtemp()
+for conv in ("default.conv", "usfs.conv"):
+    filespec = os.path.join(top, conv)
+    start = time.perf_counter()
+    ctable = datafile.convfile(filespec)
+    parsed = time.perf_counter() - start
+    start = time.perf_counter()
+    ctable = datafile.convfile(filespec)
+    cached = time.perf_counter() - start
+    print("%s: parsed in %.2fms, cached in %.2fms"
+          % (conv, parsed * 1000, cached * 1000))
+
+    pairs = list()
+    for field, tag in ctable.table.items():
+        pairs.append((field, "not there"))
+        for value in ctable.attrtable.get(tag, dict()):
+            pairs.append((field, value))
+    for name, values in ctable.attrtable.items():
+        for value in values:
+            pairs.append((name, value))
+    pairs.append(("NOT_A_FIELD", "foo, bar"))
+
+    for field, value in pairs:
+        tag = ctable.match(field)
+        if ctable.translate(field, value) != (tag, ctable.attribute(tag, value)):
+            print("Mismatch for %r=%r" % (field, value))
+
+    start = time.perf_counter()
+    for i in range(0, loops):
+        for field, value in pairs:
+            tag = ctable.match(field)
+            ctable.attribute(tag, value)
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(0, loops):
+        for field, value in pairs:
+            ctable.translate(field, value)
+    compiled = time.perf_counter() - start
+    lookups = loops * len(pairs)
+    print("%s: match+attribute %9.0f lookups/second" % (conv, lookups / legacy))
+    print("%s: translate       %9.0f lookups/second" % (conv, lookups / compiled))
+shutil.rmtree(datafile.CACHEDIR)
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Compare writing roads with the fastkml document osm2kml used to
+# build, against the streaming kmlWriter. This writes a synthetic set
+# of roads, each with 20 vertices and a style like MapStyle makes, and
+# reports the time and the peak memory used for each one.
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+from sys import argv
+from fastkml import kml, styles
+from shapely.geometry import LineString
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+from kmlwriter import kmlWriter
+
+roads = 20000
+if len(argv) > 1:
+    roads = int(argv[1])
+ns = '{http://www.opengis.net/kml/2.2}'
+
+
+def road(i):
+    line = LineString([(-105.0 - i * 0.0001, 39.0 + j * 0.0001) for j in range(0, 20)])
+    style = styles.Style(styles=[styles.LineStyle(color='ff0000ff', width=3.0)])
+    return str(-i), "Forest Road %d" % i, style, line
+
+
+def legacy(filespec):
+    """This is what osm2kml used to do"""
+    kmlfile = kml.KML()
+    doc = kml.Document(ns=ns, id='docid', name='Roads', description='doc description')
+    kmlfile.append(doc)
+    for i in range(0, roads):
+        osmid, name, style, line = road(i)
+        doc.append(kml.Placemark(ns=ns, id=osmid, name=name, description=name,
+                                 styles=[style], geometry=line))
+    file = open(filespec, 'w')
+    file.write(kmlfile.to_string(prettyprint=True))
+    file.close()
+
+
+def streamed(filespec):
+    """This is the kmlWriter"""
+    doc = kmlWriter(filespec)
+    doc.header('Roads', 'doc description')
+    for i in range(0, roads):
+        osmid, name, style, line = road(i)
+        doc.placemark(osmid, name, name, style, line)
+    doc.footer()
+
+
+tmpdir = tempfile.mkdtemp()
+for name, func in (("fastkml", legacy), ("kmlWriter", streamed)):
+    filespec = os.path.join(tmpdir, "bench.kml")
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(filespec)
+    delta = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-10s %9.0f placemarks/second, %6.1f MB peak, %d bytes"
+          % (name, roads / delta, peak / (1024 * 1024), os.path.getsize(filespec)))
+    os.remove(filespec)
+os.rmdir(tmpdir)
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Compare the old way osmfile wrote elements, one write() per attribute,
+# tag, and nd, against the buffered xmlWriter. This writes a synthetic
+# set of roads, each with 20 nodes and a handful of tags. The legacy
+# code is copied from the old writeNode() and makeWay() methods.
+
+import os
+import sys
+import time
+import tempfile
+from datetime import datetime
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+from osmwriter import xmlWriter
+
+ways = 20000
+if len(argv) > 1:
+    ways = int(argv[1])
+tags = [("highway", "track"), ("surface", "dirt"), ("name", "Forest Road 123"),
+        ("motor_vehicle", "yes"), ("tracktype", "grade3")]
+
+
+def legacy(filespec):
+    """This is what osmfile used to do"""
+    file = open(filespec, 'w')
+    osmid = -1
+    for way in range(0, ways):
+        refs = list()
+        for i in range(0, 20):
+            timestamp = datetime.now().strftime("%Y-%m-%dT%TZ")
+            attrs = {'id': str(osmid), 'lat': '39.%06d' % i, 'lon': '-105.%06d' % way}
+            file.write("    <node")
+            for ref, value in attrs.items():
+                file.write(" " + ref + "=\"" + value + "\"")
+            file.write("/>\n")
+            refs.append(osmid)
+            osmid -= 1
+        file.write("    <way")
+        timestamp = datetime.now().strftime("%Y-%m-%dT%TZ")
+        file.write(" action='modified'")
+        file.write(" version='1'")
+        file.write(" id=\'" + str(osmid) + "\'")
+        file.write(" timestamp='" + timestamp + "\'>\n")
+        for ref in refs:
+            file.write("    <nd ref=\"" + str(ref) + "\"/>\n")
+        for name, value in tags:
+            file.write("    <tag k=\"" + name + "\" v=\"" + str(value) + "\"/>\n")
+        file.write("  </way>\n")
+        osmid -= 1
+    file.close()
+
+
+def buffered(filespec):
+    """This is the xmlWriter"""
+    file = xmlWriter(filespec)
+    osmid = -1
+    for way in range(0, ways):
+        refs = list()
+        for i in range(0, 20):
+            attrs = {'id': str(osmid), 'lat': '39.%06d' % i, 'lon': '-105.%06d' % way}
+            file.node(attrs)
+            refs.append(osmid)
+            osmid -= 1
+        timestamp = datetime.now().strftime("%Y-%m-%dT%TZ")
+        file.way({'action': 'modified', 'version': '1', 'id': str(osmid),
+                  'timestamp': timestamp}, refs, tags)
+        osmid -= 1
+    file.close()
+
+
+tmpdir = tempfile.mkdtemp()
+elements = ways * 21
+for name, func, suffix in (("legacy", legacy, ".osm"),
+                           ("buffered", buffered, ".osm"),
+                           ("buffered gzip", buffered, ".osm.gz"),
+                           ("buffered bz2", buffered, ".osm.bz2")):
+    filespec = os.path.join(tmpdir, "bench" + suffix)
+    start = time.perf_counter()
+    func(filespec)
+    delta = time.perf_counter() - start
+    print("%-14s %9.0f elements/second, %d bytes" % (name, elements / delta, os.path.getsize(filespec)))
+    os.remove(filespec)
+os.rmdir(tmpdir)
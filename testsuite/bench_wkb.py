@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Compare decoding the geometries one row at a time with wkb.loads(),
+# which is what Postgis.query used to do, against decoding a batch of
+# them with shapely's from_wkb(). The rows are synthetic roads stored
+# the way ogr2ogr imports them, a GeometryCollection with a SRID. If a
+# database name is given, getRoads() is also timed with the geometry
+# sent as hex EWKB and as binary WKB.
+
+import os
+import sys
+import time
+import random
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+import shapely
+from shapely import wkb
+from shapely.geometry import GeometryCollection, LineString
+from sql import Postgis, Row
+
+count = 100000
+if len(argv) > 1:
+    count = int(argv[1])
+
+random.seed(1)
+geoms = list()
+for i in range(0, count):
+    lon = random.uniform(-109.0, -102.0)
+    lat = random.uniform(37.0, 41.0)
+    line = LineString([(lon + j * 0.0001, lat + random.uniform(0, 0.0001)) for j in range(0, 20)])
+    geoms.append(GeometryCollection([line]))
+geoms = shapely.set_srid(shapely.from_wkt([geom.wkt for geom in geoms]), 4326)
+hexes = [wkb.dumps(geom, hex=True, include_srid=True) for geom in geoms]
+binaries = [wkb.dumps(geom) for geom in geoms]
+
+start = time.perf_counter()
+for item in hexes:
+    try:
+        geom = wkb.loads(item, hex=True)
+    except:
+        pass
+delta = time.perf_counter() - start
+print("per row hex     %9.0f rows/second" % (count / delta))
+
+post = Postgis()
+layout = ({'osm_id': 0, 'wkb_geometry': 1}, None, [1])
+for name, data in (("batch hex", hexes), ("batch binary", binaries)):
+    lines = [(str(i), memoryview(value) if isinstance(value, bytes) else value)
+             for i, value in enumerate(data)]
+    start = time.perf_counter()
+    rows = post.makeRows(layout, lines)
+    delta = time.perf_counter() - start
+    print("%-15s %9.0f rows/second" % (name, count / delta))
+
+if len(argv) > 2:
+    for binary in (False, True):
+        post = Postgis(binary=binary)
+        post.connect('localhost', argv[2])
+        start = time.perf_counter()
+        roads = post.getRoads()
+        delta = time.perf_counter() - start
+        print("getRoads(binary=%r) %d roads in %.2f seconds" % (binary, len(roads), delta))
+        post.close()
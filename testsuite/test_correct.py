@@ -162,6 +162,37 @@ instr="Hwy 119 Mile Marker 5.0 (Gold Dust Rd)"
 x = obj.abbreviation(instr)
 dj.matches(x, "Highway 119 Mile Marker 5.0 (Gold Dust Road)", "correct.abbreviation(paren)", False)
 
+# An abbreviation with a period, or a name that's only one token, is
+# left alone.
+for instr in ("Dr. Smith Rd", "Fr. John Rd"):
+    x = obj.abbreviation(instr)
+    dj.matches(x, instr.replace(" Rd", " Road"), "correct.abbreviation(%s)" % instr)
+
+for instr in ("Ct", "Ln"):
+    x = obj.abbreviation(instr)
+    dj.matches(x, instr, "correct.abbreviation(%s)" % instr)
+
+# The same names again, from the cache
+import os
+import tempfile
+tmpdir = tempfile.mkdtemp()
+cache = os.path.join(tmpdir, "names.db")
+obj = correct.correct(cache)
+obj.normalize("N Gold Dust Rd")
+obj.close()
+obj = correct.correct(cache)
+x = obj.normalize("N Gold Dust Rd")
+dj.matches(x, "North Gold Dust Road", "correct.normalize(cached)")
+dj.matches(obj.cache.hits, 1, "nameCache.get(hit)")
+obj.close()
+
+# A change to the rules empties the cache
+cached = correct.nameCache(cache, "not the current rules")
+dj.matches(cached.get('everything', "N Gold Dust Rd"), None, "nameCache(version)")
+cached.close()
+os.remove(cache)
+os.rmdir(tmpdir)
+
 # All done
 if __name__ == '__main__':
     dj.totals()
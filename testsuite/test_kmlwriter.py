@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Write a small Document with the kmlWriter, and check it parses, and
+# that the Placemarks share the styles, and the tags are in the data
+# for the Schema of the subset.
+
+import os
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from fastkml import styles
+from shapely.geometry import Point, LineString
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+from kmlwriter import kmlWriter
+import dejagnu
+
+dj = dejagnu.dejagnu()
+dj.verbose_level(2)
+
+ns = '{http://www.opengis.net/kml/2.2}'
+tmpdir = tempfile.mkdtemp()
+filespec = os.path.join(tmpdir, "test.kml")
+
+red = styles.Style(styles=[styles.LineStyle(color='ff0000ff', width=3.0)])
+blue = styles.Style(styles=[styles.LineStyle(color='ffff0000', width=3.0)])
+icon = styles.Style(styles=[styles.IconStyle(icon_href="icons/heliport.png")])
+
+doc = kmlWriter(filespec)
+doc.header("Test & Map", 'doc description')
+# A subset, written on it's own and included
+subset = kmlWriter(tempfile.TemporaryFile(), depth=2, styles=doc.styles, schemas=doc.schemas)
+subset.folder('Landing Sites')
+subset.placemark('1', 'LZ <1>', None, icon, Point(-105.0, 39.0), 'landingsite',
+                 {'osm_id': '1', 'name': 'LZ <1>', 'emergency': 'landing_site', 'ref': None})
+subset.endFolder()
+doc.include(subset)
+doc.folder('Roads')
+for i in range(0, 10):
+    # A new Style for every road, like MapStyle makes
+    color = 'ff0000ff' if i % 2 == 0 else 'ffff0000'
+    style = styles.Style(styles=[styles.LineStyle(color=color, width=3.0)])
+    data = {'osm_id': str(i + 2), 'highway': 'track', 'surface': ''}
+    if i == 3:
+        data['surface'] = 'dirt & rocks'
+    doc.placemark(str(i + 2), 'road %d' % i, None, style,
+                  LineString([(-105.0, 39.0 + i), (-105.1, 39.0 + i)]), 'roads', data)
+doc.footer()
+
+try:
+    root = ET.parse(filespec).getroot()
+    dj.passes("kmlWriter(parse)")
+except ET.ParseError as inst:
+    root = None
+    dj.fails("kmlWriter(parse)")
+    dj.verbose("\t%r" % inst)
+
+if root is not None:
+    document = root.find(ns + 'Document')
+    shared = document.findall(ns + 'Style')
+    if len(shared) == 3 and document.find(ns + 'name').text == "Test & Map":
+        dj.passes("kmlWriter(shared styles)")
+    else:
+        dj.fails("kmlWriter(shared styles)")
+        dj.verbose("\tGot %d styles, expected 3" % len(shared))
+
+    ids = set(['#' + style.get('id') for style in shared])
+    placemarks = list(document.iter(ns + 'Placemark'))
+    urls = [placemark.find(ns + 'styleUrl').text for placemark in placemarks]
+    if len(placemarks) == 11 and set(urls) == ids and placemarks[0].find(ns + 'Style') is None:
+        dj.passes("kmlWriter(styleUrl)")
+    else:
+        dj.fails("kmlWriter(styleUrl)")
+
+    schemas = dict()
+    for schema in document.findall(ns + 'Schema'):
+        schemas[schema.get('id')] = [field.get('name') for field in schema.findall(ns + 'SimpleField')]
+    if schemas == {'landingsite': ['emergency'], 'roads': ['highway', 'surface']}:
+        dj.passes("kmlWriter(Schema)")
+    else:
+        dj.fails("kmlWriter(Schema)")
+        dj.verbose("\tGot %r" % schemas)
+
+    # Only the fields that aren't empty are in each Placemark
+    data = list()
+    for placemark in placemarks:
+        data.append(dict([(field.get('name'), field.text) for field in placemark.iter(ns + 'SimpleData')]))
+    if data[0] == {'emergency': 'landing_site'} and data[1] == {'highway': 'track'} \
+       and data[4] == {'highway': 'track', 'surface': 'dirt & rocks'} \
+       and placemarks[4].find(ns + 'ExtendedData/' + ns + 'SchemaData').get('schemaUrl') == '#roads':
+        dj.passes("kmlWriter(SchemaData)")
+    else:
+        dj.fails("kmlWriter(SchemaData)")
+        dj.verbose("\tGot %r" % data)
+
+if doc.styles.size() == 3 and doc.styles.saved() > 0 and doc.placemarks == 11:
+    dj.passes("kmlWriter(statistics)")
+else:
+    dj.fails("kmlWriter(statistics)")
+    dj.verbose("\t%d styles, saved %d bytes" % (doc.styles.size(), doc.styles.saved()))
+
+os.remove(filespec)
+os.rmdir(tmpdir)
+
+# All done
+if __name__ == '__main__':
+    dj.totals()
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Write a KML file that uses two icons with the same contents, and
+# check the KMZ file has the KML file first, compressed, and only one
+# copy of the icon.
+
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+from fastkml import styles
+from shapely.geometry import Point
+from sys import argv
+sys.path.append(os.path.abspath(os.path.dirname(argv[0]) + '/../osmpylib'))
+from kmlwriter import kmlWriter
+from kmz import iconTable, packageAll
+import dejagnu
+
+dj = dejagnu.dejagnu()
+dj.verbose_level(2)
+
+# The icons are relative to where osm2kml runs
+tmpdir = tempfile.mkdtemp()
+os.chdir(tmpdir)
+os.mkdir("icons")
+for icon, data in (("one.png", b'first icon'), ("two.png", b'other icon'), ("copy.png", b'first icon')):
+    with open(os.path.join("icons", icon), 'wb') as file:
+        file.write(data)
+
+icons = iconTable()
+filespec = "test.kml"
+doc = kmlWriter(filespec, icons=icons)
+doc.header("Test", 'doc description')
+for i in range(0, 300):
+    icon = ("icons/one.png", "icons/two.png", "icons/copy.png")[i % 3]
+    style = styles.Style(styles=[styles.IconStyle(icon_href=icon)])
+    doc.placemark(str(i), 'point %d' % i, None, style, Point(-105.0, 39.0 + i * 0.001))
+doc.footer()
+
+if icons.duplicates == 1 and doc.styles.size() == 2 \
+   and doc.styles.iconFiles() == set(["icons/one.png", "icons/two.png"]):
+    dj.passes("iconTable(duplicates)")
+else:
+    dj.fails("iconTable(duplicates)")
+    dj.verbose("\tGot %r" % doc.styles.iconFiles())
+
+# With more than one file, each one is packaged in another process
+shutil.copy(filespec, "other.kml")
+jobs = [(filespec, doc.styles.iconFiles(), 9), ("other.kml", set(), 1)]
+results = packageAll(jobs)
+if [result[0] for result in results] == ["test.kmz", "other.kmz"] \
+   and zipfile.ZipFile("other.kmz").namelist() == ["other.kml"]:
+    dj.passes("packageAll(processes)")
+else:
+    dj.fails("packageAll(processes)")
+kmz = zipfile.ZipFile("test.kmz")
+entries = kmz.infolist()
+if [entry.filename for entry in entries] == ["test.kml", "icons/one.png", "icons/two.png"]:
+    dj.passes("package(entries)")
+else:
+    dj.fails("package(entries)")
+    dj.verbose("\tGot %r" % [entry.filename for entry in entries])
+
+if entries[0].compress_type == zipfile.ZIP_DEFLATED and entries[0].compress_size * 4 < entries[0].file_size \
+   and kmz.read("test.kml") == open(filespec, 'rb').read() and "icons/copy.png" not in kmz.read("test.kml").decode():
+    dj.passes("package(deflate)")
+else:
+    dj.fails("package(deflate)")
+kmz.close()
+
+os.chdir("/")
+shutil.rmtree(tmpdir)
+
+# All done
+if __name__ == '__main__':
+    dj.totals()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Write a wiggly road, a straight road, and a point with level of
+# detail, and check each tier that's different has a Placemark with a
+# Region, and the coordinates are rounded.
+
+import os
+import sys
+import math
+import tempfile
+import xml.etree.ElementTree as ET
+from fastkml import styles
+from shapely.geometry import Point, LineString
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+from kmlwriter import kmlWriter
+from lod import levelOfDetail
+import dejagnu
+
+dj = dejagnu.dejagnu()
+dj.verbose_level(2)
+
+ns = '{http://www.opengis.net/kml/2.2}'
+tmpdir = tempfile.mkdtemp()
+filespec = os.path.join(tmpdir, "test.kml")
+
+# The wiggles are bigger than the first tolerance, but smaller than
+# the second one
+lod = levelOfDetail(tiers=((0.0, 256), (0.0001, 64), (0.001, 8)), precision=5)
+style = styles.Style(styles=[styles.LineStyle(color='ff0000ff', width=3.0)])
+doc = kmlWriter(filespec, lod=lod)
+doc.header("Test", 'doc description')
+doc.folder("Roads")
+wiggly = LineString([(-105.0 + i * 0.0002, 39.0 + 0.0005 * math.sin(i / 4.0)) for i in range(0, 200)])
+doc.placemark('1', 'wiggly', None, style, wiggly, 'roads', {'highway': 'track'})
+doc.placemark('2', 'straight', None, style, LineString([(-105.0, 39.1), (-104.9, 39.1)]), 'roads', {})
+doc.placemark('3', 'point', None, None, Point(-105.123456789, 39.987654321), 'milestones', {})
+doc.endFolder()
+doc.footer()
+
+root = ET.parse(filespec).getroot()
+placemarks = dict()
+for placemark in root.iter(ns + 'Placemark'):
+    lods = placemark.find(ns + 'Region/' + ns + 'Lod')
+    if lods is not None:
+        lods = (int(lods.find(ns + 'minLodPixels').text), int(lods.find(ns + 'maxLodPixels').text))
+    coords = placemark.find('.//' + ns + 'coordinates').text.split(' ')
+    placemarks[placemark.get('id')] = (lods, coords)
+
+if sorted(placemarks.keys()) == ['1', '1-1', '1-2', '2', '3'] and doc.placemarks == 3:
+    dj.passes("kmlWriter(lod placemarks)")
+else:
+    dj.fails("kmlWriter(lod placemarks)")
+    dj.verbose("\tGot %r" % sorted(placemarks.keys()))
+
+if placemarks['1'][0] == (256, -1) and placemarks['1-1'][0] == (64, 256) and placemarks['1-2'][0] == (8, 64) \
+   and placemarks['2'][0] == (8, -1) and placemarks['3'][0] is None:
+    dj.passes("kmlWriter(lod regions)")
+else:
+    dj.fails("kmlWriter(lod regions)")
+
+if len(placemarks['1'][1]) == 200 and len(placemarks['1'][1]) > len(placemarks['1-1'][1]) > len(placemarks['1-2'][1]) \
+   and placemarks['3'][1] == ['-105.12346,39.98765']:
+    dj.passes("kmlWriter(lod simplify)")
+else:
+    dj.fails("kmlWriter(lod simplify)")
+
+roads = lod.vertices['roads']
+if roads[0] == 202 and roads[1] == 202 and roads[2] < roads[1] and roads[3] < roads[2] and 'milestones' not in lod.vertices:
+    dj.passes("levelOfDetail(vertices)")
+else:
+    dj.fails("levelOfDetail(vertices)")
+    dj.verbose("\tGot %r" % lod.vertices)
+
+os.remove(filespec)
+os.rmdir(tmpdir)
+
+# All done
+if __name__ == '__main__':
+    dj.totals()
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Write the same nodes, ways, and relations through osmfile as XML and
+# as PBF, read both back with pyosmium, and check they're the same, and
+# have the right IDs, locations, tags, refs, and members. The blocks
+# are small, so the deltas have to restart in each one.
+
+import os
+import sys
+import shutil
+import tempfile
+import osmium
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+import osm
+import dejagnu
+
+dj = dejagnu.dejagnu()
+dj.verbose_level(2)
+
+
+class options(object):
+    """The few options osmfile needs"""
+    def __init__(self, convfile):
+        self.options = dict()
+        self.options['convfile'] = convfile
+
+    def get(self, opt):
+        try:
+            return self.options[opt]
+        except Exception as inst:
+            return False
+
+
+class reader(osmium.SimpleHandler):
+    """Collect everything in a file"""
+    def __init__(self):
+        super(reader, self).__init__()
+        self.nodes = dict()
+        self.ways = dict()
+        self.relations = dict()
+
+    def node(self, n):
+        self.nodes[n.id] = (round(n.location.lat, 7), round(n.location.lon, 7),
+                            dict([(tag.k, tag.v) for tag in n.tags]))
+
+    def way(self, w):
+        self.ways[w.id] = ([nd.ref for nd in w.nodes], dict([(tag.k, tag.v) for tag in w.tags]))
+
+    def relation(self, r):
+        self.relations[r.id] = ([(m.type, m.ref, m.role) for m in r.members],
+                                dict([(tag.k, tag.v) for tag in r.tags]))
+
+
+def write(filespec):
+    out = osm.osmfile(opts, filespec)
+    if filespec.endswith('.pbf'):
+        out.file.blocksize = 4
+    out.header()
+    # Nodes go both ways from the first one, so the deltas are negative
+    # and positive.
+    for osmid, lat, lon, tags in nodes:
+        out.writeNode(tags, {'id': str(osmid), 'lat': lat, 'lon': lon})
+    for osmid, refs, tags in ways:
+        out.makeWay(refs, tags, {'id': str(osmid)})
+    for osmid, members, tags in relations:
+        mems = list()
+        for type, ref, role in members:
+            mems += [{'type': type}, {'ref': str(ref)}, {'role': role}]
+        out.makeRelation(mems, tags, {'id': str(osmid)})
+    out.footer()
+    data = reader()
+    data.apply_file(filespec)
+    return data
+
+
+nodes = [(-1, '39.1234567', '-105.7654321', [{'amenity': 'hot_spring'}, {'note': 'wet & warm'}]),
+         (-2, '39.1234500', '-105.7654400', list()),
+         (-3, '38.0000001', '-104.9999999', [{'ref': '12'}]),
+         (-4, '-33.8688197', '151.2092955', list()),
+         (-10, '0.0', '0.0', [{'amenity': 'hot_spring'}]),
+         (-5, '39.2', '-105.8', list())]
+ways = [(-100, [-1, -2, -3], [{'highway': 'track'}, {'surface': 'dirt'}]),
+        (-101, [-5, -4, -1, -5], [{'highway': 'track'}]),
+        (-102, [-3, -10], list())]
+relations = [(-200, [('way', -100, 'outer'), ('node', -3, 'label'), ('way', -101, 'inner')],
+              [{'type': 'multipolygon'}]),
+             (-201, [('relation', -200, ''), ('node', -10, 'admin_centre'), ('way', -102, '')],
+              [{'type': 'route'}, {'route': 'hiking'}])]
+
+convfile = os.path.join(os.path.dirname(argv[0]), '..', 'default.conv')
+opts = options(convfile)
+tmpdir = tempfile.mkdtemp()
+xml = write(os.path.join(tmpdir, "test.osm"))
+pbf = write(os.path.join(tmpdir, "test.pbf"))
+
+expected = dict([(osmid, (round(float(lat), 7), round(float(lon), 7))) for osmid, lat, lon, tags in nodes])
+locations = dict([(osmid, node[:2]) for osmid, node in pbf.nodes.items()])
+if locations == expected:
+    dj.passes("pbfWriter(node locations)")
+else:
+    dj.fails("pbfWriter(node locations)")
+    dj.verbose("\tGot %r" % locations)
+
+if pbf.nodes == xml.nodes and pbf.nodes[-1][2].get('note') == 'wet and warm' and pbf.nodes[-2][2] == dict():
+    dj.passes("pbfWriter(node tags)")
+else:
+    dj.fails("pbfWriter(node tags)")
+    dj.verbose("\tGot %r" % pbf.nodes)
+
+if pbf.ways == xml.ways and [pbf.ways[osmid][0] for osmid in (-100, -101, -102)] \
+   == [[-1, -2, -3], [-5, -4, -1, -5], [-3, -10]]:
+    dj.passes("pbfWriter(way refs)")
+else:
+    dj.fails("pbfWriter(way refs)")
+    dj.verbose("\tGot %r" % pbf.ways)
+
+if pbf.relations == xml.relations \
+   and pbf.relations[-200][0] == [('w', -100, 'outer'), ('n', -3, 'label'), ('w', -101, 'inner')] \
+   and pbf.relations[-201][0] == [('r', -200, ''), ('n', -10, 'admin_centre'), ('w', -102, '')] \
+   and pbf.relations[-201][1] == {'type': 'route', 'route': 'hiking'}:
+    dj.passes("pbfWriter(relation members)")
+else:
+    dj.fails("pbfWriter(relation members)")
+    dj.verbose("\tGot %r" % pbf.relations)
+
+shutil.rmtree(tmpdir)
+
+# All done
+if __name__ == '__main__':
+    dj.totals()
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Test the query result cache without a database
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+from querycache import queryCache
+import dejagnu
+
+dj = dejagnu.dejagnu()
+dj.verbose_level(2)
+
+tmpdir = tempfile.mkdtemp()
+cache = queryCache(tmpdir, 4096)
+names = ('osm_id', 'name', 'wkb_geometry')
+
+# A result in two batches, with a bytea column
+key = cache.key('localhost', 'test', 'stamp1', "SELECT * FROM points", None)
+writer = cache.writer(key, names)
+writer.add([(1, 'Forest Road 123', memoryview(b'\x01\x02'))])
+writer.add([(2, None, memoryview(b'\x03\x04'))])
+writer.commit()
+found = cache.get(key)
+if found is not None and found[0] == names:
+    batches = list(found[1])
+    dj.matches(batches, [[(1, 'Forest Road 123', b'\x01\x02')], [(2, None, b'\x03\x04')]], "queryCache.get()")
+else:
+    dj.fails("queryCache.get()")
+
+# A new import makes a different key
+other = cache.key('localhost', 'test', 'stamp2', "SELECT * FROM points", None)
+dj.matches(cache.get(other), None, "queryCache.get(generation)")
+
+# A query that wasn't finished isn't cached
+writer = cache.writer(other, names)
+writer.add([(3, 'partial', None)])
+writer.abort()
+dj.matches((cache.get(other), os.listdir(tmpdir)), (None, [key + ".pickle"]), "queryCache.writer(abort)")
+
+# The oldest result goes first when the cache is too big
+keys = list()
+for i in range(0, 4):
+    keys.append(cache.key('localhost', 'test', 'stamp1', "SELECT %d" % i, None))
+    writer = cache.writer(keys[-1], names)
+    writer.add([(i, 'x' * 1000, None)])
+    writer.commit()
+    # So the modification times are different
+    os.utime(cache.filespec(keys[-1]), (time.time() + i, time.time() + i))
+found = [k for k in [key] + keys if os.path.exists(cache.filespec(k))]
+if key not in found and keys[-1] in found:
+    dj.passes("queryCache.evict()")
+else:
+    dj.fails("queryCache.evict()")
+
+shutil.rmtree(tmpdir)
+
+# The size is scanned once at the start, and the directory is only
+# scanned again when a write goes over the limit.
+tmpdir = tempfile.mkdtemp()
+cache = queryCache(tmpdir, 4096)
+writer = cache.writer(key, names)
+writer.add([(1, 'x' * 1000, None)])
+writer.commit()
+cache = queryCache(tmpdir, 4096)
+scans = list()
+scan = cache.scan
+cache.scan = lambda: scans.append(True) or scan()
+for i in range(0, 2):
+    writer = cache.writer(keys[i], names)
+    writer.add([(i, 'x' * 1000, None)])
+    writer.commit()
+total = sum([os.path.getsize(os.path.join(tmpdir, name)) for name in os.listdir(tmpdir)])
+dj.matches((cache.size, len(scans)), (total, 0), "queryCache.added()")
+for i in range(2, 4):
+    writer = cache.writer(keys[i], names)
+    writer.add([(i, 'x' * 1000, None)])
+    writer.commit()
+total = sum([os.path.getsize(os.path.join(tmpdir, name)) for name in os.listdir(tmpdir)])
+if len(scans) > 0 and cache.size == total and total <= 4096:
+    dj.passes("queryCache.added(evict)")
+else:
+    dj.fails("queryCache.added(evict)")
+    dj.verbose("\tGot %d bytes of %d after %d scans" % (cache.size, total, len(scans)))
+
+# The statistics are kept by the worker threads
+cache.lookups = cache.hits = 0
+with ThreadPoolExecutor(max_workers=8) as executor:
+    list(executor.map(lambda i: cache.get(keys[-1] if i % 2 else other), range(0, 4000)))
+dj.matches((cache.lookups, cache.hits, cache.ratio()), (4000, 2000, 0.5), "queryCache.get(threads)")
+shutil.rmtree(tmpdir)
+
+# All done
+if __name__ == '__main__':
+    dj.totals()
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Convert the same shapefile with one process and with several, and
+# check the output is the same other than the IDs and the order.
+
+import os
+import sys
+import shutil
+import tempfile
+import shapefile
+import xml.etree.ElementTree as ET
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+import osm
+import shp
+import dejagnu
+
+dj = dejagnu.dejagnu()
+dj.verbose_level(2)
+
+
+class options(object):
+    """The few options makeOSM() needs"""
+    def __init__(self, convfile):
+        self.options = dict()
+        self.options['filter'] = ''
+        self.options['extra'] = ''
+        self.options['type'] = 'line'
+        self.options['format'] = 'osm'
+        self.options['convfile'] = convfile
+
+    def get(self, opt):
+        try:
+            return self.options[opt]
+        except Exception as inst:
+            return False
+
+
+def contents(filespec):
+    """Get the ways and tagged nodes in an OSM file, using locations
+    instead of IDs"""
+    nodes = dict()
+    tagged = list()
+    ways = list()
+    for elem in ET.parse(filespec).getroot():
+        tags = tuple(sorted([(tag.get('k'), tag.get('v')) for tag in elem.iter('tag')]))
+        if elem.tag == 'node':
+            nodes[elem.get('id')] = (elem.get('lat'), elem.get('lon'))
+            if len(tags) > 0:
+                tagged.append((nodes[elem.get('id')], tags))
+        elif elem.tag == 'way':
+            refs = tuple([nodes[nd.get('ref')] for nd in elem.iter('nd')])
+            ways.append((refs, tags))
+    return len(nodes), sorted(tagged), sorted(ways)
+
+
+tmpdir = tempfile.mkdtemp()
+infile = os.path.join(tmpdir, "roads")
+
+# A chain of roads, each one starts where the last one ended, so there
+# are shared vertices inside each slice and between them.
+sf = shapefile.Writer(infile, shapeType=shapefile.POLYLINE)
+sf.field('NAME', 'C')
+sf.field('SURFACE', 'C')
+for i in range(0, 10):
+    lon = -105.0 + i * 0.01
+    sf.line([[[lon, 39.0], [lon + 0.005, 39.002], [lon + 0.01, 39.0]]])
+    sf.record('forest rd %d' % (i % 3), 'dirt')
+sf.close()
+
+convfile = os.path.join(os.path.dirname(argv[0]), '..', 'default.conv')
+opts = options(convfile)
+serial = os.path.join(tmpdir, "serial.osm")
+parallel = os.path.join(tmpdir, "parallel.osm")
+
+reader = shp.shpfile(opts)
+reader.open(infile)
+reader.makeOSM(osm.osmfile(opts, serial))
+
+reader = shp.shpfile(opts)
+reader.open(infile)
+reader.makeOSMJobs(osm.osmfile(opts, parallel), 3)
+
+one = contents(serial)
+many = contents(parallel)
+if one[0] == many[0] and one[0] == 21:
+    dj.passes("shp.makeOSMJobs(nodes)")
+else:
+    dj.fails("shp.makeOSMJobs(nodes)")
+    dj.verbose("\tGot %d nodes, expected %d" % (many[0], one[0]))
+
+if one[1] == many[1]:
+    dj.passes("shp.makeOSMJobs(tagged nodes)")
+else:
+    dj.fails("shp.makeOSMJobs(tagged nodes)")
+
+if one[2] == many[2] and len(one[2]) == 10:
+    dj.passes("shp.makeOSMJobs(ways)")
+else:
+    dj.fails("shp.makeOSMJobs(ways)")
+
+shutil.rmtree(tmpdir)
+
+# All done
+if __name__ == '__main__':
+    dj.totals()
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Test decoding rows, and the statistics for queries, without a database
+
+import os
+import sys
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+import sql
+from querystats import queryStats
+import dejagnu
+
+dj = dejagnu.dejagnu()
+dj.verbose_level(2)
+
+# other_tags as text, with a comma and quotes in the values
+tags = sql.hstore('"surface"=>"dirt, gravel","note"=>"a \\"big\\" hill","fixme"=>NULL')
+dj.matches(tags.get('surface'), "dirt, gravel", "sql.hstore(comma)")
+dj.matches(tags.get('note'), 'a "big" hill', "sql.hstore(quote)")
+dj.matches(tags.get('fixme', False), None, "sql.hstore(NULL)")
+
+layout = ({'osm_id': 0, 'name': 1}, 2, list())
+row = sql.Row(layout[0], ['123', None, None], tags)
+dj.matches(row['name'], None, "sql.Row(NULL)")
+dj.matches(row['surface'], "dirt, gravel", "sql.Row(tag)")
+row['name'] = "Unknown"
+row['ref'] = "FS 123"
+dj.matches((row['name'], 'ref' in row, 'highway' in row), ("Unknown", True, False), "sql.Row(set)")
+
+
+
+class column(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class cursor(object):
+    """Just enough of a psycopg2 cursor to run a query"""
+    def __init__(self, results, name=None, withhold=False):
+        self.results = results
+        self.name = name
+        self.withhold = withhold
+        self.description = None
+        self.lines = None
+        self.itersize = 0
+
+    def execute(self, query, params=None):
+        queries.append(query)
+        names, self.lines = self.results(query)
+        self.description = [column(name) for name in names]
+
+    def fetchall(self):
+        return self.lines
+
+    def fetchmany(self, size):
+        lines = self.lines[:size]
+        self.lines = self.lines[size:]
+        return lines
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class connection(object):
+    closed = 0
+
+    def __init__(self, results):
+        self.results = results
+        self.autocommit = True
+        self.cursors = list()
+        self.ended = list()
+
+    def cursor(self, name=None, withhold=False):
+        self.cursors.append((name, withhold, self.autocommit))
+        return cursor(self.results, name, withhold)
+
+    def commit(self):
+        self.ended.append('commit')
+
+    def rollback(self):
+        self.ended.append('rollback')
+
+
+queries = list()
+
+
+def results(query):
+    if query.startswith("EXPLAIN"):
+        return ('QUERY PLAN', ), [('Seq Scan on points', ), ('Execution Time: 1.0 ms', )]
+    return ('osm_id', 'name'), [('1', 'Denver'), ('2', 'Boulder')]
+
+
+# A threshold of 0 makes every query slow, so the first one is
+# explained, which shouldn't change what it returns.
+post = sql.Postgis('test', stats=queryStats(0))
+post.dbshell = connection(results)
+post.dbcursor = post.dbshell.cursor()
+places = post.query("SELECT osm_id,name FROM points", name='places')
+dj.matches([(place['osm_id'], place['name']) for place in places], [('1', 'Denver'), ('2', 'Boulder')],
+           "sql.query(slow columns)")
+entry = post.stats.queries['places']
+dj.matches((entry['calls'], entry['rows'], entry['plan']),
+           (1, 2, 'Seq Scan on points\nExecution Time: 1.0 ms'), "sql.query(slow plan)")
+
+# Streamed rows come from a named cursor without WITH HOLD, in a
+# transaction that is committed at the end, or rolled back if the
+# rows aren't all used.
+post = sql.Postgis('test')
+post.dbshell = connection(results)
+post.dbcursor = post.dbshell.cursor()
+places = [(place['osm_id'], place['name']) for place in post.iterquery("SELECT osm_id,name FROM points", 1)]
+dj.matches(places, [('1', 'Denver'), ('2', 'Boulder')], "sql.iterquery(rows)")
+dj.matches((post.dbshell.cursors[-1], post.dbshell.ended, post.dbshell.autocommit),
+           (('iterquery1', False, False), ['commit'], True), "sql.iterquery(transaction)")
+rows = post.iterquery("SELECT osm_id,name FROM points", 1)
+next(rows)
+rows.close()
+dj.matches((post.dbshell.ended, post.dbshell.autocommit), (['commit', 'rollback'], True),
+           "sql.iterquery(abandoned)")
+list(post.iterquery("SELECT osm_id,name FROM points", 1, withhold=True))
+dj.matches((post.dbshell.cursors[-1], post.dbshell.ended), (('iterquery3', True, True), ['commit', 'rollback']),
+           "sql.iterquery(withhold)")
+
+
+# The view for hot springs filters on natural, which is a reserved
+# word, so it has to be quoted.
+def tables(query):
+    if query.startswith("SELECT column_name"):
+        return ('column_name', ), [(name, ) for name in ('osm_id', 'name', 'natural', 'amenity', 'description',
+                                                         'emergency', 'ref', 'aeroway', 'highway', 'other_tags')]
+    return (), []
+
+
+queries = list()
+post = sql.Postgis('test')
+post.dbshell = connection(tables)
+post.dbcursor = post.dbshell.cursor()
+post.updateViews()
+view = [query for query in queries if query.startswith("CREATE MATERIALIZED VIEW subset_hotsprings")]
+if len(view) == 1 and '"natural" AS "natural"' in view[0] and '"natural"=\'hot_spring\'' in view[0] \
+   and "(other_tags::hstore->'bath:type') AS \"bath_type\"" in view[0]:
+    dj.passes("sql.updateViews(reserved words)")
+else:
+    dj.fails("sql.updateViews(reserved words)")
+    dj.verbose("\tGot %r" % view)
+
+# All done
+if __name__ == '__main__':
+    dj.totals()
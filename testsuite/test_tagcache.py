@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+#
+#   Copyright (C) 2020   Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Convert the same tags more than once with a tiny tag cache, so some
+# come from the cache and some are evicted, and check the counters,
+# and that addresses come out the same either way.
+
+import os
+import sys
+import shutil
+import tempfile
+from sys import argv
+sys.path.append(os.path.dirname(argv[0]) + '/../osmpylib')
+import osm
+import dejagnu
+
+dj = dejagnu.dejagnu()
+dj.verbose_level(2)
+
+
+class options(object):
+    """The few options osmfile needs"""
+    def __init__(self, convfile):
+        self.options = dict()
+        self.options['convfile'] = convfile
+        self.options['tagcache'] = 2
+
+    def get(self, opt):
+        try:
+            return self.options[opt]
+        except Exception as inst:
+            return False
+
+
+convfile = os.path.join(os.path.dirname(argv[0]), '..', 'coaddrs.conv')
+tmpdir = tempfile.mkdtemp()
+out = osm.osmfile(options(convfile), os.path.join(tmpdir, "test.osm"))
+
+full = ('AddrFull', '123 Main St Unit 4')
+number = ('AddrNum', '123')
+street = ('StreetName', 'Main St')
+
+# With room for 2, this is a miss, a hit, 2 misses that evict the
+# full address, a miss that evicts the number, and a hit.
+tags = list()
+for field, value in (full, full, number, street, full, street):
+    tags.append(out.makeTag(field, value))
+
+if (out.hits, out.misses, out.evictions) == (2, 4, 2) and len(out.tagcache) == 2:
+    dj.passes("osmfile.makeTag(cache counters)")
+else:
+    dj.fails("osmfile.makeTag(cache counters)")
+    dj.verbose("\tGot %d hits, %d misses, %d evictions" % (out.hits, out.misses, out.evictions))
+
+# The full address is split the same way whether it was just
+# translated, came from the cache, or was translated again.
+if tags[0] == tags[1] == tags[4] == {'add:street': 'Main St'} and out.num == '123' \
+   and tags[2] == {'addr:housenumber': '123'} and tags[3] == tags[5] == {'addr:street': 'Main St'}:
+    dj.passes("osmfile.makeTag(addr:full)")
+else:
+    dj.fails("osmfile.makeTag(addr:full)")
+    dj.verbose("\tGot %r" % tags)
+
+# The cache has the translation, not the value it was changed to
+if out.tagcache.get(full) == ('addr:full', '123 Main St Unit 4') and out.full is None:
+    dj.passes("osmfile.makeTag(cached translation)")
+else:
+    dj.fails("osmfile.makeTag(cached translation)")
+    dj.verbose("\tGot %r" % out.tagcache.get(full))
+
+out.file.close()
+shutil.rmtree(tmpdir)
+
+# All done
+if __name__ == '__main__':
+    dj.totals()